@@ -0,0 +1,62 @@
+import traceback
+from pathlib import Path
+
+
+def _chunking_backend_notice():
+    from epub_sum_lib import chunking
+
+    is_available, reason = chunking.get_semantic_chunking_status()
+    if is_available:
+        return None
+
+    return (
+        "Semantic chunking dependencies are unavailable "
+        f"({reason}); using sentence-based fallback."
+    )
+
+
+def _iter_ebook_chunks(ebook_path):
+    if Path(ebook_path).suffix.lower() == ".pdf":
+        from epub_sum_lib import pdf_util
+
+        return pdf_util.iter_pdf_chunks(ebook_path)
+
+    from epub_sum_lib import epub_util
+
+    # `workers=1`: this process is already off the event loop, and the pool
+    # size is bounded by `uniborg.chunk_worker.CHUNK_WORKER_MAX_JOBS` instead.
+    return epub_util.iter_epub_chunks(ebook_path, workers=1)
+
+
+def _run_chunk_job(conn, ebook_path, output_dir, book_name):
+    notice = _chunking_backend_notice()
+    if notice:
+        conn.send(("notice", notice))
+
+    chunk_count = 0
+    for chunk in _iter_ebook_chunks(ebook_path):
+        chunk_count += 1
+        chunk_path = Path(output_dir) / f"{book_name}_part_{chunk_count:03d}.txt"
+        chunk_path.write_text(chunk, encoding="utf-8")
+        conn.send(("progress", chunk_count))
+    conn.send(("done", chunk_count))
+
+
+def run_chunk_worker(conn):
+    """Runs chunking jobs sent over `conn` until it is closed.
+
+    The process is long-lived so the semantic chunking model, once loaded, stays
+    warm between jobs. This module lives outside `uniborg` so that spawning a
+    worker does not import the bot.
+    """
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+
+        try:
+            _run_chunk_job(conn, **job)
+        except Exception as e:
+            traceback.print_exc()
+            conn.send(("error", f"{type(e).__name__}: {e}"))
@@ -1,7 +1,9 @@
 import csv
+import hashlib
 import logging
 import os
 import re
+from collections import OrderedDict
 from pathlib import Path
 import sys
 
@@ -38,9 +40,25 @@ def preprocess_text(text):
 
 
 MODEL_NAME = "all-MiniLM-L6-v2"
+# "torch": sentence-transformers on PyTorch.
+# "onnx": the same model, int8-quantized, on ONNX Runtime without importing torch.
+SEMANTIC_BACKEND = os.environ.get("BORG_SEMANTIC_BACKEND", "torch").lower()
+ONNX_MODEL_FILE = os.environ.get(
+    "BORG_SEMANTIC_ONNX_FILE", "onnx/model_quint8_avx2.onnx"
+)
+ONNX_MAX_SEQ_LENGTH = 256
+SEMANTIC_BATCH_SIZE = int(os.environ.get("BORG_SEMANTIC_BATCH_SIZE", "64"))
+SEMANTIC_THREADS = int(os.environ.get("BORG_SEMANTIC_THREADS", "0"))  # 0: torch default
+EMBEDDING_CACHE_MAX_ENTRIES = int(
+    os.environ.get("BORG_SEMANTIC_CACHE_ENTRIES", "50000")
+)
+# `--parity` fails when a backend moves a boundary further than this, or when
+# fewer than this share of the boundaries match exactly.
+PARITY_MAX_DRIFT_CHARS = 2000
+PARITY_MIN_EXACT_RATIO = 0.9
 _model = None
-_sentence_transformer_cls = None
-_sentence_transformers_util = None
+_embedding_cache = OrderedDict()
+_semantic_model_factory = None
 _semantic_backend_error = None
 _semantic_backend_warning_emitted = False
 
@@ -68,46 +86,209 @@ def _remember_semantic_backend_failure(exc):
     return _semantic_backend_error
 
 
+class OnnxSentenceEncoder:
+    """
+    Sentence encoder running a sentence-transformers model on ONNX Runtime.
+
+    Implements the subset of `SentenceTransformer.encode` used by
+    `encode_sentences` (mean pooling, optional L2 normalization). `model_name`
+    is either a local directory or a Hugging Face repo (bare names resolve under
+    `sentence-transformers/`); `ONNX_MODEL_FILE` selects the ONNX export.
+    """
+
+    def __init__(self, model_name):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        if os.path.isdir(model_name):
+            model_path = os.path.join(model_name, ONNX_MODEL_FILE)
+            tokenizer_path = os.path.join(model_name, "tokenizer.json")
+        else:
+            from huggingface_hub import hf_hub_download
+
+            repo_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+            model_path = hf_hub_download(repo_id, ONNX_MODEL_FILE)
+            tokenizer_path = hf_hub_download(repo_id, "tokenizer.json")
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=ONNX_MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        if SEMANTIC_THREADS > 0:
+            options.intra_op_num_threads = SEMANTIC_THREADS
+        self.session = onnxruntime.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def encode(
+        self,
+        sentences,
+        *,
+        batch_size=32,
+        convert_to_numpy=True,
+        normalize_embeddings=False,
+    ):
+        import numpy as np
+
+        # Batch similar lengths together to minimize padding, like sentence-transformers.
+        order = sorted(range(len(sentences)), key=lambda i: -len(sentences[i]))
+        embeddings = [None] * len(sentences)
+        for start in range(0, len(order), batch_size):
+            batch_indices = order[start : start + batch_size]
+            encodings = self.tokenizer.encode_batch(
+                [sentences[i] for i in batch_indices]
+            )
+            attention_mask = np.array(
+                [encoding.attention_mask for encoding in encodings], dtype=np.int64
+            )
+            feeds = {
+                "input_ids": np.array(
+                    [encoding.ids for encoding in encodings], dtype=np.int64
+                ),
+                "attention_mask": attention_mask,
+            }
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.array(
+                    [encoding.type_ids for encoding in encodings], dtype=np.int64
+                )
+
+            token_embeddings = self.session.run(None, feeds)[0]
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(
+                mask.sum(axis=1), 1e-9, None
+            )
+            for i, embedding in zip(batch_indices, pooled):
+                embeddings[i] = embedding
+
+        embeddings = (
+            np.stack(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+        )
+        if normalize_embeddings and len(embeddings):
+            embeddings /= np.clip(
+                np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None
+            )
+        return embeddings
+
+
 def _load_semantic_backend():
-    global _sentence_transformer_cls
-    global _sentence_transformers_util
+    global _semantic_model_factory
 
     if _semantic_backend_error is not None:
         raise _semantic_backend_error
 
-    if _sentence_transformer_cls is not None and _sentence_transformers_util is not None:
-        return _sentence_transformer_cls, _sentence_transformers_util
+    if _semantic_model_factory is not None:
+        return _semantic_model_factory
 
     try:
-        from sentence_transformers import SentenceTransformer, util
+        if SEMANTIC_BACKEND == "torch":
+            from sentence_transformers import SentenceTransformer
+
+            model_factory = SentenceTransformer
+        elif SEMANTIC_BACKEND == "onnx":
+            import onnxruntime  # noqa: F401
+            import tokenizers  # noqa: F401
+
+            model_factory = OnnxSentenceEncoder
+        else:
+            raise ValueError(f"Unknown BORG_SEMANTIC_BACKEND: {SEMANTIC_BACKEND!r}")
     except Exception as exc:
         raise _remember_semantic_backend_failure(exc) from exc
 
-    _sentence_transformer_cls = SentenceTransformer
-    _sentence_transformers_util = util
-    return _sentence_transformer_cls, _sentence_transformers_util
+    _semantic_model_factory = model_factory
+    return _semantic_model_factory
 
 
 def get_model():
     global _model
     if _model is None:
-        sentence_transformer_cls, _ = _load_semantic_backend()
+        model_factory = _load_semantic_backend()
         setup_transformer_cache()  # Set up cache before loading model
         try:
-            _model = sentence_transformer_cls(MODEL_NAME)
+            if SEMANTIC_THREADS > 0 and SEMANTIC_BACKEND == "torch":
+                import torch
+
+                torch.set_num_threads(SEMANTIC_THREADS)
+            _model = model_factory(MODEL_NAME)
         except Exception as exc:
             raise _remember_semantic_backend_failure(exc) from exc
     return _model
 
 
+def set_semantic_backend(backend):
+    """Switches `SEMANTIC_BACKEND` at runtime, dropping the loaded model and cache."""
+    global SEMANTIC_BACKEND
+    global _model
+    global _semantic_model_factory
+    global _semantic_backend_error
+    global _semantic_backend_warning_emitted
+
+    SEMANTIC_BACKEND = backend
+    _model = None
+    _semantic_model_factory = None
+    _semantic_backend_error = None
+    _semantic_backend_warning_emitted = False
+    _embedding_cache.clear()
+
+
 def get_semantic_chunking_status():
+    """Returns `(is_available, reason)` for the `SEMANTIC_BACKEND` in use."""
     try:
         _load_semantic_backend()
     except Exception as exc:
-        return False, _format_backend_error(exc)
+        return False, f"{SEMANTIC_BACKEND} backend: {_format_backend_error(exc)}"
     return True, None
 
 
+def _sentence_key(sentence):
+    return hashlib.blake2b(sentence.encode("utf-8"), digest_size=16).digest()
+
+
+def encode_sentences(sentences, *, batch_size=None):
+    """
+    Returns L2-normalized embeddings of `sentences` as a numpy array.
+
+    Embeddings are cached by sentence hash in an LRU of
+    `EMBEDDING_CACHE_MAX_ENTRIES`, so re-chunking overlapping text (e.g. the
+    accumulated text in `chunk_epub`) only encodes new sentences.
+    """
+    import numpy as np
+
+    keys = [_sentence_key(sentence) for sentence in sentences]
+    missing = {}
+    for key, sentence in zip(keys, sentences):
+        if key in _embedding_cache:
+            _embedding_cache.move_to_end(key)
+        else:
+            missing.setdefault(key, sentence)
+
+    rows = {}
+    if missing:
+        embeddings = get_model().encode(
+            list(missing.values()),
+            batch_size=batch_size or SEMANTIC_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        )
+        rows = dict(zip(missing.keys(), embeddings))
+
+    out = np.stack([rows[key] if key in rows else _embedding_cache[key] for key in keys])
+
+    for key, embedding in rows.items():
+        _embedding_cache[key] = embedding
+    while len(_embedding_cache) > EMBEDDING_CACHE_MAX_ENTRIES:
+        _embedding_cache.popitem(last=False)
+    return out
+
+
+def adjacent_similarities(embeddings):
+    """Cosine similarity of each normalized embedding with the next one."""
+    import numpy as np
+
+    return np.einsum("ij,ij->i", embeddings[:-1], embeddings[1:])
+
+
 def _split_sentences(text):
     normalized_text = re.sub(r"\s+", " ", text).strip()
     if not normalized_text:
@@ -196,9 +377,7 @@ def semantic_chunking(text, min_chunk_size=8000, max_chunk_size=12000):
         return []
 
     try:
-        model = get_model()
-        _, sentence_transformers_util = _load_semantic_backend()
-        embeddings = model.encode(sentences, convert_to_tensor=True)
+        similarities = adjacent_similarities(encode_sentences(sentences)).tolist()
     except Exception:
         return sentence_chunking(
             text,
@@ -220,9 +399,7 @@ def semantic_chunking(text, min_chunk_size=8000, max_chunk_size=12000):
 
         # Once we reach minimum size, start looking for natural break points
         if i < len(sentences) - 1:
-            similarity = sentence_transformers_util.cos_sim(
-                embeddings[i], embeddings[i + 1]
-            ).item()
+            similarity = similarities[i]
 
             # Create dynamic threshold based on chunk size
             # As we get closer to max_size, we become more willing to split
@@ -349,10 +526,130 @@ def process_csv(input_file):
                 )
 
 
+def benchmark_semantic_chunking(text, *, max_chunk_size=12000):
+    """
+    Times the previous similarity code, a sentence-transformers encode to a
+    tensor and a per-pair `cos_sim(...).item()` loop, against `semantic_chunking`.
+    """
+    import time
+
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers import util as sentence_transformers_util
+
+    sentences = _split_sentences(text)
+    if SEMANTIC_BACKEND == "torch":
+        baseline_model = get_model()
+    else:
+        setup_transformer_cache()
+        baseline_model = SentenceTransformer(MODEL_NAME)
+
+    started_at = time.perf_counter()
+    embeddings = baseline_model.encode(sentences, convert_to_tensor=True)
+    pairwise = [
+        sentence_transformers_util.cos_sim(embeddings[i], embeddings[i + 1]).item()
+        for i in range(len(sentences) - 1)
+    ]
+    pairwise_seconds = time.perf_counter() - started_at
+
+    _embedding_cache.clear()
+    started_at = time.perf_counter()
+    chunks = semantic_chunking(text, max_chunk_size=max_chunk_size)
+    cold_seconds = time.perf_counter() - started_at
+
+    started_at = time.perf_counter()
+    semantic_chunking(text, max_chunk_size=max_chunk_size)
+    warm_seconds = time.perf_counter() - started_at
+
+    vectorized = adjacent_similarities(encode_sentences(sentences))
+    max_similarity_diff = max(
+        (abs(a - b) for a, b in zip(pairwise, vectorized.tolist())), default=0.0
+    )
+    print(
+        f"backend={SEMANTIC_BACKEND}: "
+        f"{len(text)} chars, {len(sentences)} sentences, {len(chunks)} chunks\n"
+        f"previous code, torch encode + per-pair cos_sim: {pairwise_seconds:.2f}s\n"
+        f"semantic_chunking, cold cache: {cold_seconds:.2f}s\n"
+        f"semantic_chunking, warm cache: {warm_seconds:.2f}s\n"
+        f"max similarity difference: {max_similarity_diff:.2e}"
+    )
+
+
+def _boundary_drifts(boundaries, other):
+    # Distance from each boundary to the nearest one in `other`.
+    import bisect
+
+    drifts = []
+    for boundary in boundaries:
+        index = bisect.bisect_left(other, boundary)
+        neighbours = other[max(0, index - 1) : index + 1]
+        drifts.append(min((abs(boundary - n) for n in neighbours), default=boundary))
+    return drifts
+
+
+def semantic_backend_parity(
+    text,
+    *,
+    backends=("torch", "onnx"),
+    max_chunk_size=12000,
+    max_drift_chars=PARITY_MAX_DRIFT_CHARS,
+    min_exact_ratio=PARITY_MIN_EXACT_RATIO,
+):
+    """
+    Compares chunk boundaries of `backends` against the first one.
+
+    Returns `{backend: (boundary_count, exact_matches, max_drift_chars, ok)}`,
+    where drift is the distance from a boundary of either backend to the
+    nearest boundary of the other, and `ok` is whether the drift stays within
+    `max_drift_chars` and at least `min_exact_ratio` of the boundaries of the
+    backend with more of them match exactly.
+    """
+    import time
+
+    boundaries = {}
+    for backend in backends:
+        set_semantic_backend(backend)
+        available, reason = get_semantic_chunking_status()
+        if not available:
+            raise RuntimeError(reason)
+
+        started_at = time.perf_counter()
+        chunks = semantic_chunking(text, max_chunk_size=max_chunk_size)
+        print(f"{backend}: {len(chunks)} chunks in {time.perf_counter() - started_at:.2f}s")
+        offsets = []
+        offset = 0
+        for chunk in chunks[:-1]:
+            offset += len(chunk) + 1
+            offsets.append(offset)
+        boundaries[backend] = offsets
+
+    reference = boundaries[backends[0]]
+    report = {}
+    for backend in backends[1:]:
+        other = boundaries[backend]
+        drifts = _boundary_drifts(reference, other)
+        exact_matches = sum(drift == 0 for drift in drifts)
+        max_drift = max(drifts + _boundary_drifts(other, reference), default=0)
+        boundary_count = max(len(reference), len(other))
+        ok = max_drift <= max_drift_chars and (
+            not boundary_count or exact_matches / boundary_count >= min_exact_ratio
+        )
+        report[backend] = (len(other), exact_matches, max_drift, ok)
+    return report
+
+
 # To this:
 if __name__ == "__main__":
     import sys
 
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 2 and sys.argv[1] == "--benchmark":
+        with open(sys.argv[2], "r", encoding="utf-8") as f:
+            benchmark_semantic_chunking(f.read())
+    elif len(sys.argv) > 2 and sys.argv[1] == "--parity":
+        with open(sys.argv[2], "r", encoding="utf-8") as f:
+            parity_report = semantic_backend_parity(f.read())
+        print(parity_report)
+        if not all(ok for *_, ok in parity_report.values()):
+            sys.exit(1)
+    elif len(sys.argv) > 1:
         input_csv = sys.argv[1]
         process_csv(input_csv)
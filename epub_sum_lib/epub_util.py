@@ -0,0 +1,345 @@
+from bs4 import XMLParsedAsHTMLWarning
+import warnings
+
+warnings.filterwarnings("ignore", category=XMLParsedAsHTMLWarning)
+from bs4 import BeautifulSoup, CData, NavigableString, Tag
+
+from pynight.common_icecream import ic
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from zipfile import ZipFile
+from epub_sum_lib.epubsplit import SplitEpub
+from epub_sum_lib.chunking import semantic_chunking
+
+MAX_EBOOK_CHUNK_CHARS = 92000
+MIN_EBOOK_CHUNK_CHARS = 5000
+EPUB_CHUNK_WORKERS = int(
+    os.environ.get("BORG_EPUB_CHUNK_WORKERS", min(4, os.cpu_count() or 1))
+)
+# Below this much spine HTML, starting worker processes costs more than it saves.
+EPUB_PARALLEL_MIN_BYTES = 8 * 1024 * 1024
+
+try:
+    import lxml  # noqa: F401
+
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+
+def _clean_text(text: str) -> str:
+    # Clean up spacing by replacing multiple newlines with a single one
+    return re.sub(r"\n\s*\n", "\n\n", text)
+
+
+def _extract_text_from_html(html_content: str, *, parser=HTML_PARSER) -> str:
+    """Extracts clean text from an HTML string."""
+    soup = BeautifulSoup(html_content, parser)
+    return _clean_text(soup.get_text(separator="\n", strip=True))
+
+
+def _extract_text_ranges(html_content: str, ranges) -> list[str]:
+    """
+    Extracts the text of several anchor ranges of one HTML file, parsing it once.
+
+    Each range is a `(start_anchor, end_anchor)` pair with the same meaning as
+    `splitHtml`: text starts at the element with id `start_anchor` (or the
+    beginning of the body) and stops before the element with id `end_anchor`
+    (or the end). Missing anchors fall back to the beginning/end.
+    """
+    soup = BeautifulSoup(html_content, HTML_PARSER)
+    anchors = {anchor for anchor_range in ranges for anchor in anchor_range if anchor}
+    positions = {}
+    strings = []
+    for element in (soup.body or soup).descendants:
+        if isinstance(element, Tag):
+            element_id = element.get("id")
+            if element_id in anchors and element_id not in positions:
+                positions[element_id] = len(strings)
+        elif type(element) in (NavigableString, CData):
+            text = element.strip()
+            if text:
+                strings.append(text)
+    # Break the tree's parent/child cycles now instead of waiting for the GC.
+    soup.decompose()
+
+    texts = []
+    for start_anchor, end_anchor in ranges:
+        start = positions.get(start_anchor, 0)
+        end = positions.get(end_anchor, len(strings))
+        texts.append(_clean_text("\n".join(strings[start:end])))
+    return texts
+
+
+def _extract_file_text_ranges(epub_path: str, href: str, ranges) -> list[str]:
+    with ZipFile(epub_path, "r") as epub:
+        html_content = epub.read(href).decode("utf-8")
+    return _extract_text_ranges(html_content, ranges)
+
+
+def _epub_sections(lines) -> list[list[int]]:
+    # Group split lines into sections based on TOC entries
+    sections = []
+    current_section_lines = []
+    for i, line in enumerate(lines):
+        # A TOC entry marks the beginning of a new section
+        if line.get("toc"):
+            if current_section_lines:
+                sections.append(current_section_lines)
+            current_section_lines = [i]
+        # If no TOC, append to the current section
+        elif current_section_lines:
+            current_section_lines.append(i)
+
+    if current_section_lines:
+        sections.append(current_section_lines)
+
+    # If no TOC was found, treat the entire book as one section
+    if not sections:
+        sections.append(list(range(len(lines))))
+
+    return sections
+
+
+def iter_epub_section_texts(epub_path: str, *, workers: int = None):
+    """
+    Yields the text of each TOC section of an EPUB, in order.
+
+    Every spine file is read and parsed exactly once, in a process pool when
+    `workers` > 1 and the book is large enough, and each section is yielded as
+    soon as its files are done. Only spine files are read; images and fonts
+    are never decompressed, and a file's text is dropped once its last section
+    has been yielded.
+    """
+    workers = EPUB_CHUNK_WORKERS if workers is None else workers
+    with SplitEpub(epub_path) as splitter:
+        lines = splitter.get_split_lines(samples=False)
+
+        # (href, range index) for every piece of every section
+        section_pieces = []
+        file_ranges = {}
+        for section_linenums in _epub_sections(lines):
+            pieces = []
+            for href, start, end in splitter.get_split_chunks(section_linenums):
+                end_anchor = (
+                    end["anchor"] if end is not None and end["href"] == href else None
+                )
+                ranges = file_ranges.setdefault(href, [])
+                pieces.append((href, len(ranges)))
+                ranges.append((start["anchor"], end_anchor))
+            section_pieces.append(pieces)
+
+        html_size = sum(splitter.epub.getinfo(href).file_size for href in file_ranges)
+
+    pending_ranges = {href: len(ranges) for href, ranges in file_ranges.items()}
+    if workers > 1 and len(file_ranges) > 1 and html_size >= EPUB_PARALLEL_MIN_BYTES:
+        executor = ProcessPoolExecutor(
+            max_workers=min(workers, len(file_ranges)),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        futures = {
+            href: executor.submit(_extract_file_text_ranges, epub_path, href, ranges)
+            for href, ranges in file_ranges.items()
+        }
+
+        def file_texts(href):
+            return futures[href].result()
+
+        def release(href):
+            del futures[href]
+
+    else:
+        executor = None
+        cache = {}
+
+        def file_texts(href):
+            if href not in cache:
+                cache[href] = _extract_file_text_ranges(
+                    epub_path, href, file_ranges[href]
+                )
+            return cache[href]
+
+        def release(href):
+            del cache[href]
+
+    try:
+        for pieces in section_pieces:
+            section_text_parts = []
+            for href, range_index in pieces:
+                section_text_parts.append(file_texts(href)[range_index])
+                pending_ranges[href] -= 1
+                if not pending_ranges[href]:
+                    release(href)
+            yield "\n\n".join(section_text_parts).strip()
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _iter_epub_section_texts_baseline(epub_path: str):
+    """
+    Yields the section texts the way `chunk_epub` used to: `get_split_files`
+    rebuilds the HTML of each section, which is then parsed again with
+    html.parser. Only kept as the `--baseline` of the benchmark below.
+    """
+    with SplitEpub(epub_path) as splitter:
+        lines = splitter.get_split_lines()
+        for section_linenums in _epub_sections(lines):
+            yield "\n\n".join(
+                _extract_text_from_html(filedata, parser="html.parser")
+                for _, _, _, filedata in splitter.get_split_files(section_linenums)
+            ).strip()
+
+
+def extract_epub_text(epub_path: str, *, workers: int = 1) -> str:
+    """Returns the text of all TOC sections of an EPUB, separated by blank lines."""
+    return "\n\n".join(
+        text for text in iter_epub_section_texts(epub_path, workers=workers) if text
+    )
+
+
+def iter_section_chunks(section_texts):
+    """
+    Merges consecutive short sections and semantically splits long ones,
+    yielding each chunk as soon as it is final.
+    """
+    accumulated_text = ""
+    for section_text in section_texts:
+        if not section_text:
+            continue
+
+        # Add section to accumulated text
+        if accumulated_text:
+            accumulated_text += "\n\n" + section_text
+        else:
+            accumulated_text = section_text
+
+        # If accumulated text is too long, apply semantic chunking
+        if len(accumulated_text) > MAX_EBOOK_CHUNK_CHARS:
+            # ic(len(accumulated_text))
+
+            semantic_chunks = semantic_chunking(
+                accumulated_text, max_chunk_size=MAX_EBOOK_CHUNK_CHARS
+            )
+
+            # Handle merging small last chunk with accumulated_text
+            for i, chunk in enumerate(semantic_chunks):
+                if i == len(semantic_chunks) - 1 and len(chunk) < MIN_EBOOK_CHUNK_CHARS:
+                    # Keep the last small chunk in accumulated_text for next iteration
+                    accumulated_text = chunk
+                else:
+                    yield chunk
+                    if i == len(semantic_chunks) - 1:
+                        accumulated_text = ""
+
+        # If accumulated text is long enough, finalize it
+        elif len(accumulated_text) >= MIN_EBOOK_CHUNK_CHARS:
+            # ic(len(accumulated_text))
+            yield accumulated_text
+            accumulated_text = ""
+
+    # Handle any remaining accumulated text
+    if accumulated_text:
+        if len(accumulated_text) > MAX_EBOOK_CHUNK_CHARS:
+            yield from semantic_chunking(
+                accumulated_text, max_chunk_size=MAX_EBOOK_CHUNK_CHARS
+            )
+        else:
+            yield accumulated_text
+
+
+def iter_epub_chunks(epub_path: str, *, workers: int = None):
+    """
+    Yields the chunks of `chunk_epub` as soon as each one is final.
+    """
+    yield from iter_section_chunks(iter_epub_section_texts(epub_path, workers=workers))
+
+
+def chunk_epub(epub_path: str, *, workers: int = None) -> list[str]:
+    """
+    Chunks an EPUB file using a sophisticated two-stage process:
+
+    1.  **Structural Splitting**: The EPUB is first divided into sections
+        based on its Table of Contents (chapters).
+    2.  **Semantic Chunking**: If a chapter's text is too long, it is
+        further divided into smaller, semantically coherent chunks.
+
+    Section text is extracted in parallel by `iter_epub_section_texts`.
+
+    Args:
+        epub_path: Path to the EPUB file.
+        workers: Extraction processes; defaults to `EPUB_CHUNK_WORKERS`
+            (`$BORG_EPUB_CHUNK_WORKERS`), and 1 extracts in-process.
+
+    Returns:
+        A list of text chunks.
+    """
+    final_chunks = []
+    try:
+        for chunk in iter_epub_chunks(epub_path, workers=workers):
+            final_chunks.append(chunk)
+
+    except Exception as e:
+        print(f"Error chunking EPUB file {epub_path}: {e}")
+        # Optionally, re-raise or return a specific error message
+        # For now, we'll return any chunks processed so far.
+
+    return final_chunks
+
+
+def _print_chunk_diff(baseline_chunks, chunks):
+    same_count = sum(a == b for a, b in zip(baseline_chunks, chunks))
+    max_length_delta = max(
+        (abs(len(a) - len(b)) for a, b in zip(baseline_chunks, chunks)), default=0
+    )
+    print(
+        f"baseline: {len(baseline_chunks)} chunks, new: {len(chunks)} chunks, "
+        f"{same_count} identical, chunk lengths differ by at most "
+        f"{max_length_delta} chars"
+    )
+    for i, (a, b) in enumerate(zip(baseline_chunks, chunks)):
+        if a != b:
+            print(
+                f"first differing chunk: #{i}, {len(a)} vs {len(b)} chars, "
+                f"starting {a[:60]!r} vs {b[:60]!r}"
+            )
+            break
+
+
+if __name__ == "__main__":
+    # Benchmark: python -m epub_sum_lib.epub_util [--baseline] book.epub [workers ...]
+    #
+    # `--baseline` also times the previous get_split_files + html.parser path
+    # and compares its chunks with the new ones.
+    args = sys.argv[1:]
+    baseline_p = "--baseline" in args
+    if baseline_p:
+        args.remove("--baseline")
+    epub_path = args[0]
+
+    baseline_chunks = None
+    if baseline_p:
+        started_at = time.perf_counter()
+        baseline_chunks = list(
+            iter_section_chunks(_iter_epub_section_texts_baseline(epub_path))
+        )
+        elapsed = time.perf_counter() - started_at
+        print(
+            f"baseline: {len(baseline_chunks)} chunks, "
+            f"{sum(map(len, baseline_chunks))} chars in {elapsed:.2f}s"
+        )
+
+    for workers in [int(w) for w in args[1:]] or [1, EPUB_CHUNK_WORKERS]:
+        started_at = time.perf_counter()
+        chunks = chunk_epub(epub_path, workers=workers)
+        elapsed = time.perf_counter() - started_at
+        print(
+            f"workers={workers}: {len(chunks)} chunks, "
+            f"{sum(map(len, chunks))} chars in {elapsed:.2f}s"
+        )
+        if baseline_chunks is not None:
+            _print_chunk_diff(baseline_chunks, chunks)
@@ -5,7 +5,7 @@ __license__ = "GPL v3"
 __copyright__ = "2021, Jim Miller"
 __docformat__ = "restructuredtext en"
 
-import sys, re, os, traceback, copy
+import sys, re, os, traceback, copy, codecs, shutil
 from posixpath import normpath
 import logging
 
@@ -630,8 +630,16 @@ entities = {
 }
 
 
+# Longest UTF-8 encoding of one character; a sample of N characters never needs
+# more than N * 4 bytes.
+MAX_UTF8_CHAR_BYTES = 4
+
+
 class SplitEpub:
 
+    # inputio is a path or a seekable file object.  Members are read lazily
+    # from the zip, one at a time, so passing a path avoids holding the whole
+    # epub in memory.
     def __init__(self, inputio):
         self.epub = ZipFile(inputio, "r")
         self.content_dom = None
@@ -644,9 +652,28 @@ class SplitEpub:
         self.origauthors = []
         self.origtitle = None
 
+    def close(self):
+        self.epub.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     def get_file(self, href):
         return self.epub.read(href)
 
+    # Decodes just enough of href for a sample of maxchars characters.
+    def get_file_sample(self, href, maxchars=1500):
+        with self.epub.open(href) as f:
+            data = f.read(maxchars * MAX_UTF8_CHAR_BYTES + MAX_UTF8_CHAR_BYTES)
+            truncated = bool(f.read(1))
+        t = codecs.getincrementaldecoder("utf-8")().decode(data, final=not truncated)
+        if len(t) > maxchars:
+            t = t[:maxchars] + "..."
+        return t
+
     def get_content_dom(self):
         if not self.content_dom:
             ## Find the .opf file.
@@ -759,7 +786,9 @@ class SplitEpub:
     # list of dicts with href, anchor & toc text.
     # 'split lines' are all the points that the epub can be split on.
     # Offer a split at each spine file and each ToC point.
-    def get_split_lines(self):
+    # samples=False skips reading and splitting every file just for the
+    # 1500-char preview, for callers that only need the split structure.
+    def get_split_lines(self, samples=True):
 
         metadom = self.get_content_dom()
         ## Save indiv book title
@@ -799,10 +828,10 @@ class SplitEpub:
             current["id"] = idref
             current["type"] = type
             current["num"] = count
-            t = self.epub.read(href).decode("utf-8")
-            if len(t) > 1500:
-                t = t[:1500] + "..."
-            current["sample"] = t
+            if samples:
+                current["sample"] = self.get_file_sample(href)
+            # decoded lazily, once per file, only if it has anchored toc entries.
+            filedata = None
             count += 1
             # print("spine:%s->%s"%(idref,href))
 
@@ -828,13 +857,14 @@ class SplitEpub:
                         current["id"] = idref
                         current["type"] = type
                         current["num"] = count
-                        # anchor, need to split first, then reduce to 1500.
-                        t = splitHtml(
-                            self.epub.read(href).decode("utf-8"), anchor, before=False
-                        )
-                        if len(t) > 1500:
-                            t = t[:1500] + "..."
-                        current["sample"] = t
+                        if samples:
+                            # anchor, need to split first, then reduce to 1500.
+                            if filedata is None:
+                                filedata = self.epub.read(href).decode("utf-8")
+                            t = splitHtml(filedata, anchor, before=False)
+                            if len(t) > 1500:
+                                t = t[:1500] + "..."
+                            current["sample"] = t
                         count += 1
                     # There can be more than one toc to the same split line.
                     # This won't find multiple toc to the same anchor yet.
@@ -843,9 +873,8 @@ class SplitEpub:
         return self.split_lines
 
     # pass in list of line numbers(?)
-    def get_split_files(self, linenums):
-
-        self.filecache = FileCache(self.get_manifest_items())
+    # returns list of tuples=(filename,start,end) 'end' is not inclusive.
+    def get_split_chunks(self, linenums):
 
         # set include flag in split_lines.
         if not self.split_lines:
@@ -886,6 +915,14 @@ class SplitEpub:
         if inchunk:
             outchunks.append((currentfile, start, None))
 
+        return outchunks
+
+    # pass in list of line numbers(?)
+    def get_split_files(self, linenums):
+
+        self.filecache = FileCache(self.get_manifest_items())
+        outchunks = self.get_split_chunks(linenums)
+
         outfiles = []  # tuples, (filename,type,data) -- filename changed to unique
         for href, start, end in outchunks:
             filedata = self.epub.read(href).decode("utf-8")
@@ -1159,11 +1196,16 @@ class SplitEpub:
                 continue  # don't dup cover.
 
             try:
-                linkeddata = self.get_file(linked)
                 if linked in fontdecrypter.get_encrypted_fontfiles():
                     print("Decrypting font file: %s" % linked)
                     linkeddata = fontdecrypter.get_decrypted_font_data(linked)
-                outputepub.writestr(linked, linkeddata)
+                    outputepub.writestr(linked, linkeddata)
+                else:
+                    # copy in blocks; images can be far larger than the text.
+                    with self.epub.open(linked) as src, outputepub.open(
+                        linked, "w"
+                    ) as dst:
+                        shutil.copyfileobj(src, dst)
 
             except Exception as e:
                 print("Skipping linked file (%s)\nException: %s" % (linked, e))
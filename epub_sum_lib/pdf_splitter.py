@@ -1,16 +1,15 @@
 import re
 import os
 import sys
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from typing import List, TypedDict
 import click
 import pypdf
 import unicodedata
 import logging
 
-logging.basicConfig(
-    level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s"
-)
-
 
 @click.command()
 @click.option("--dry-run", is_flag=True, help="Simulate a split")
@@ -19,8 +18,37 @@ logging.basicConfig(
 )
 @click.option("--overlap", is_flag=True, help="Overlap split points")
 @click.option("--prefix", nargs=1, help="Filename prefix")
+@click.option(
+    "--jobs",
+    default=1,
+    show_default=True,
+    help="Worker processes; each opens the PDF read-only and writes whole ranges",
+)
+@click.option(
+    "--benchmark",
+    type=int,
+    metavar="PAGES",
+    help="Time splitting a synthetic PDF of PAGES pages, written to the new FILE",
+)
 @click.argument("file")
-def main(dry_run: bool, regex: str, overlap: bool, prefix: str, file: str):
+def main(
+    dry_run: bool,
+    regex: str,
+    overlap: bool,
+    prefix: str,
+    jobs: int,
+    benchmark: int,
+    file: str,
+):
+    if benchmark:
+        if os.path.exists(file):
+            print(
+                f"Error: File '{file}' already exists; --benchmark would overwrite it."
+            )
+            sys.exit(1)
+        benchmark_split_pdf(file, page_count=benchmark, jobs=jobs)
+        return
+
     if not os.path.exists(file):
         print(f"Error: File '{file}' does not exist.")
         sys.exit(0)
@@ -28,15 +56,15 @@ def main(dry_run: bool, regex: str, overlap: bool, prefix: str, file: str):
         level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s"
     )
     try:
-        pdf = pypdf.PdfReader(input_file)
+        pdf = pypdf.PdfReader(file)
 
         # Check if the PDF is encrypted
         if pdf.is_encrypted:
-            logging.error(f"Error: PDF file '{input_file}' is encrypted.")
+            logging.error(f"Error: PDF file '{file}' is encrypted.")
             return
 
         # Process the PDF (e.g., extract TOC, pages, etc.)
-        logging.info(f"Successfully loaded PDF: {input_file}")
+        logging.info(f"Successfully loaded PDF: {file}")
         # Add further processing logic here
 
     except pypdf.errors.PdfReadError as e:
@@ -71,6 +99,8 @@ def main(dry_run: bool, regex: str, overlap: bool, prefix: str, file: str):
 
         if dry_run is True:
             dry_run_toc_split(page_ranges, prefix, output_dir)
+        elif jobs > 1:
+            split_pdf_parallel(file, page_ranges, prefix, output_dir, jobs=jobs)
         else:
             split_pdf(pdf, page_ranges, prefix, output_dir)
 
@@ -171,14 +201,21 @@ def get_page_ranges(
     toc: List[OutlineItem], overlap: bool, page_count: int
 ) -> List[PageRange]:
     page_ranges = []
+    # Repeated names get " 2", " 3", ... without rescanning earlier ranges.
+    name_counts = {}
+    used_names = set()
     for i, item in enumerate(toc):
         name = item["name"]
         if len(name) == 0:
             name = "Untitled Section"
-        if len([item for item in page_ranges if name is item["name"]]) > 0:
-            name += " {}".format(
-                len([item for item in page_ranges if name in item["name"]]) + 1
-            )
+        suffix = name_counts.get(name, 1)
+        unique_name = name
+        while unique_name in used_names:
+            suffix += 1
+            unique_name = f"{name} {suffix}"
+        name_counts[name] = suffix
+        name = unique_name
+        used_names.add(name)
         start_page = item["page"]
         end_page = toc[i + 1]["page"] - 1 if i + 1 < len(toc) else page_count - 1
         if overlap and i + 1 < len(toc):
@@ -212,33 +249,163 @@ def get_page_ranges(
     return merged_page_ranges
 
 
+def split_output_path(
+    i: int, page_range: PageRange, prefix: str, output_dir: str
+) -> str:
+    filename = f"{safe_filename(page_range['name'])}.pdf"
+    if prefix is not None:
+        filename = f"{prefix}{filename}"
+
+    prefix_number = str(i).zfill(2)
+    filename = f"{prefix_number}-{filename}"
+
+    # Save the output file to the newly created directory
+    return os.path.join(output_dir, filename)
+
+
+def write_page_range(pdf: pypdf.PdfReader, page_range: PageRange, output_path: str):
+    pdf_writer = pypdf.PdfWriter()
+    start_page, end_page = page_range["page_range"]
+    logging.debug(
+        f"Splitting pages {start_page} to {end_page} for '{page_range['name']}'"
+    )
+    pdf_writer.append(
+        fileobj=pdf,
+        pages=(start_page, end_page + 1),
+    )
+
+    with open(output_path, "wb") as output:
+        pdf_writer.write(output)
+
+    return output_path
+
+
 def split_pdf(
     pdf: pypdf.PdfReader, page_ranges: List[PageRange], prefix: str, output_dir: str
 ):
     for i, page_range in enumerate(page_ranges, start=1):
-        pdf_writer = pypdf.PdfWriter()
-        start_page, end_page = page_range["page_range"]
-        logging.debug(
-            f"Splitting pages {start_page} to {end_page} for '{page_range['name']}'"
+        output_path = split_output_path(i, page_range, prefix, output_dir)
+        write_page_range(pdf, page_range, output_path)
+        logging.info(f"Created file '{output_path}'")
+
+
+# Each worker process opens the input once and reuses the reader, with its
+# parsed xref table and resolved objects, for every range it is given.
+_worker_pdf = None
+
+
+def _init_split_worker(input_path: str):
+    global _worker_pdf
+    _worker_pdf = pypdf.PdfReader(input_path)
+
+
+def _write_worker_page_range(page_range: PageRange, output_path: str):
+    return write_page_range(_worker_pdf, page_range, output_path)
+
+
+def split_pdf_parallel(
+    input_path: str,
+    page_ranges: List[PageRange],
+    prefix: str,
+    output_dir: str,
+    *,
+    jobs: int,
+):
+    """
+    Writes the same files as `split_pdf`, distributing the ranges over `jobs`
+    worker processes. Longest ranges are submitted first so that one large
+    chapter does not start last.
+    """
+    tasks = [
+        (page_range, split_output_path(i, page_range, prefix, output_dir))
+        for i, page_range in enumerate(page_ranges, start=1)
+    ]
+    tasks.sort(key=lambda task: task[0]["page_range"][0] - task[0]["page_range"][1])
+
+    with ProcessPoolExecutor(
+        max_workers=min(jobs, len(tasks)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_split_worker,
+        initargs=(input_path,),
+    ) as executor:
+        futures = [
+            executor.submit(_write_worker_page_range, page_range, output_path)
+            for page_range, output_path in tasks
+        ]
+        for future in as_completed(futures):
+            logging.info(f"Created file '{future.result()}'")
+
+
+def write_synthetic_pdf(
+    output_path: str, *, page_count: int, pages_per_section: int = 10
+):
+    """
+    Writes a PDF of `page_count` text pages set in one font, with an outline
+    entry every `pages_per_section` pages.
+    """
+    from pypdf.generic import (
+        DecodedStreamObject,
+        DictionaryObject,
+        NameObject,
+    )
+
+    pdf_writer = pypdf.PdfWriter()
+    font = DictionaryObject(
+        {
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Helvetica"),
+        }
+    )
+    for page_number in range(page_count):
+        page = pdf_writer.add_blank_page(width=612, height=792)
+        lines = [
+            f"(Page {page_number} line {line} of the synthetic benchmark text.) Tj T*"
+            for line in range(40)
+        ]
+        content = DecodedStreamObject()
+        content.set_data(
+            ("BT /F1 10 Tf 12 TL 72 720 Td " + " ".join(lines) + " ET").encode()
         )
-        pdf_writer.append(
-            fileobj=pdf,
-            pages=(start_page, end_page + 1),
+        page.replace_contents(content)
+        page[NameObject("/Resources")] = DictionaryObject(
+            {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})}
         )
 
-        filename = f"{safe_filename(page_range['name'])}.pdf"
-        if prefix is not None:
-            filename = f"{prefix}{filename}"
+    for page_number in range(0, page_count, pages_per_section):
+        pdf_writer.add_outline_item(
+            f"Chapter {page_number // pages_per_section + 1}", page_number
+        )
 
-        prefix_number = str(i).zfill(2)
-        filename = f"{prefix_number}-{filename}"
+    with open(output_path, "wb") as output:
+        pdf_writer.write(output)
 
-        # Save the output file to the newly created directory
-        output_path = os.path.join(output_dir, filename)
-        with open(output_path, "wb") as output:
-            pdf_writer.write(output)
 
-        logging.info(f"Created file '{output_path}'")
+def benchmark_split_pdf(output_path: str, *, page_count: int, jobs: int):
+    write_synthetic_pdf(output_path, page_count=page_count)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    pdf = pypdf.PdfReader(output_path)
+    page_ranges = prepare_page_ranges(get_toc(pdf), None, False, len(pdf.pages))
+    output_dir = os.path.splitext(output_path)[0] + "_split"
+    os.makedirs(output_dir, exist_ok=True)
+
+    started_at = time.perf_counter()
+    split_pdf(pdf, page_ranges, None, output_dir)
+    print(
+        f"serial: {len(page_ranges)} files from {page_count} pages "
+        f"in {time.perf_counter() - started_at:.2f}s"
+    )
+
+    for worker_count in sorted({2, jobs} - {1}):
+        started_at = time.perf_counter()
+        split_pdf_parallel(
+            output_path, page_ranges, None, output_dir, jobs=worker_count
+        )
+        print(
+            f"jobs={worker_count}: {len(page_ranges)} files "
+            f"in {time.perf_counter() - started_at:.2f}s"
+        )
 
 
 def dry_run_toc_split(page_ranges: List[PageRange], prefix: str, output_dir: str):
@@ -0,0 +1,102 @@
+import re
+import sys
+import time
+
+import pypdf
+
+from epub_sum_lib.pdf_splitter import get_toc
+from epub_sum_lib.epub_util import MAX_EBOOK_CHUNK_CHARS, iter_section_chunks
+
+# A TOC section longer than this is handed on in pieces, at page boundaries.
+MAX_PDF_SECTION_CHARS = 4 * MAX_EBOOK_CHUNK_CHARS
+
+
+def _clean_page_text(text: str) -> str:
+    return re.sub(r"\n\s*\n", "\n\n", text).strip()
+
+
+def iter_pdf_page_texts(reader: pypdf.PdfReader):
+    """Yields the extracted text of each page, one page at a time."""
+    for page_number, page in enumerate(reader.pages):
+        try:
+            text = page.extract_text() or ""
+        except Exception as e:
+            print(f"Error extracting text from page {page_number}: {e}")
+            text = ""
+        yield _clean_page_text(text)
+
+
+def iter_pdf_section_texts(pdf_path: str):
+    """
+    Yields the text of each TOC section of a PDF, in order.
+
+    Without an outline every page is its own section, and sections longer than
+    `MAX_PDF_SECTION_CHARS` are yielded in pieces, so at most one section is
+    held in memory regardless of the page count.
+    """
+    reader = pypdf.PdfReader(pdf_path)
+    section_starts = {item["page"] for item in get_toc(reader)}
+
+    section_pages = []
+    section_size = 0
+    for page_number, page_text in enumerate(iter_pdf_page_texts(reader)):
+        is_boundary = not section_starts or page_number in section_starts
+        if section_pages and (is_boundary or section_size > MAX_PDF_SECTION_CHARS):
+            yield "\n\n".join(section_pages)
+            section_pages = []
+            section_size = 0
+
+        if page_text:
+            section_pages.append(page_text)
+            section_size += len(page_text)
+
+    if section_pages:
+        yield "\n\n".join(section_pages)
+
+
+def extract_pdf_text(pdf_path: str) -> str:
+    """Returns the text of all pages of a PDF, separated by blank lines."""
+    reader = pypdf.PdfReader(pdf_path)
+    return "\n\n".join(text for text in iter_pdf_page_texts(reader) if text)
+
+
+def iter_pdf_chunks(pdf_path: str):
+    """
+    Yields the chunks of `chunk_pdf` as soon as each one is final.
+    """
+    yield from iter_section_chunks(iter_pdf_section_texts(pdf_path))
+
+
+def chunk_pdf(pdf_path: str) -> list[str]:
+    """
+    Chunks a PDF file the way `epub_util.chunk_epub` chunks an EPUB: the outline
+    (via `pdf_splitter.get_toc`) gives the structural sections, which are
+    merged or semantically split into chunks.
+
+    Text is extracted page by page and only the current section's text is
+    held, so the extracted text in memory does not grow with the page count.
+
+    Args:
+        pdf_path: Path to the PDF file.
+
+    Returns:
+        A list of text chunks.
+    """
+    final_chunks = []
+    try:
+        for chunk in iter_pdf_chunks(pdf_path):
+            final_chunks.append(chunk)
+
+    except Exception as e:
+        print(f"Error chunking PDF file {pdf_path}: {e}")
+
+    return final_chunks
+
+
+if __name__ == "__main__":
+    # Benchmark: python -m epub_sum_lib.pdf_util book.pdf
+    pdf_path = sys.argv[1]
+    started_at = time.perf_counter()
+    chunks = chunk_pdf(pdf_path)
+    elapsed = time.perf_counter() - started_at
+    print(f"{len(chunks)} chunks, {sum(map(len, chunks))} chars in {elapsed:.2f}s")
@@ -16,11 +16,13 @@ import json
 from pathlib import Path
 from typing import Dict, Iterable
 from IPython import embed
-from brish import z, zp, bsh, zq
+from brish import z, zp, bsh, zq, Brish
 from uuid import uuid4
 import re
-from cachetools import cached, LRUCache, TTLCache
+from cachetools import LRUCache, TLRUCache
+from concurrent.futures import Future, ThreadPoolExecutor
 from threading import RLock
+import hashlib
 import traceback
 
 from telegram import (
@@ -62,7 +64,15 @@ dl_base = os.getcwd() + "/dls/"
 tmp_chat = int(z('ecn "${{borg_tmpc:--1001215308649}}"').outrs)
 # -1001496131468 (old TMPC)
 ##
-lock_inline = RLock()
+# Queries run concurrently, each command in its own brish worker.
+inline_workers = int(os.environ.get("borg_inline_workers", 8))
+inline_brish = Brish(server_count=inline_workers)
+inline_upload_concurrency = int(os.environ.get("borg_inline_upload_concurrency", 4))
+upload_executor = ThreadPoolExecutor(max_workers=inline_upload_concurrency)
+# Seconds before an inline command is killed, unless the command kind sets its own.
+INLINE_TIMEOUT = int(os.environ.get("borg_inline_timeout", 60))
+SEARCH_TIMEOUT = 30
+INLINE_CACHE_TTL = 3600
 ##
 
 
@@ -144,116 +154,221 @@ Show an affirming flame.
         )
         return
 
-    with lock_inline:
-        query = update.inline_query.query
-        m = PDI.match(query)
-        if m:
-            c_id = m.group(1)
-            c_kind = m.group(2) or ""
-            print(f"Download ID: {c_id} {c_kind}")
-            result = None
-            if c_kind == "":
-                result = InlineQueryResultCachedDocument(
-                    id=uuid4(), title=str(c_id), document_file_id=c_id
-                )
-            elif c_kind.startswith("vid"):
-                result = InlineQueryResultCachedVideo(
-                    id=uuid4(), title=str(c_id), video_file_id=c_id
-                )
-            elif c_kind == "photo":
-                result = InlineQueryResultCachedPhoto(
-                    id=uuid4(), title=str(c_id), photo_file_id=c_id
-                )
-            elif c_kind == "gif":
-                result = InlineQueryResultCachedMpeg4Gif(
-                    id=uuid4(), title=str(c_id), mpeg4_file_id=c_id
-                )
-            if result:
-                try:
-                    update.inline_query.answer([result], cache_time=1, is_personal=True)
-                except:
-                    ans_text(traceback.format_exc())
-            else:
-                ans_text(f"Invalid kind: {c_kind}")
+    query = update.inline_query.query
+    m = PDI.match(query)
+    if m:
+        c_id = m.group(1)
+        c_kind = m.group(2) or ""
+        print(f"Download ID: {c_id} {c_kind}")
+        result = None
+        if c_kind == "":
+            result = InlineQueryResultCachedDocument(
+                id=uuid4(), title=str(c_id), document_file_id=c_id
+            )
+        elif c_kind.startswith("vid"):
+            result = InlineQueryResultCachedVideo(
+                id=uuid4(), title=str(c_id), video_file_id=c_id
+            )
+        elif c_kind == "photo":
+            result = InlineQueryResultCachedPhoto(
+                id=uuid4(), title=str(c_id), photo_file_id=c_id
+            )
+        elif c_kind == "gif":
+            result = InlineQueryResultCachedMpeg4Gif(
+                id=uuid4(), title=str(c_id), mpeg4_file_id=c_id
+            )
+        if result:
+            try:
+                update.inline_query.answer([result], cache_time=1, is_personal=True)
+            except:
+                ans_text(traceback.format_exc())
+        else:
+            ans_text(f"Invalid kind: {c_kind}")
+        return
+    command = ""
+    cache_time = 1
+    is_personal = True
+    timeout = INLINE_TIMEOUT
+    ttl = INLINE_CACHE_TTL
+    no_match = True
+    m = PC_KITSU.match(query)
+    if m:
+        no_match = False
+        arg = zq(str(m.group(1)))
+        if not arg:
+            ans_text()
             return
-        command = ""
-        cache_time = 1
-        is_personal = True
-        no_match = True
-        m = PC_KITSU.match(query)
-        if m:
-            no_match = False
-            arg = zq(str(m.group(1)))
-            if not arg:
-                ans_text()
-                return
-            command = f"kitsu-getall {arg}"
-            cache_time = 86400
-            is_personal = False
-        m = PC_GOO.match(query)
-        if m:
-            no_match = False
-            mode = str(m.group(1))
-            arg = zq(str(m.group(2)))
-            if not arg:
-                ans_text()
-                return
-            if mode == "g":
-                command = f"jigoo {arg}"
-            elif mode == "as":
-                command = f"jias {arg}"
-            else:  # 'd'
-                command = f"search_json_ddg=y jigoo {arg}"
-            is_personal = False
-        if no_match:
-            if not isAdmin(update):
-                ans_text(
-                    """The enlightenment driven away,
+        command = f"kitsu-getall {arg}"
+        cache_time = 86400
+        ttl = 86400
+        is_personal = False
+    m = PC_GOO.match(query)
+    if m:
+        no_match = False
+        mode = str(m.group(1))
+        arg = zq(str(m.group(2)))
+        if not arg:
+            ans_text()
+            return
+        if mode == "g":
+            command = f"jigoo {arg}"
+        elif mode == "as":
+            command = f"jias {arg}"
+        else:  # 'd'
+            command = f"search_json_ddg=y jigoo {arg}"
+        timeout = SEARCH_TIMEOUT
+        is_personal = False
+    if no_match:
+        if not isAdmin(update):
+            ans_text(
+                """The enlightenment driven away,
 The habit-forming pain,
 Mismanagement and grief:
 We must suffer them all again. - Auden"""
-                )
-                return
-            if query == ".x":
-                bsh.restart()
-                cache.clear()
+            )
+            return
+        if query == ".x":
+            #: Holding `cache_lock` keeps new commands from starting until the restart is done.
+            with cache_lock:
+                running_count = len(inflight_results)
+                if not running_count:
+                    bsh.restart()
+                    inline_brish.restart()
+                    cache.clear()
+            if running_count:
+                ans_text(f"Not restarted: {running_count} command(s) still running")
+            else:
                 ans_text("Restarted")
-                return
-            m = PAF.match(query)
-            if m == None:
-                ans_text()
-                return
-            command = m.group(2)
-            if m.group(1) == "n":
-                # embed()
-                command = "noglob " + command
-        if not command:
+            return
+        m = PAF.match(query)
+        if m == None:
             ans_text()
             return
-        print(f"Inline command accepted: {command}")
-        results = get_results(command)
-        update.inline_query.answer(
-            results, cache_time=cache_time, is_personal=is_personal
-        )
-
-
-cache = TTLCache(maxsize=256, ttl=3600)
-
+        command = m.group(2)
+        if m.group(1) == "n":
+            # embed()
+            command = "noglob " + command
+    if not command:
+        ans_text()
+        return
+    print(f"Inline command accepted: {command}")
+    results = get_results(command, timeout=timeout, ttl=ttl)
+    update.inline_query.answer(results, cache_time=cache_time, is_personal=is_personal)
+
+
+# Entries are `(results, ttl)`, so each command kind keeps its results as long as it asks to.
+cache = TLRUCache(maxsize=256, ttu=lambda _key, value, now: now + value[1])
+cache_lock = RLock()
+# Queries for a command that is already running wait for its results instead of rerunning it.
+inflight_results: Dict[tuple, Future] = {}
+
+
+def get_results(
+    command: str,
+    json_mode: bool = True,
+    *,
+    timeout=INLINE_TIMEOUT,
+    ttl=INLINE_CACHE_TTL,
+):
+    key = (command, json_mode)
+    with cache_lock:
+        if key in cache:
+            return cache[key][0]
+
+        future = inflight_results.get(key)
+        owner_p = future is None
+        if owner_p:
+            future = inflight_results[key] = Future()
+
+    if not owner_p:
+        return future.result()
 
-@cached(cache)
-def get_results(command: str, json_mode: bool = True):
+    try:
+        results, timed_out_p = run_command(
+            command, json_mode=json_mode, timeout=timeout
+        )
+        if not timed_out_p:
+            with cache_lock:
+                cache[key] = (results, ttl)
+        future.set_result(results)
+        return results
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with cache_lock:
+            del inflight_results[key]
+
+
+file_id_cache = LRUCache(maxsize=1024)
+
+
+def upload_file(path: Path):
+    """
+    Returns the document `file_id` of the file at `path`, uploading it to
+    `tmp_chat` unless the same content was uploaded before.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(2**20), b""):
+            sha256.update(block)
+    digest = sha256.hexdigest()
+    with cache_lock:
+        file_id = file_id_cache.get(digest)
+    if file_id:
+        return file_id
+
+    with open(path, "rb") as file:
+        uploaded_file = updater.bot.send_document(tmp_chat, file)
+    if not uploaded_file.document:
+        print("BUG?: Uploaded file had no document!")
+        return None
+
+    # print(f"File ID: {uploaded_file.document.file_id}")
+    with cache_lock:
+        file_id_cache[digest] = uploaded_file.document.file_id
+    return uploaded_file.document.file_id
+
+
+def run_command(command: str, *, json_mode: bool, timeout: int):
     cwd = dl_base + "Inline " + str(uuid4()) + "/"
     Path(cwd).mkdir(parents=True, exist_ok=True)
-    res = z(
+    #: Created by the watchdog when it kills the command; kept outside `cwd` so it is not sent.
+    timeout_flag = cwd[:-1] + ".timeout"
+    #: The command and its watchdog run as background jobs in their own process groups, so
+    #: killing a group also kills everything the job started.
+    res = inline_brish.z(
         """
     if cd {cwd} ; then
-        {command:e}
+        setopt monitor
+        {{
+            {command:e}
+        }} &
+        inline_pid=$!
+        {{
+            sleep {timeout}
+            : > {timeout_flag}
+            if kill -TERM -$inline_pid 2>/dev/null ; then
+                echo "Inline Query: timed out after {timeout:e}s" >&2
+            else
+                command rm -f {timeout_flag}
+            fi
+        }} &
+        inline_watchdog=$!
+        unsetopt monitor
+        wait $inline_pid
+        inline_retcode=$?
+        kill -TERM -$inline_watchdog 2>/dev/null
+        (exit $inline_retcode)
     else
         echo Inline Query: cd failed >&2
     fi
     """,
         fork=True,
-    )  # @design We might want to add a timeout here. We also need a file cacher ... Easier yet, just cache the results array and reset it using our 'x' command
+    )
+    timed_out_p = os.path.exists(timeout_flag)
+    if timed_out_p:
+        os.remove(timeout_flag)
     out = res.outerr
     if WHITESPACE.match(out):
         out = f"The process exited {res.retcode}."
@@ -345,31 +460,20 @@ def get_results(command: str, json_mode: bool = True):
                 ),
             )
         ]
-        files = list(Path(cwd).glob("*"))
-        files.sort()
-        for f in files:
-            if not f.is_dir():
-                file_add = f.absolute()
-                base_name = str(os.path.basename(file_add))
-                ext = f.suffix
-                file = open(file_add, "rb")
-                uploaded_file = updater.bot.send_document(tmp_chat, file)
-                file.close()
-                if uploaded_file.document:
-                    # print(f"File ID: {uploaded_file.document.file_id}")
-                    results.append(
-                        InlineQueryResultCachedDocument(
-                            id=uuid4(),
-                            title=base_name,
-                            document_file_id=uploaded_file.document.file_id,
-                        )
+        files = [f for f in sorted(Path(cwd).glob("*")) if not f.is_dir()]
+        for f, file_id in zip(files, upload_executor.map(upload_file, files)):
+            if file_id:
+                results.append(
+                    InlineQueryResultCachedDocument(
+                        id=uuid4(),
+                        title=f.name,
+                        document_file_id=file_id,
                     )
-                else:
-                    print("BUG?: Uploaded file had no document!")
+                )
 
     z("command rm -r {cwd}")
     print(f"len(results): {len(results)}")
-    return results
+    return results, timed_out_p
 
 
 def main():
@@ -377,7 +481,14 @@ def main():
     # Make sure to set use_context=True to use the new context based callbacks
     # Post version 12 this will no longer be necessary
     global updater
-    updater = Updater(os.environ["TELEGRAM_TOKEN"], use_context=True)
+    updater = Updater(
+        os.environ["TELEGRAM_TOKEN"],
+        use_context=True,
+        workers=inline_workers,
+        request_kwargs={
+            "con_pool_size": inline_workers + inline_upload_concurrency + 4
+        },
+    )
 
     # Get the dispatcher to register handlers
     dp = updater.dispatcher
@@ -386,7 +497,7 @@ def main():
     # dp.add_handler(CommandHandler("start", start))
     # dp.add_handler(CommandHandler("help", help_command))
 
-    dp.add_handler(InlineQueryHandler(inlinequery))
+    dp.add_handler(InlineQueryHandler(inlinequery, run_async=True))
 
     # Start the Bot
     updater.start_polling()
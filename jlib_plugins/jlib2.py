@@ -5,6 +5,9 @@ from functools import partial
 from uniborg.util import embed2, brishz
 from brish import zs
 
+# Seconds before a download is killed.
+JLIB_TIMEOUT = 30 * 60
+
 
 @borg.on(events.NewMessage(pattern=r"^http.*(\w{32})\W*$"))
 async def _(event):
@@ -29,5 +32,8 @@ async def _(event):
 
         command = zs("lgNoBok=y pkno sout jlib {md5}")
         await util.run_and_upload(
-            event=event, to_await=partial(brishz, cmd=command, fork=True, shell=False)
+            event=event,
+            to_await=partial(
+                brishz, cmd=command, fork=True, shell=False, timeout=JLIB_TIMEOUT
+            ),
         )
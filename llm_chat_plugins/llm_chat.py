@@ -14,6 +14,7 @@ import uuid
 import base64
 import binascii
 import copy
+import hashlib
 import io
 import mimetypes
 import re
@@ -83,7 +84,7 @@ from uniborg.constants import (
 )
 
 # Import live mode utilities
-from uniborg import gemini_live_util
+from uniborg import audio_util, gemini_live_util
 from uniborg import codex_util
 
 # Redis utilities for smart context state persistence
@@ -1073,6 +1074,10 @@ BOT_COMMANDS = [
     {"command": "tools", "description": "Enable or disable tools like search"},
     {"command": "json", "description": "Toggle JSON output mode"},
     {"command": "tts", "description": "Set TTS model for this chat"},
+    {
+        "command": "textdocshere",
+        "description": "Toggle sending PDFs/EPUBs as extracted text in this chat",
+    },
     {"command": "geminivoice", "description": "Set global Gemini voice"},
     {"command": "geminivoicehere", "description": "Set Gemini voice for this chat"},
     {
@@ -1335,6 +1340,7 @@ class ChatPrefs(BaseModel):
     live_mode_enabled: bool = Field(default=False)
     last_n_messages_limit: Optional[int] = Field(default=None)
     auto_delete_info_p: AutoDeleteMode = Field(default=AutoDeleteMode.GROUP_ONLY)
+    text_only_documents: bool = Field(default=False)
 
 
 class UserManager:
@@ -1539,6 +1545,15 @@ class ChatManager:
         prefs.last_n_messages_limit = limit
         self._save_prefs(chat_id, prefs)
 
+    def is_text_only_documents(self, chat_id: int) -> bool:
+        return self.get_prefs(chat_id).text_only_documents
+
+    def toggle_text_only_documents(self, chat_id: int) -> bool:
+        prefs = self.get_prefs(chat_id)
+        prefs.text_only_documents = not prefs.text_only_documents
+        self._save_prefs(chat_id, prefs)
+        return prefs.text_only_documents
+
 
 user_manager = UserManager()
 chat_manager = ChatManager()
@@ -2925,6 +2940,82 @@ async def _get_and_cache_media_info(message, file_id, temp_dir):
         return "base64", b64_content, file_path.name, mime_type
 
 
+# Documents that chats with "text-only documents" enabled send as extracted text
+TEXT_EXTRACTABLE_DOCUMENT_TYPES = {
+    ".pdf": "application/pdf",
+    ".epub": "application/epub+zip",
+}
+
+
+def _get_text_extractable_document_suffix(message) -> Optional[str]:
+    """Returns the suffix of a PDF/EPUB attachment without downloading it."""
+    if not message.file:
+        return None
+
+    suffix = Path(message.file.name or "").suffix.lower()
+    if suffix in TEXT_EXTRACTABLE_DOCUMENT_TYPES:
+        return suffix
+
+    for suffix, mime_type in TEXT_EXTRACTABLE_DOCUMENT_TYPES.items():
+        if message.file.mime_type == mime_type:
+            return suffix
+
+    return None
+
+
+def _extract_document_text(file_path: str, suffix: str) -> str:
+    if suffix == ".pdf":
+        from epub_sum_lib import pdf_util
+
+        return pdf_util.extract_pdf_text(file_path)
+
+    from epub_sum_lib import epub_util
+
+    return epub_util.extract_epub_text(file_path)
+
+
+async def _get_document_text(message, file_id, temp_dir, suffix):
+    """
+    Returns (filename, text) for a PDF/EPUB attachment, or None on failure.
+
+    The text is extracted once per content digest and also cached per file_id,
+    so later turns neither re-download nor re-read the Base64 document.
+    """
+    text_file_id = f"{file_id}:text"
+    cached_text_info = await history_util.get_cached_file(text_file_id)
+    if cached_text_info:
+        return cached_text_info.get("filename"), cached_text_info["data"]
+
+    storage_type, content, filename, mime_type = await _get_and_cache_media_info(
+        message, file_id, temp_dir
+    )
+    if not storage_type:
+        return None
+    if storage_type == "text":
+        return filename, content
+
+    digest = hashlib.sha256(content.encode("ascii")).hexdigest()
+    text = await history_util.get_cached_document_text(digest)
+    if text is None:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_f:
+            temp_f.write(base64.b64decode(content))
+            temp_path = temp_f.name
+        try:
+            text = await asyncio.to_thread(_extract_document_text, temp_path, suffix)
+        finally:
+            os.unlink(temp_path)
+        await history_util.cache_document_text(digest, text)
+
+    await history_util.cache_file(
+        text_file_id,
+        data=text,
+        data_storage_type="text",
+        filename=filename,
+        mime_type="text/plain",
+    )
+    return filename, text
+
+
 @dataclass
 class SystemPromptInfo:
     """Contains all system prompt information for a chat context."""
@@ -3139,6 +3230,26 @@ async def _process_media(
             f"{message.chat_id}_{message.id}_{getattr(message.media, 'id', 'unknown')}"
         )
 
+        # --- Text-only documents: send PDFs/EPUBs as their extracted text ---
+        document_suffix = _get_text_extractable_document_suffix(message)
+        if document_suffix and chat_manager.is_text_only_documents(message.chat_id):
+            try:
+                document = await _get_document_text(
+                    message, file_id, temp_dir, document_suffix
+                )
+            except Exception as e:
+                print(f"Error extracting text from message {message.id}: {e}")
+                document = None
+
+            # Scanned PDFs have no text; those still go to the model as files.
+            if document and document[1].strip():
+                filename, text = document
+                part = {
+                    "type": "text",
+                    "text": f"\n--- Attachment: {filename} ---\n{text}",
+                }
+                return ProcessMediaResult(media_part=part, warnings=[])
+
         # --- Branch 1: Gemini Files API Mode ---
         if is_native_gemini_files_mode(model_in_use):
             gemini_client = None
@@ -4266,6 +4377,9 @@ def register_handlers():
     borg.on(events.NewMessage(pattern=rf"(?i)^/tts{bot_username_suffix_re}\s*$"))(
         tts_handler
     )
+    borg.on(
+        events.NewMessage(pattern=rf"(?i)^/textdocshere{bot_username_suffix_re}\s*$")
+    )(text_docs_here_handler)
     borg.on(
         events.NewMessage(
             pattern=rf"(?i)^/geminivoice{bot_username_suffix_re}\s*$",
@@ -4493,6 +4607,7 @@ You can attach **images, audio, video, and text files**. Sending multiple files
 - /setthink: Adjust the model's reasoning effort for complex tasks.
 - /tools: Enable/disable tools like Google Search and Code Execution.
 - /json: Toggle JSON-only output mode for structured data needs.
+- /textDocsHere: Send PDFs and EPUBs in this chat as extracted text (much smaller requests).
 
 **Quick Model Selection Shortcuts**
 Start your messages with these shortcuts to use specific models:
@@ -4598,10 +4713,7 @@ async def stop_handler(event):
     # Cancel live mode if active
     chat_id = event.chat_id
     if gemini_live_util.live_session_manager.is_live_mode_active(chat_id):
-        session = gemini_live_util.live_session_manager.get_session(chat_id)
-        if session and hasattr(session, "_response_task") and session._response_task:
-            session._response_task.cancel()
-        gemini_live_util.live_session_manager.end_session(chat_id)
+        await gemini_live_util.live_session_manager.end_session(chat_id)
 
     # Cancel all active LLM tasks
     cancelled_count = cancel_all_llm_tasks(user_id)
@@ -4732,7 +4844,8 @@ async def status_handler(event):
         f"**This Chat's Settings**\n"
         f"• **Chat Model:** `{chat_model or 'Not set'}`\n"
         f"• **Chat System Prompt:** `{chat_system_prompt_status}`\n"
-        f"• **Chat 'Last N' Limit:** {chat_last_n_status}\n\n"
+        f"• **Chat 'Last N' Limit:** {chat_last_n_status}\n"
+        f"• **Text-Only Documents:** `{'Enabled' if chat_prefs.text_only_documents else 'Disabled'}`\n\n"
         f"**TTS Settings (This Chat)**\n"
         f"• **TTS Model:** `{tts_model_display}`\n"
         f"• **Voice:** {effective_voice_display}\n\n"
@@ -5371,6 +5484,18 @@ async def json_mode_handler(event):
     )
 
 
+async def text_docs_here_handler(event):
+    """Toggles sending PDF/EPUB attachments as extracted text in this chat."""
+    is_enabled = chat_manager.toggle_text_only_documents(event.chat_id)
+    if is_enabled:
+        details = "PDF and EPUB files will be sent to the model as extracted text."
+    else:
+        details = "PDF and EPUB files will be sent to the model as files."
+    await event.reply(
+        f"{BOT_META_INFO_PREFIX}Text-only documents have been **{'enabled' if is_enabled else 'disabled'}** for this chat. {details}"
+    )
+
+
 async def tts_handler(event):
     """Handle /tts command - per-chat TTS model selection"""
     current_model = chat_manager.get_tts_model(event.chat_id)
@@ -5937,7 +6062,12 @@ async def live_handler(event):
         try:
             # Create new live session
             session = await gemini_live_util.live_session_manager.create_session(
-                chat_id, user_id, live_model, api_key
+                chat_id,
+                user_id,
+                live_model,
+                api_key,
+                on_response=handle_live_mode_response,
+                on_close=handle_live_mode_close,
             )
             chat_manager.set_live_mode_enabled(chat_id, True)
             await event.reply(
@@ -6452,27 +6582,22 @@ async def _handle_tts_response(event, response_text: str):
         else:
             voice = user_manager.get_tts_global_voice(sender_id)
 
-        # Truncate text if needed
-        truncated_text, was_truncated = tts_util.truncate_text_for_tts(response_text)
+        from telethon.tl.types import DocumentAttributeAudio
 
-        # Generate TTS audio (returns OGG file path)
-        ogg_file_path = await tts_util.generate_tts_audio(
-            truncated_text,
+        # Send each segment as a voice message as soon as it is ready, while
+        # the following segments are still being synthesized.
+        async for ogg_data in tts_util.iter_tts_audio_segments(
+            response_text,
             voice=voice,
             model=tts_model,
             api_key=api_key,
             user_id=sender_id,
-        )
-
-        try:
-            # Send as voice message with proper attributes
-            from telethon.tl.types import DocumentAttributeAudio
-
+        ):
             async with borg.action(event.chat, "audio") as action:
-                await event.client.send_file(
+                await tts_util.send_voice_message(
+                    event.client,
                     event.chat_id,
-                    ogg_file_path,
-                    voice_note=True,
+                    ogg_data,
                     reply_to=event.id,
                     attributes=[
                         DocumentAttributeAudio(
@@ -6481,22 +6606,6 @@ async def _handle_tts_response(event, response_text: str):
                         )
                     ],
                 )
-        finally:
-            # Clean up temporary file
-            try:
-                import os
-
-                os.remove(ogg_file_path)
-            except Exception as cleanup_error:
-                print(
-                    f"Warning: Failed to cleanup TTS temp file {ogg_file_path}: {cleanup_error}"
-                )
-
-        # Send truncation notice if needed
-        if was_truncated:
-            await event.reply(
-                f"{BOT_META_INFO_PREFIX}🔊 **TTS Note:** Text was truncated to {tts_util.TTS_MAX_LENGTH} characters for voice generation."
-            )
 
     except Exception as e:
         # Handle TTS errors gracefully
@@ -6518,114 +6627,19 @@ async def handle_live_mode_message(event):
     gemini_live_util.live_session_manager.update_session_activity(chat_id)
 
     try:
-        # Get API key
-        api_key = get_effective_gemini_api_key(event.sender_id)
-        if not api_key:
-            await send_info_message(event, "❌ API key not found.")
-            return
-
-        gemini_api = gemini_live_util.GeminiLiveAPI(api_key, user_id=event.sender_id)
-
-        # Start the session context manager if not already started
-        if session._session_context is None:
-            try:
-                # Store the context manager and enter it properly
-                session._session_context = session.session
-                session._live_connection = await session._session_context.__aenter__()
-                session.is_connected = True
-                print(f"Live session connected for chat {chat_id}")
-
-                # Start response listener
-                session._response_task = asyncio.create_task(
-                    handle_live_mode_responses(session, event)
-                )
-            except Exception as conn_error:
-                print(f"Failed to connect live session: {conn_error}")
-                traceback.print_exc()
-
-                # Clean up on connection failure
-                session._session_context = None
-                session.is_connected = False
-
-                await event.reply(
-                    f"{BOT_META_INFO_PREFIX}❌ Failed to connect to live session: {str(conn_error)}"
-                )
-                return
-
-        live_session = session._live_connection
-
-        # Handle different message types with connection error recovery
         if event.text:
-            # Text message
-            try:
-                await gemini_api.send_text(live_session, event.text)
-            except Exception as send_error:
-                print(f"Error sending to live session: {send_error}")
-                traceback.print_exc()
-
-                # Check if it's a connection error - if so, mark session as disconnected
-                if (
-                    "connection" in str(send_error).lower()
-                    or "websocket" in str(send_error).lower()
-                ):
-                    session.is_connected = False
-                    session._session_context = None
-                    await event.reply(
-                        f"{BOT_META_INFO_PREFIX}❌ Live session connection lost. Use `/live` to restart."
-                    )
-                    return
-                else:
-                    # Other error - still notify user
-                    await event.reply(
-                        f"{BOT_META_INFO_PREFIX}❌ Error in live session: {str(send_error)}"
-                    )
-                    return
+            await session.send_text(event.text)
 
         elif event.audio or event.voice:
-            # Audio message
-            media_info = await event.download_media(bytes)
-            if media_info:
-                # Save to temp file for processing
-                with tempfile.NamedTemporaryFile(
-                    suffix=".ogg", delete=False
-                ) as temp_file:
-                    temp_file.write(media_info)
-                    temp_path = temp_file.name
-
-                try:
-                    # Convert OGG to PCM for Gemini
-                    pcm_data = await gemini_live_util.AudioProcessor.convert_ogg_to_pcm(
-                        temp_path
-                    )
-
-                    # Send audio with connection error handling
-                    try:
-                        await gemini_api.send_audio_chunk(live_session, pcm_data)
-                    except Exception as send_error:
-                        print(f"Error sending audio to live session: {send_error}")
-                        traceback.print_exc()
-
-                        # Check if it's a connection error
-                        if (
-                            "connection" in str(send_error).lower()
-                            or "websocket" in str(send_error).lower()
-                        ):
-                            session.is_connected = False
-                            session._session_context = None
-                            await event.reply(
-                                f"{BOT_META_INFO_PREFIX}❌ Live session connection lost. Use `/live` to restart."
-                            )
-                            return
-                        else:
-                            # Other error - still notify user
-                            await event.reply(
-                                f"{BOT_META_INFO_PREFIX}❌ Error sending audio to live session: {str(send_error)}"
-                            )
-                            return
-
-                finally:
-                    # Clean up temp file
-                    Path(temp_path).unlink(missing_ok=True)
+            # Decode the audio while it downloads and stream it into the session.
+            await session.send_audio(
+                audio_util.iter_audio_to_pcm(
+                    event.client.iter_download(event.media),
+                    sample_rate=gemini_live_util.GEMINI_AUDIO_SAMPLE_RATE,
+                    channels=gemini_live_util.GEMINI_AUDIO_CHANNELS,
+                    frame_duration=gemini_live_util.GEMINI_AUDIO_FRAME_DURATION,
+                )
+            )
 
         elif event.video:
             # For now, handle video as audio extraction
@@ -6637,68 +6651,54 @@ async def handle_live_mode_message(event):
     except Exception as e:
         print(f"Error handling live mode message: {e}")
         traceback.print_exc()
-        await event.reply(
-            f"{BOT_META_INFO_PREFIX}❌ Error processing message: {str(e)}"
-        )
+        await event.reply(f"{BOT_META_INFO_PREFIX}❌ Error in live session: {str(e)}")
 
 
-async def handle_live_mode_responses(session, original_event):
-    """Handle responses from Gemini Live API."""
-    try:
-        live_session = session._live_connection
+async def handle_live_mode_response(session, response):
+    """Handle a server message from Gemini Live API."""
+    if response.text:
+        # Text response
+        await borg.send_message(session.chat_id, response.text)
+        print(f"Sent text response: {response.text[:50]}...")
 
-        async for response in live_session:
-            try:
-                # Handle different types of responses
-                if hasattr(response, "text") and response.text:
-                    # Text response
-                    await borg.send_message(session.chat_id, response.text)
-                    print(f"Sent text response: {response.text[:50]}...")
+    elif response.data:
+        # Audio response: voice notes are sent at pauses while the model talks.
+        if session.voice_reply is None:
 
-                elif hasattr(response, "data") and response.data:
-                    # Audio response
-                    audio_data = response.data
+            async def send_voice_note(ogg_data):
+                async with borg.action(session.chat_id, "audio"):
+                    await borg.send_file(
+                        session.chat_id, ogg_data, attributes=[], voice_note=True
+                    )
 
-                    # Convert audio to OGG format for Telegram
-                    try:
-                        ogg_data = (
-                            await gemini_live_util.AudioProcessor.convert_pcm_to_ogg(
-                                audio_data, sample_rate=24000
-                            )
-                        )
+            async def send_voice_note_failed(_error):
+                # Fallback: tell the user instead of dropping the note silently
+                await borg.send_message(
+                    session.chat_id, "[Audio response - processing failed]"
+                )
 
-                        # Send as voice message
-                        async with borg.action(session.chat_id, "audio") as action:
-                            await borg.send_file(
-                                session.chat_id,
-                                ogg_data,
-                                attributes=[],
-                                voice_note=True,
-                            )
-                        print(f"Sent voice response: {len(ogg_data)} bytes")
-                    except Exception as audio_error:
-                        print(f"Error processing audio response: {audio_error}")
-                        traceback.print_exc()
-                        # Fallback: send as text if audio processing fails
-                        await borg.send_message(
-                            session.chat_id, "[Audio response - processing failed]"
-                        )
+            session.voice_reply = gemini_live_util.LiveVoiceReply(
+                send_voice_note, on_error=send_voice_note_failed
+            )
+        session.voice_reply.feed(response.data)
 
-                # Update session activity
-                gemini_live_util.live_session_manager.update_session_activity(
-                    session.chat_id
-                )
+    content = response.server_content
+    if content and (content.turn_complete or content.interrupted):
+        voice_reply, session.voice_reply = session.voice_reply, None
+        if voice_reply:
+            await voice_reply.finish()
 
-            except Exception as e:
-                print(f"Error processing individual response: {e}")
-                traceback.print_exc()
-                continue
+    # Update session activity
+    gemini_live_util.live_session_manager.update_session_activity(session.chat_id)
 
-    except Exception as e:
-        print(f"Error in response handler: {e}")
-        traceback.print_exc()
-        # Mark session as disconnected
-        session.is_connected = False
+
+async def handle_live_mode_close(session, reason):
+    """Tell the user that their live session has ended on its own."""
+    chat_manager.set_live_mode_enabled(session.chat_id, False)
+    await borg.send_message(
+        session.chat_id,
+        f"{BOT_META_INFO_PREFIX}🔴 {reason} Use `/live` to restart.",
+    )
 
 
 def get_streaming_delay(model_name: str) -> float:
@@ -6744,6 +6744,7 @@ async def chat_handler(event):
     group_id = event.grouped_id
 
     if group_id:
+        bot_util.record_album_message(event.message)
         if group_id in bot_util.PROCESSED_GROUP_IDS:
             return  # Already being processed
 
@@ -50,3 +50,21 @@ async def _(event):
 async def _(event):
     util.restart_brishes()
     await event.reply("Restarted brishes.")
+
+
+@borg.on(util.admin_cmd(pattern="^\.xm$"))
+async def _(event):
+    metrics = util.brish_pool.metrics()
+    server_stats = metrics.pop("server_stats")
+    lines = [
+        f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}"
+        for key, value in metrics.items()
+    ]
+    for index, stats in server_stats.items():
+        lines.append(
+            f"server {index}{' (persistent)' if stats['persistent'] else ''}:"
+            f" {stats['commands']} commands, mean {stats['mean_seconds']:.2f}s,"
+            f" max {stats['max_seconds']:.2f}s, last {stats['last_seconds']:.2f}s,"
+            f" {stats['timeouts']} timeouts"
+        )
+    await event.reply("\n".join(lines))
@@ -4,6 +4,7 @@
 # ** `.delalltext 99999999`
 # ** `.delallself`
 # ** `.delallselfreactions`
+# ** `.delresume`
 #
 # * @warning =self_only= is currently implemented as admin-only instead!
 ###
@@ -12,6 +13,7 @@ import json
 import os
 import re
 import struct
+import time
 from datetime import datetime
 from pathlib import Path
 
@@ -26,11 +28,13 @@ from telethon.tl.functions.messages import (
 from telethon.tl.types import UpdateMessageReactions
 from uniborg import util
 from uniborg.export_util import (
+    FloodWaitGate,
     export_root,
-    make_chat_export_data,
-    message_to_export,
+    iter_jsonl_reversed,
+    iter_messages_to_export,
     sanitize_path_part,
-    write_json_with_jq,
+    write_chat_export_stream,
+    write_json_atomic,
 )
 from uniborg.util import admin_cmd, embed2
 from brish import z
@@ -40,6 +44,9 @@ from tqdm.asyncio import tqdm
 
 REACTION_REFRESH_CHUNK_SIZE = 100
 TEXT_DELETE_SCAN_CHUNK_SIZE = 100
+DELETE_BATCH_SIZE = 100
+DELETE_REQUESTS_PER_SECOND = 1.0
+DELETE_REQUEST_BURST = 3
 DEFAULT_DELETE_EXPORT_ROOT = "~/tmp/tlg-deleter"
 TEXT_FILE_SUFFIXES = {".txt", ".md", ".markdown", ".org", ".rst", ".log"}
 HASHTAG_ONLY_RE = re.compile(r"#[^\W_]\w*", re.UNICODE)
@@ -83,6 +90,185 @@ def _flood_wait_seconds(e):
     return int(wait_seconds) + 1
 
 
+class _TokenBucket:
+    """Request rate limiter whose bucket is emptied and paused on FloodWait."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated_at = self.paused_until
+
+
+class _BatchDeleter:
+    """Exports and deletes scanned messages `DELETE_BATCH_SIZE` at a time.
+
+    A batch is only written to the export once it has been deleted; the ids
+    of batches that failed to delete are kept in `failed_ids`. The scan
+    cursor, counters and failed ids are checkpointed after every batch so the
+    session can be continued with `.delresume`.
+    """
+
+    def __init__(self, session, progress, *, params, checkpoint=None):
+        checkpoint = checkpoint or {}
+        self.session = session
+        self.progress = progress
+        self.params = params
+        self.bucket = _TokenBucket(DELETE_REQUESTS_PER_SECOND, DELETE_REQUEST_BURST)
+        self.pending = []
+        self.offset_id = checkpoint.get("offset_id", 0)
+        self.scanned_count = checkpoint.get("scanned_count", 0)
+        self.skipped_count = checkpoint.get("skipped_count", 0)
+        self.deleted_count = checkpoint.get("deleted_count", 0)
+        self.failed_ids = set(checkpoint.get("failed_ids", []))
+        self.retry_count = checkpoint.get("flood_wait_retries", 0)
+        self.started_at = time.monotonic()
+        self.run_deleted_count = 0
+        self.postfix_extra = {}
+
+    async def scan(self, msg, *, delete):
+        self.scanned_count += 1
+        self.offset_id = msg.id
+        self.progress.update(1)
+        if delete:
+            self.pending.append(msg)
+            if len(self.pending) >= DELETE_BATCH_SIZE:
+                await self.flush()
+            return
+
+        self.skipped_count += 1
+        if not self.pending and self.scanned_count % DELETE_BATCH_SIZE == 0:
+            self.checkpoint()
+
+    @property
+    def failed_count(self):
+        return len(self.failed_ids)
+
+    async def retry_failed(self):
+        """Deletes the messages of batches that failed to delete in an earlier run."""
+        failed_ids = sorted(self.failed_ids, reverse=True)
+        for message_ids in _chunks(failed_ids, DELETE_BATCH_SIZE):
+            msgs = [
+                msg
+                for msg in await borg.get_messages(
+                    self.session["input_chat"], ids=message_ids
+                )
+                if msg
+            ]
+            # Messages that no longer exist have been deleted some other way.
+            self.failed_ids.difference_update(
+                set(message_ids) - {msg.id for msg in msgs}
+            )
+            if msgs:
+                await self._delete_batch(msgs)
+            self.checkpoint()
+        self.report()
+
+    async def flush(self):
+        batch, self.pending = self.pending, []
+        if not batch:
+            self.checkpoint()
+            return
+
+        await self._delete_batch(batch)
+        self.checkpoint()
+        self.report()
+
+    async def _delete_batch(self, batch):
+        rows = await _deleted_message_rows(self.session, batch)
+        message_ids = [msg.id for msg in batch]
+        while True:
+            await self.bucket.acquire()
+            try:
+                await borg.delete_messages(self.session["input_chat"], message_ids)
+                break
+            except FloodWaitError as e:
+                wait_seconds = _flood_wait_seconds(e)
+                self.retry_count += 1
+                self.bucket.pause(wait_seconds)
+                print(
+                    f"{self.session['command']} delete flood wait for {wait_seconds}s "
+                    f"on a batch of {len(message_ids)} messages",
+                    flush=True,
+                )
+            except Exception as e:
+                self.failed_ids.update(message_ids)
+                print(
+                    f"failed to delete messages {message_ids[0]}..{message_ids[-1]}: {e}",
+                    flush=True,
+                )
+                return
+
+        _append_delete_wip_jsonl(self.session, rows)
+        self.failed_ids.difference_update(message_ids)
+        self.deleted_count += len(message_ids)
+        self.run_deleted_count += len(message_ids)
+
+    def checkpoint(self, *, completed=False):
+        session = self.session
+        write_json_atomic(
+            {
+                "command": session["command"],
+                "chat_id": session["chat_id"],
+                "started_at": session["started_at"],
+                "runs": session["runs"],
+                "params": self.params,
+                "offset_id": self.offset_id,
+                "scanned_count": self.scanned_count,
+                "skipped_count": self.skipped_count,
+                "deleted_count": self.deleted_count,
+                "failed_count": self.failed_count,
+                "failed_ids": sorted(self.failed_ids),
+                "flood_wait_retries": self.retry_count,
+                "completed": completed,
+                "updated_at": time.time(),
+            },
+            session["checkpoint_path"],
+        )
+
+    def report(self, **extra):
+        self.postfix_extra.update(extra)
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        self.progress.set_postfix(
+            deleted=self.deleted_count,
+            failed=self.failed_count,
+            retries=self.retry_count,
+            rate=f"{self.run_deleted_count / elapsed:.1f}/s",
+            **self.postfix_extra,
+        )
+
+
+def _report_failed_deletes(deleter):
+    if deleter.failed_ids:
+        print(
+            f"{deleter.failed_count} messages could not be deleted; "
+            "use .delresume to retry them",
+            flush=True,
+        )
+
+
 def _reactions_have_own_reaction(reactions):
     if not reactions:
         return False
@@ -162,13 +348,17 @@ def _is_deletable_text_message(msg):
     return _is_deletable_text_only_message(msg) or _is_text_file_message(msg)
 
 
-async def _create_delete_export_session(event, command_name, chat, input_chat):
+async def _create_delete_export_session(
+    event, command_name, chat, input_chat, *, output_dir=None, checkpoint=None
+):
     human_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
     chat_id = event.chat_id
-    output_dir = (
-        export_root("BORG_DELETER_EXPORT_DIR", DEFAULT_DELETE_EXPORT_ROOT)
-        / f"DeleteSession_{command_name}_{chat_id}_{human_time}"
-    )
+    if output_dir is None:
+        output_dir = (
+            export_root("BORG_DELETER_EXPORT_DIR", DEFAULT_DELETE_EXPORT_ROOT)
+            / f"DeleteSession_{command_name}_{chat_id}_{human_time}"
+        )
+    checkpoint = checkpoint or {}
     session = {
         "command": command_name,
         "chat": chat,
@@ -177,51 +367,85 @@ async def _create_delete_export_session(event, command_name, chat, input_chat):
         "output_dir": output_dir,
         "output_path": output_dir / "result.json",
         "wip_jsonl_path": output_dir / "deleted_messages.wip.jsonl",
-        "messages": [],
+        "checkpoint_path": output_dir / "checkpoint.json",
         "sender_cache": {},
         "peer_cache": {},
-        "started_at": human_time,
+        "flood_gate": FloodWaitGate(),
+        "started_at": checkpoint.get("started_at", human_time),
+        "runs": checkpoint.get("runs", [])
+        + [{"started_at": human_time, "offset_id": checkpoint.get("offset_id", 0)}],
     }
     output_dir.mkdir(parents=True, exist_ok=True)
+    # Only deleted messages are exported, so rows written after the last
+    # checkpoint are kept; their messages are gone and will not be rescanned.
     session["wip_jsonl_path"].touch()
     return session
 
 
-def _append_delete_wip_jsonl(session, row):
+def _find_resumable_delete_session(chat_id):
+    """Return `(output_dir, checkpoint)` of the newest unfinished delete session of `chat_id`."""
+    latest = None
+    root = export_root("BORG_DELETER_EXPORT_DIR", DEFAULT_DELETE_EXPORT_ROOT)
+    for checkpoint_path in root.glob(f"DeleteSession_*_{chat_id}_*/checkpoint.json"):
+        try:
+            checkpoint = json.loads(checkpoint_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if checkpoint.get("chat_id") != chat_id or checkpoint.get("completed"):
+            continue
+        if latest is None or checkpoint.get("updated_at", 0) > latest[1].get(
+            "updated_at", 0
+        ):
+            latest = (checkpoint_path.parent, checkpoint)
+    return latest
+
+
+def _append_delete_wip_jsonl(session, rows):
     with session["wip_jsonl_path"].open("a", encoding="utf-8") as out:
-        out.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")))
-        out.write("\n")
+        for row in rows:
+            out.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")))
+            out.write("\n")
         out.flush()
         os.fsync(out.fileno())
 
 
-async def _export_deleted_message(session, msg):
-    row = await message_to_export(
-        msg,
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+async def _export_text_file(session, msg, row):
+    files_dir = session["output_dir"] / "files"
+    files_dir.mkdir(parents=True, exist_ok=True)
+    file_name = _message_file_name(msg) or f"message_{msg.id}.txt"
+    file_path = files_dir / f"{msg.id}_{sanitize_path_part(file_name)}"
+    try:
+        downloaded_path = await borg.download_media(message=msg, file=str(file_path))
+        if downloaded_path:
+            row["file"] = str(Path(downloaded_path).relative_to(session["output_dir"]))
+    except Exception as e:
+        row["file_export_error"] = str(e)
+        print(f"failed to export text file for message {msg.id}: {e}", flush=True)
+
+
+async def _deleted_message_rows(session, msgs):
+    """Returns the export rows of `msgs`, downloading the text files among them."""
+    rows = []
+    async for msg, row in iter_messages_to_export(
+        _aiter(msgs),
         session["input_chat"],
         session["sender_cache"],
         session["peer_cache"],
-    )
-
-    if _is_text_file_message(msg):
-        files_dir = session["output_dir"] / "files"
-        files_dir.mkdir(parents=True, exist_ok=True)
-        file_name = _message_file_name(msg) or f"message_{msg.id}.txt"
-        file_path = files_dir / f"{msg.id}_{sanitize_path_part(file_name)}"
-        try:
-            downloaded_path = await borg.download_media(message=msg, file=str(file_path))
-            if downloaded_path:
-                row["file"] = str(Path(downloaded_path).relative_to(session["output_dir"]))
-        except Exception as e:
-            row["file_export_error"] = str(e)
-            print(f"failed to export text file for message {msg.id}: {e}", flush=True)
-
-    session["messages"].append(row)
-    _append_delete_wip_jsonl(session, row)
+        flood_gate=session["flood_gate"],
+    ):
+        if _is_text_file_message(msg):
+            await _export_text_file(session, msg, row)
+        rows.append(row)
+    return rows
 
 
 def _export_delete_metadata_jsonl(session, row):
-    _append_delete_wip_jsonl(session, row)
+    _append_delete_wip_jsonl(session, [row])
 
 
 def _write_delete_export_session(session, *, extra=None):
@@ -231,18 +455,29 @@ def _write_delete_export_session(session, *, extra=None):
         "started_at": session["started_at"],
         "export_type": "deleter",
     }
+    if len(session["runs"]) > 1:
+        metadata["runs"] = session["runs"]
     if extra:
         metadata.update(extra)
 
-    export_data = make_chat_export_data(
+    message_count = 0
+
+    def messages():
+        nonlocal message_count
+        for row in iter_jsonl_reversed(session["wip_jsonl_path"]):
+            if row.get("type") == "message":
+                message_count += 1
+                yield row
+
+    write_chat_export_stream(
         session["chat"],
         session["chat_id"],
-        list(reversed(session["messages"])),
+        messages(),
+        session["output_path"],
         deletion_session=metadata,
     )
-    write_json_with_jq(export_data, session["output_path"])
     print(
-        f"{session['command']} export wrote {len(session['messages'])} messages "
+        f"{session['command']} export wrote {message_count} messages "
         f"to {session['output_path']}",
         flush=True,
     )
@@ -319,51 +554,44 @@ async def _delete_participant_reactions(peer, participant, command_name):
         return bool(result)
 
 
-@borg.on(events.NewMessage(pattern=r"(?i)^\.del\s+(?P<self_only>s?)\s*(?P<n>\d+)$"))
-async def _(event):
-    # USERBOT ONLY (Can't get_messages in bot API)
-
-    # embed2()
-    if not (await util.isAdmin(event) and event.message.forward == None):
-        # print("deleter: not admin")
-        return
-
-    await event.delete()
-
-    n = int(event.pattern_match.group("n") or 1)
-    self_only = bool(event.pattern_match.group("self_only"))
-    print(f"del received: n={n}, self_only={self_only}", flush=True)
-
-    chat = await event.get_chat()
-    input_chat = await event.get_input_chat()
-    export_session = await _create_delete_export_session(event, "del", chat, input_chat)
-    delete_count = 0
+async def _run_del(export_session, *, n, self_only, checkpoint=None):
+    chat = export_session["chat"]
     reaction_delete_count = 0
     min_reaction_messages = {}
 
-    async for msg in tqdm(
-        borg.iter_messages(chat, limit=n), total=n, desc="Deleting messages"
-    ):
-        delete_msg = not self_only or await util.isAdmin(None, msg=msg)
-
-        if self_only:
-            if _has_own_reaction(msg):
-                try:
-                    await _clear_own_reaction(chat, msg)
-                    reaction_delete_count += 1
-                except Exception as e:
-                    print(f"failed to delete reaction on message {msg.id}: {e}", flush=True)
-            elif not delete_msg and _has_min_reactions(msg):
-                min_reaction_messages[msg.id] = msg
-
-        if not delete_msg:
-            continue
-
-        ic(msg.raw_text)
-        await _export_deleted_message(export_session, msg)
-        await msg.delete()
-        delete_count += 1
-        # embed2()
+    with tqdm(total=n, desc="Deleting messages") as progress:
+        deleter = _BatchDeleter(
+            export_session,
+            progress,
+            params={"requested_limit": n, "self_only": self_only},
+            checkpoint=checkpoint,
+        )
+        progress.update(deleter.scanned_count)
+        await deleter.retry_failed()
+        async for msg in borg.iter_messages(
+            chat, limit=n - deleter.scanned_count, offset_id=deleter.offset_id
+        ):
+            delete_msg = not self_only or await util.isAdmin(None, msg=msg)
+
+            if self_only:
+                if _has_own_reaction(msg):
+                    try:
+                        await _clear_own_reaction(chat, msg)
+                        reaction_delete_count += 1
+                    except Exception as e:
+                        print(
+                            f"failed to delete reaction on message {msg.id}: {e}",
+                            flush=True,
+                        )
+                elif not delete_msg and _has_min_reactions(msg):
+                    min_reaction_messages[msg.id] = msg
+
+            if delete_msg:
+                ic(msg.raw_text)
+            await deleter.scan(msg, delete=delete_msg)
+            # embed2()
+        await deleter.flush()
+    delete_count = deleter.deleted_count
 
     print(f"deleted {delete_count} messages!", flush=True)
     if self_only:
@@ -377,27 +605,37 @@ async def _(event):
             "requested_limit": n,
             "self_only": self_only,
             "deleted_count": delete_count,
+            "failed_count": deleter.failed_count,
+            "flood_wait_retries": deleter.retry_count,
         },
     )
+    _report_failed_deletes(deleter)
+    deleter.checkpoint(completed=not deleter.failed_ids)
 
 
-@borg.on(events.NewMessage(pattern=r"(?i)^\.delalltext\s+(?P<n>\d+)$"))
+@borg.on(events.NewMessage(pattern=r"(?i)^\.del\s+(?P<self_only>s?)\s*(?P<n>\d+)$"))
 async def _(event):
+    # USERBOT ONLY (Can't get_messages in bot API)
+
+    # embed2()
     if not (await util.isAdmin(event) and event.message.forward == None):
+        # print("deleter: not admin")
         return
 
     await event.delete()
 
-    n = int(event.pattern_match.group("n"))
+    n = int(event.pattern_match.group("n") or 1)
+    self_only = bool(event.pattern_match.group("self_only"))
+    print(f"del received: n={n}, self_only={self_only}", flush=True)
+
     chat = await event.get_chat()
     input_chat = await event.get_input_chat()
-    export_session = await _create_delete_export_session(
-        event, "delalltext", chat, input_chat
-    )
-    scanned_count = 0
-    delete_count = 0
-    skip_count = 0
-    offset_id = 0
+    export_session = await _create_delete_export_session(event, "del", chat, input_chat)
+    await _run_del(export_session, n=n, self_only=self_only)
+
+
+async def _run_delalltext(export_session, *, n, checkpoint=None):
+    input_chat = export_session["input_chat"]
 
     with tqdm(
         total=n,
@@ -406,50 +644,113 @@ async def _(event):
         miniters=1,
         dynamic_ncols=True,
     ) as progress:
-        while scanned_count < n:
-            page_limit = min(TEXT_DELETE_SCAN_CHUNK_SIZE, n - scanned_count)
+        deleter = _BatchDeleter(
+            export_session,
+            progress,
+            params={"requested_limit": n},
+            checkpoint=checkpoint,
+        )
+        progress.update(deleter.scanned_count)
+        await deleter.retry_failed()
+        while deleter.scanned_count < n:
+            page_limit = min(TEXT_DELETE_SCAN_CHUNK_SIZE, n - deleter.scanned_count)
             page = [
                 msg
                 async for msg in borg.iter_messages(
-                    input_chat, limit=page_limit, offset_id=offset_id
+                    input_chat, limit=page_limit, offset_id=deleter.offset_id
                 )
             ]
             if not page:
                 break
 
-            offset_id = page[-1].id
-
             for msg in page:
-                scanned_count += 1
-                progress.update(1)
-
-                if not _is_deletable_text_message(msg):
-                    skip_count += 1
-                    continue
-
-                try:
-                    await _export_deleted_message(export_session, msg)
-                    await msg.delete()
-                    delete_count += 1
-                    progress.set_postfix(deleted=delete_count, skipped=skip_count)
-                except Exception as e:
-                    print(f"failed to delete text message {msg.id}: {e}", flush=True)
+                await deleter.scan(msg, delete=_is_deletable_text_message(msg))
+            deleter.report(skipped=deleter.skipped_count)
+        await deleter.flush()
 
     print(
-        f"scanned {scanned_count} messages; deleted {delete_count} text messages/files; "
-        f"skipped {skip_count} messages",
+        f"scanned {deleter.scanned_count} messages; "
+        f"deleted {deleter.deleted_count} text messages/files; "
+        f"skipped {deleter.skipped_count} messages",
         flush=True,
     )
     _write_delete_export_session(
         export_session,
         extra={
             "requested_limit": n,
-            "scanned_count": scanned_count,
-            "deleted_count": delete_count,
-            "skipped_count": skip_count,
+            "scanned_count": deleter.scanned_count,
+            "deleted_count": deleter.deleted_count,
+            "failed_count": deleter.failed_count,
+            "flood_wait_retries": deleter.retry_count,
+            "skipped_count": deleter.skipped_count,
             "text_file_suffixes": sorted(TEXT_FILE_SUFFIXES),
         },
     )
+    _report_failed_deletes(deleter)
+    deleter.checkpoint(completed=not deleter.failed_ids)
+
+
+@borg.on(events.NewMessage(pattern=r"(?i)^\.delalltext\s+(?P<n>\d+)$"))
+async def _(event):
+    if not (await util.isAdmin(event) and event.message.forward == None):
+        return
+
+    await event.delete()
+
+    n = int(event.pattern_match.group("n"))
+    chat = await event.get_chat()
+    input_chat = await event.get_input_chat()
+    export_session = await _create_delete_export_session(
+        event, "delalltext", chat, input_chat
+    )
+    await _run_delalltext(export_session, n=n)
+
+
+@borg.on(events.NewMessage(pattern=r"(?i)^\.delresume$"))
+async def _(event):
+    if not (await util.isAdmin(event) and event.message.forward == None):
+        return
+
+    await event.delete()
+
+    resumable = _find_resumable_delete_session(event.chat_id)
+    if resumable is None:
+        print(f"delresume: no unfinished delete session in {event.chat_id}", flush=True)
+        return
+
+    output_dir, checkpoint = resumable
+    command_name = checkpoint["command"]
+    params = checkpoint["params"]
+    print(
+        f"delresume: continuing {command_name} in {output_dir} from "
+        f"offset_id={checkpoint['offset_id']} "
+        f"(scanned={checkpoint['scanned_count']}, deleted={checkpoint['deleted_count']}, "
+        f"failed={len(checkpoint.get('failed_ids', []))} to retry)",
+        flush=True,
+    )
+    chat = await event.get_chat()
+    input_chat = await event.get_input_chat()
+    export_session = await _create_delete_export_session(
+        event,
+        command_name,
+        chat,
+        input_chat,
+        output_dir=output_dir,
+        checkpoint=checkpoint,
+    )
+    if command_name == "del":
+        await _run_del(
+            export_session,
+            n=params["requested_limit"],
+            self_only=params["self_only"],
+            checkpoint=checkpoint,
+        )
+    elif command_name == "delalltext":
+        await _run_delalltext(
+            export_session, n=params["requested_limit"], checkpoint=checkpoint
+        )
+    else:
+        raise ValueError(f"Unknown resumable delete command: {command_name!r}")
 
 
 @borg.on(events.NewMessage(pattern=r"(?i)^\.delallself$"))
@@ -1,17 +1,20 @@
 import asyncio
-import importlib
+import glob
 import io
 import os
 import shutil
+import time
 import traceback
 from pathlib import Path
 
 from telethon import events
-from uniborg import util
+from uniborg import bot_util, util
+from uniborg.chunk_worker import get_chunking_service
 from brish import zs
 
 # --- New: For handling grouped messages ---
 PROCESSED_GROUP_IDS = set()
+bot_util.register_album_recorder(borg)
 
 # --- Configuration ---
 # A set of supported ebook file extensions (case-insensitive).
@@ -33,6 +36,12 @@ EBOOK_COVER_EXTENSIONS = {
     ".cbz",
 }
 
+# Seconds before ebook-cover and epub2md are killed.
+EBOOK_PROCESSING_TIMEOUT = 30 * 60
+
+# Extensions that `.split` can chunk into text files
+SPLIT_EXTENSIONS = EBOOK_EXTENSIONS | {".pdf"}
+
 # AUTO_PROCESS_MODE configuration
 # "PV": only processes books sent in private chats
 # dict: a mapping of chat names to chat IDs - only process books sent in those chat IDs
@@ -41,20 +50,10 @@ AUTO_PROCESS_MODE = {
 }
 
 
-def _get_epub_util():
-    return importlib.import_module("uniborg.epub_util")
-
-
-def _get_chunking_backend_notice():
-    chunking = importlib.import_module("epub_sum_lib.chunking")
-    is_available, reason = chunking.get_semantic_chunking_status()
-    if is_available:
-        return None
-
-    return (
-        "Semantic chunking dependencies are unavailable "
-        f"({reason}); using sentence-based fallback."
-    )
+# chat_id -> set of running `.split` chunking tasks, for `.splitcancel`
+ACTIVE_SPLIT_JOBS = {}
+# Minimum seconds between progress edits of the `.split` status message
+SPLIT_PROGRESS_INTERVAL = 3
 
 
 async def should_auto_process(event):
@@ -128,7 +127,17 @@ async def process_ebooks_and_clean(cwd, event, *, include_conversion=True):
 
     # Directly use the brishz_helper to get the command result, which allows
     # us to control the output sent back to the user.
-    res = await util.brishz_helper(util.persistent_brish, cwd, full_command, fork=True)
+    try:
+        res = await util.brishz_helper(
+            util.brish_pool,
+            cwd,
+            full_command,
+            fork=True,
+            timeout=EBOOK_PROCESSING_TIMEOUT,
+        )
+    except util.BrishTimeoutError as e:
+        await util.send_output(event, str(e), retcode=124)
+        return
 
     if res.retcode == 0:
         # On success, delete the original ebook files to prevent re-upload.
@@ -159,6 +168,7 @@ async def ebook_handler(event):
     # --- Grouped message handling ---
     group_id = event.grouped_id
     if group_id:
+        bot_util.record_album_message(event.message)
         if group_id in PROCESSED_GROUP_IDS:
             return  # This album is already being processed
 
@@ -195,20 +205,19 @@ async def ebook_handler(event):
                 pass
 
         if group_id:
-            # Give a bit more time before allowing the same group to be processed again
-            await asyncio.sleep(10)
             PROCESSED_GROUP_IDS.discard(group_id)
 
 
-async def split_ebook_and_clean(cwd, event):
+async def split_ebook_and_clean(cwd, event, *, status_message=None):
     """
     Finds the ebook file in the directory, chunks it using the advanced
-    epub_util, saves the chunks as text files, and deletes the original.
+    epub_util (or pdf_util for PDFs) in the chunking worker process, saves the
+    chunks as text files, and deletes the original.
     """
     ebook_files = [
         f
         for f in Path(cwd).iterdir()
-        if f.is_file() and f.suffix.lower() in EBOOK_EXTENSIONS
+        if f.is_file() and f.suffix.lower() in SPLIT_EXTENSIONS
     ]
 
     if not ebook_files:
@@ -217,35 +226,58 @@ async def split_ebook_and_clean(cwd, event):
 
     if len(ebook_files) > 1:
         await event.reply(
-            "Warning: Multiple EPUBs found. Splitting only the first one."
+            "Warning: Multiple ebooks found. Splitting only the first one."
         )
 
     ebook_file = ebook_files[0]
+    book_name = ebook_file.stem
+    last_progress_at = time.monotonic()
 
-    try:
-        fallback_notice = _get_chunking_backend_notice()
-        if fallback_notice:
-            await event.reply(fallback_notice)
-
-        epub_util = _get_epub_util()
-        # Use the new, sophisticated chunking utility
-        chunks = epub_util.chunk_epub(str(ebook_file))
-
-        if not chunks:
-            await event.reply("Could not extract any text from the EPUB.")
+    async def report_progress(chunk_count):
+        nonlocal last_progress_at
+        now = time.monotonic()
+        if status_message is None or now - last_progress_at < SPLIT_PROGRESS_INTERVAL:
             return
 
-        book_name = ebook_file.stem
-
-        # Save chunks to sequentially named text files
-        for i, chunk in enumerate(chunks):
-            chunk_filename = Path(cwd) / f"{book_name}_part_{i+1:03d}.txt"
-            with open(chunk_filename, "w", encoding="utf-8") as f:
-                f.write(chunk)
-
+        last_progress_at = now
+        try:
+            await status_message.edit(
+                f"Splitting ebook into text chunks... ({chunk_count} done)"
+            )
+        except Exception:
+            pass
+
+    job = asyncio.create_task(
+        get_chunking_service().chunk_ebook_to_files(
+            ebook_file,
+            cwd,
+            book_name=book_name,
+            on_progress=report_progress,
+            on_notice=event.reply,
+        )
+    )
+    chat_jobs = ACTIVE_SPLIT_JOBS.setdefault(event.chat_id, set())
+    chat_jobs.add(job)
+    try:
+        # `asyncio.wait` lets `.splitcancel` cancel only the job, not this task.
+        await asyncio.wait({job})
+        if job.cancelled():
+            for chunk_file in Path(cwd).glob(f"{glob.escape(book_name)}_part_*.txt"):
+                chunk_file.unlink()
+            await event.reply("Ebook splitting cancelled.")
+        elif not job.result():
+            await event.reply("Could not extract any text from the ebook.")
+
+    except asyncio.CancelledError:
+        job.cancel()
+        raise
     except Exception as e:
-        await event.reply(f"An error occurred during EPUB chunking: {e}")
+        await event.reply(f"An error occurred during ebook chunking: {e}")
     finally:
+        chat_jobs.discard(job)
+        if not chat_jobs:
+            ACTIVE_SPLIT_JOBS.pop(event.chat_id, None)
+
         # Delete original ebook files to prevent re-upload
         for f in ebook_files:
             if f.exists():
@@ -255,33 +287,38 @@ async def split_ebook_and_clean(cwd, event):
 @borg.on(util.admin_cmd(pattern=r"^\.split$"))
 async def split_ebook_handler(event):
     """
-    Handles the .split command for an EPUB file. Chunks the EPUB's
+    Handles the .split command for an EPUB or PDF file. Chunks the book's
     text content into multiple text files using structural and semantic splitting.
     """
     replied_msg = await event.get_reply_message()
-    has_epub = (
-        event.file and Path(event.file.name or "").suffix.lower() in EBOOK_EXTENSIONS
+    has_ebook = (
+        event.file and Path(event.file.name or "").suffix.lower() in SPLIT_EXTENSIONS
     )
-    reply_has_epub = (
+    reply_has_ebook = (
         replied_msg
         and replied_msg.file
-        and Path(replied_msg.file.name or "").suffix.lower() in EBOOK_EXTENSIONS
+        and Path(replied_msg.file.name or "").suffix.lower() in SPLIT_EXTENSIONS
     )
 
-    if not has_epub and not reply_has_epub:
+    if not has_ebook and not reply_has_ebook:
         await event.reply(
-            "Please reply to a message with an EPUB file or send one with the `.split` command."
+            "Please reply to a message with an EPUB or PDF file or send one with the `.split` command."
         )
         return
 
     status_message = None
     try:
         # A bot cannot edit a user's message. It must send a new one.
-        status_message = await event.reply("Splitting EPUB into text chunks...")
+        status_message = await event.reply("Splitting ebook into text chunks...")
+
+        async def splitting_function(cwd, event):
+            return await split_ebook_and_clean(
+                cwd, event, status_message=status_message
+            )
 
         await util.run_and_upload(
             event=event,
-            to_await=split_ebook_and_clean,
+            to_await=splitting_function,
             quiet=True,
             album_mode=True,  # Upload all generated .txt files together
         )
@@ -292,3 +329,15 @@ async def split_ebook_handler(event):
                 await status_message.delete()
             except Exception:
                 pass
+
+
+@borg.on(util.admin_cmd(pattern=r"^\.splitcancel$"))
+async def split_cancel_handler(event):
+    """Cancels the `.split` jobs running in this chat."""
+    chat_jobs = ACTIVE_SPLIT_JOBS.get(event.chat_id)
+    if not chat_jobs:
+        await event.reply("No ebook splitting in progress in this chat.")
+        return
+
+    for job in list(chat_jobs):
+        job.cancel()
@@ -1,3 +1,5 @@
+import json
+import os
 import signal
 import time
 import traceback
@@ -10,18 +12,23 @@ from telethon import events
 
 from uniborg import util
 from uniborg.export_util import (
+    append_jsonl_row,
     entity_display_name,
     export_root,
-    make_chat_export_data,
-    message_to_export,
+    iter_jsonl_reversed,
+    iter_messages_to_export,
     sanitize_path_part,
-    write_json_with_jq,
+    write_chat_export_stream,
+    write_json_atomic,
 )
 
 
 DEFAULT_EXPORT_ROOT = "~/tmp/.borg/chat_exports"
 PROGRESS_EVERY_MESSAGES = 250
 PROGRESS_EVERY_SECONDS = 10
+CHECKPOINT_EVERY_MESSAGES = 100
+WIP_JSONL_NAME = "messages.wip.jsonl"
+CHECKPOINT_NAME = "export_checkpoint.json"
 
 
 @dataclass
@@ -33,6 +40,7 @@ class ExportState:
     started_at: float
     stop_requested: bool = False
     exported_count: int = 0
+    offset_id: int = 0
     last_progress_at: float = 0
     last_progress_count: int = 0
 
@@ -92,7 +100,46 @@ def _print_progress(state: ExportState, *, force: bool = False):
     state.last_progress_count = state.exported_count
 
 
-@borg.on(events.NewMessage(pattern=r"(?i)^\.export(?:\s+(?P<limit>all|\d+))?\s*$"))
+def _write_checkpoint(state: ExportState, wip_file):
+    wip_file.flush()
+    os.fsync(wip_file.fileno())
+    write_json_atomic(
+        {
+            "chat_id": state.chat_id,
+            "chat_name": state.chat_name,
+            "limit": state.limit,
+            "offset_id": state.offset_id,
+            "exported_count": state.exported_count,
+            "jsonl_size": wip_file.tell(),
+            "updated_at": time.time(),
+        },
+        state.output_path.parent / CHECKPOINT_NAME,
+    )
+
+
+def _find_resumable_export(chat_id):
+    """Return `(output_dir, checkpoint)` of the newest unfinished export of `chat_id`."""
+    latest = None
+    root = export_root("BORG_HISTORY_EXPORT_DIR", DEFAULT_EXPORT_ROOT)
+    for checkpoint_path in root.glob(f"*/ChatExport_*/{CHECKPOINT_NAME}"):
+        try:
+            checkpoint = json.loads(checkpoint_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if checkpoint.get("chat_id") != chat_id:
+            continue
+        if latest is None or checkpoint.get("updated_at", 0) > latest[1].get(
+            "updated_at", 0
+        ):
+            latest = (checkpoint_path.parent, checkpoint)
+    return latest
+
+
+@borg.on(
+    events.NewMessage(
+        pattern=r"(?i)^\.export(?:\s+(?P<resume>resume)|\s+(?P<limit>all|\d+))?\s*$"
+    )
+)
 async def history_export_handler(event):
     if not (await util.isAdmin(event) and event.message.forward is None):
         return
@@ -100,6 +147,7 @@ async def history_export_handler(event):
     await event.delete()
 
     started_at = time.monotonic()
+    resume = bool(event.pattern_match.group("resume"))
     limit_arg = event.pattern_match.group("limit")
     limit = None if not limit_arg or limit_arg.lower() == "all" else int(limit_arg)
 
@@ -107,13 +155,26 @@ async def history_export_handler(event):
         chat = await event.get_chat()
         input_chat = await event.get_input_chat()
         chat_name = entity_display_name(chat)
-        export_unix_time = time.time_ns()
-        output_dir = (
-            export_root("BORG_HISTORY_EXPORT_DIR", DEFAULT_EXPORT_ROOT)
-            / sanitize_path_part(chat_name)
-            / f"ChatExport_{date.today().isoformat()}-{export_unix_time}"
-        )
+        checkpoint = None
+        if resume:
+            resumable = _find_resumable_export(event.chat_id)
+            if resumable is None:
+                print(
+                    "HistoryExport: no interrupted export to resume for "
+                    f"{chat_name!r} ({event.chat_id})"
+                )
+                return
+            output_dir, checkpoint = resumable
+            limit = checkpoint.get("limit")
+        else:
+            export_unix_time = time.time_ns()
+            output_dir = (
+                export_root("BORG_HISTORY_EXPORT_DIR", DEFAULT_EXPORT_ROOT)
+                / sanitize_path_part(chat_name)
+                / f"ChatExport_{date.today().isoformat()}-{export_unix_time}"
+            )
         output_path = output_dir / "result.json"
+        wip_jsonl_path = output_dir / WIP_JSONL_NAME
 
         state = ExportState(
             chat_name=chat_name,
@@ -124,49 +185,70 @@ async def history_export_handler(event):
             last_progress_at=started_at,
         )
 
-        messages = []
+        output_dir.mkdir(parents=True, exist_ok=True)
+        if checkpoint:
+            state.offset_id = checkpoint.get("offset_id", 0)
+            state.exported_count = checkpoint.get("exported_count", 0)
+            state.last_progress_count = state.exported_count
+            # Drop rows appended after the last checkpoint; they will be re-fetched.
+            os.truncate(wip_jsonl_path, checkpoint.get("jsonl_size", 0))
+            print(
+                "HistoryExport: resuming "
+                f"{chat_name!r} ({event.chat_id}) from offset_id={state.offset_id} "
+                f"with {state.exported_count} messages already exported"
+            )
+        else:
+            wip_jsonl_path.write_bytes(b"")
+
         sender_cache = {}
         peer_cache = {}
         _ACTIVE_EXPORTS.append(state)
         _print_progress(state, force=True)
-        if limit is None:
-            async for message in event.client.iter_messages(input_chat):
-                if state.stop_requested:
-                    break
-                messages.append(
-                    await message_to_export(
-                        message, input_chat, sender_cache, peer_cache
-                    )
-                )
-                state.exported_count = len(messages)
-                _print_progress(state)
-        else:
-            async for message in event.client.iter_messages(input_chat, limit=limit):
-                if state.stop_requested:
-                    break
-                messages.append(
-                    await message_to_export(
-                        message, input_chat, sender_cache, peer_cache
-                    )
+        remaining = None if limit is None else limit - state.exported_count
+        with wip_jsonl_path.open("ab") as wip_file:
+            _write_checkpoint(state, wip_file)
+            if remaining is None or remaining > 0:
+                exported = iter_messages_to_export(
+                    event.client.iter_messages(
+                        input_chat, limit=remaining, offset_id=state.offset_id
+                    ),
+                    input_chat,
+                    sender_cache,
+                    peer_cache,
                 )
-                state.exported_count = len(messages)
-                _print_progress(state)
+                try:
+                    async for message, row in exported:
+                        append_jsonl_row(wip_file, row)
+                        state.offset_id = message.id
+                        state.exported_count += 1
+                        if state.exported_count % CHECKPOINT_EVERY_MESSAGES == 0:
+                            _write_checkpoint(state, wip_file)
+                        _print_progress(state)
+                        if state.stop_requested:
+                            break
+                finally:
+                    await exported.aclose()
+            _write_checkpoint(state, wip_file)
 
         if state.stop_requested:
             print(
                 "HistoryExport: writing partial export for "
-                f"{chat_name!r} ({event.chat_id}) after interrupt"
+                f"{chat_name!r} ({event.chat_id}) after interrupt; "
+                "continue it with `.export resume`"
             )
 
-        output_messages = list(reversed(messages))
-        export_data = make_chat_export_data(chat, event.chat_id, output_messages)
-        write_json_with_jq(export_data, output_path)
+        write_chat_export_stream(
+            chat, event.chat_id, iter_jsonl_reversed(wip_jsonl_path), output_path
+        )
+        if not state.stop_requested:
+            wip_jsonl_path.unlink()
+            (output_dir / CHECKPOINT_NAME).unlink()
         _print_progress(state, force=True)
 
         elapsed = time.monotonic() - started_at
         print(
             "HistoryExport: exported "
-            f"{len(messages)} messages from {chat_name!r} ({event.chat_id}) "
+            f"{state.exported_count} messages from {chat_name!r} ({event.chat_id}) "
             f"to {output_path} in {elapsed:.1f}s"
         )
         if state in _ACTIVE_EXPORTS:
@@ -4,6 +4,9 @@ from functools import partial
 from uniborg.util import embed2, brishz
 from brish import zs
 
+# Seconds before a render is killed.
+TEX2PNG_TIMEOUT = 120
+
 
 @borg.on(events.NewMessage(pattern=r"^\.tex\s+(.+)$"))
 async def _(event):
@@ -19,5 +22,8 @@ async def _(event):
 
         command = zs("tex2png {tex}")
         await util.run_and_upload(
-            event=event, to_await=partial(brishz, cmd=command, fork=True, shell=False)
+            event=event,
+            to_await=partial(
+                brishz, cmd=command, fork=True, shell=False, timeout=TEX2PNG_TIMEOUT
+            ),
         )
@@ -1,7 +1,10 @@
 from icecream import ic
 from uniborg import util
+from uniborg import bot_util
 from uniborg import llm_util
 from uniborg import llm_db
+from uniborg import audio_util
+from uniborg import history_util
 from uniborg.constants import (
     GEMINI_FLASH_LATEST,
     GEMINI_STT_LATEST,
@@ -13,8 +16,14 @@ from uniborg.constants import (
     STT_RETRIES_PER_MODEL,
     STT_RETRY_SLEEP,
     STT_RETRY_MAX_DELAY,
+    STT_SEGMENT_MIN_DURATION,
+    STT_SEGMENT_DURATION,
+    STT_SEGMENT_OVERLAP,
+    STT_SEGMENT_CONCURRENCY,
 )
 import os
+import re
+import hashlib
 import traceback
 import llm
 import uuid
@@ -115,6 +124,11 @@ Do not add any commentary, apologies, or text outside of the final JSON object.
 
 # Set this as the active prompt
 TRANSCRIPTION_PROMPT = TRANSCRIPTION_PROMPT_V6
+
+# Appended to the prompt for each segment of a long recording.
+SEGMENT_PROMPT_NOTE = r"""
+Note: The attached audio is part {index} of {count} of one longer recording, so it may begin or end mid-sentence. Transcribe only this part, without `---` separators.
+"""
 print(f"STT Prompt Loaded:\n\n{TRANSCRIPTION_PROMPT}\n---\n\n")
 
 # Route llm-library Gemini calls through GEMINI_SPECIAL_HTTP_PROXY (no-op if unset).
@@ -180,6 +194,7 @@ async def _transcribe_with_retry(
     api_key,
     status_message,
     italics_marker,
+    prompt=TRANSCRIPTION_PROMPT,
 ):
     """Run the transcription prompt, cycling through STT_MODELS on transient errors.
 
@@ -213,7 +228,7 @@ async def _transcribe_with_retry(
             global_attempt += 1
             try:
                 response = await current_model.prompt(
-                    prompt=TRANSCRIPTION_PROMPT,
+                    prompt=prompt,
                     attachments=attachments,
                     schema=TranscriptionResult,
                     key=api_key,
@@ -277,12 +292,344 @@ async def _transcribe_with_retry(
                 await asyncio.sleep(delay)
 
 
+# --- Long-Audio Segmentation ---
+
+STT_SEGMENTABLE_AUDIO_SUFFIXES = {
+    ".ogg",
+    ".oga",
+    ".opus",
+    ".m4a",
+    ".aac",
+    ".mp3",
+    ".wav",
+    ".flac",
+}
+STITCH_MAX_OVERLAP_WORDS = 20
+
+
+def plan_stt_segments(
+    duration: float,
+    silences: list[tuple[float, float]],
+    *,
+    target: float = STT_SEGMENT_DURATION,
+    overlap: float = STT_SEGMENT_OVERLAP,
+) -> list[tuple[float, float]]:
+    """Split ``[0, duration]`` into ``(start, end)`` windows of about ``target`` seconds.
+
+    Each cut is made in the middle of the silence closest to the target length
+    (within ±25%), or at the target length if there is none. Adjacent windows
+    share ``overlap`` seconds around each cut so no word is lost to a hard cut.
+    """
+    cut_points = [(start + end) / 2 for start, end in silences]
+    windows = []
+    start = 0.0
+    while duration - start > target * 1.25:
+        ideal_cut = start + target
+        candidates = [
+            cut
+            for cut in cut_points
+            if start + target * 0.75 <= cut <= start + target * 1.25
+        ]
+        cut = (
+            min(candidates, key=lambda c: abs(c - ideal_cut))
+            if candidates
+            else ideal_cut
+        )
+        windows.append((max(0.0, start - overlap), cut + overlap))
+        start = cut
+    windows.append((max(0.0, start - overlap), duration))
+    return windows
+
+
+def _normalize_word(word: str) -> str:
+    return re.sub(r"\W+", "", word.lower())
+
+
+def _stitch_transcripts(parts: list[str]) -> str:
+    """Join segment transcripts, dropping words repeated across the overlap."""
+    stitched = ""
+    for part in parts:
+        part = part.strip()
+        if not part:
+            continue
+        if not stitched:
+            stitched = part
+            continue
+
+        previous_words = [
+            _normalize_word(w) for w in stitched.split()[-STITCH_MAX_OVERLAP_WORDS:]
+        ]
+        next_words = [
+            _normalize_word(w) for w in part.split()[:STITCH_MAX_OVERLAP_WORDS]
+        ]
+        # A single shared word is too likely to be a coincidence.
+        for n in range(min(len(previous_words), len(next_words)), 1, -1):
+            if previous_words[-n:] == next_words[:n] and any(next_words[:n]):
+                part = part[re.match(rf"(?:\s*\S+){{{n}}}\s*", part).end() :]
+                break
+
+        if part:
+            # Continue a sentence cut at the segment boundary on the same line.
+            separator = "\n\n" if re.search(r"[.!?…。؟»\"')*_`]$", stitched) else " "
+            stitched = f"{stitched}{separator}{part}"
+    return stitched
+
+
+def _format_timestamp(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def _parse_transcription_result(json_response_text: str) -> TranscriptionResult:
+    clean_json_text = (
+        json_response_text.strip().removeprefix("```json").removesuffix("```").strip()
+    )
+    return TranscriptionResult.model_validate(json.loads(clean_json_text))
+
+
+async def _get_long_audio(cwd) -> Optional[tuple[Path, float]]:
+    """Return ``(path, duration)`` if ``cwd`` holds a single audio file long enough to segment."""
+    files = [p for p in Path(cwd).iterdir() if p.is_file()]
+    if len(files) != 1 or files[0].suffix.lower() not in STT_SEGMENTABLE_AUDIO_SUFFIXES:
+        return None
+
+    try:
+        duration = await audio_util.probe_duration(files[0])
+    except audio_util.TranscodeError as e:
+        print(f"STT: could not probe {files[0].name}: {e}")
+        return None
+
+    if duration is None or duration < STT_SEGMENT_MIN_DURATION:
+        return None
+    return files[0], duration
+
+
+async def _transcribe_segmented(
+    *,
+    audio_path,
+    duration,
+    model_name,
+    api_key,
+    status_message,
+    italics_marker,
+):
+    """Transcribe long audio in silence-aligned segments, concurrently.
+
+    At most STT_SEGMENT_CONCURRENCY segments are transcribed at once, each with
+    its own ``_transcribe_with_retry``, so a transient error only repeats that
+    segment. Returns the stitched result as ``TranscriptionResult`` JSON; a
+    segment that still fails is marked in the transcript unless all of them do.
+    """
+    try:
+        await util.edit_message(
+            status_message,
+            f"{italics_marker}Splitting {_format_timestamp(duration)} of audio…{italics_marker}",
+            parse_mode="md",
+        )
+    except Exception:
+        pass  # Progress edit is best-effort.
+    silences = await audio_util.detect_silences(audio_path)
+    windows = plan_stt_segments(duration, silences)
+    print(f"STT: transcribing {audio_path.name} in {len(windows)} segments")
+
+    semaphore = asyncio.Semaphore(STT_SEGMENT_CONCURRENCY)
+    done_count = 0
+
+    async def transcribe_window(index, start, end):
+        nonlocal done_count
+        async with semaphore:
+            audio = await audio_util.extract_audio_segment(
+                audio_path, start=start, duration=end - start
+            )
+            json_response_text = await _transcribe_with_retry(
+                model_name=model_name,
+                attachments=[llm.Attachment(content=audio, type="audio/ogg")],
+                api_key=api_key,
+                status_message=status_message,
+                italics_marker=italics_marker,
+                prompt=TRANSCRIPTION_PROMPT
+                + SEGMENT_PROMPT_NOTE.format(index=index + 1, count=len(windows)),
+            )
+
+        try:
+            transcription = _parse_transcription_result(
+                json_response_text
+            ).transcription
+        except Exception as parse_error:
+            print(f"STT: segment {index + 1} returned unparsable JSON: {parse_error}")
+            transcription = json_response_text.strip()
+
+        done_count += 1
+        try:
+            await util.edit_message(
+                status_message,
+                f"{italics_marker}Transcribing… {done_count}/{len(windows)} parts done{italics_marker}",
+                parse_mode="md",
+            )
+        except Exception:
+            pass  # Progress edit is best-effort.
+        return transcription
+
+    results = await asyncio.gather(
+        *(
+            transcribe_window(index, start, end)
+            for index, (start, end) in enumerate(windows)
+        ),
+        return_exceptions=True,
+    )
+
+    failures = [r for r in results if isinstance(r, BaseException)]
+    if len(failures) == len(results):
+        raise failures[0]
+
+    parts = []
+    for (start, end), result in zip(windows, results):
+        if isinstance(result, BaseException):
+            parts.append(
+                f"{italics_marker}[{_format_timestamp(start)}–{_format_timestamp(end)} "
+                f"could not be transcribed: {type(result).__name__}]{italics_marker}"
+            )
+        else:
+            parts.append(result)
+
+    transcription = _stitch_transcripts(parts)
+    return TranscriptionResult(
+        transcription=transcription,
+        output_type="transcript" if transcription else "none",
+        error_message=(
+            f"{len(failures)} of {len(results)} segments could not be transcribed."
+            if failures
+            else None
+        ),
+    ).model_dump_json()
+
+
+# --- Transcription Cache ---
+
+# Part of every cache key, so editing the prompt invalidates old results.
+_PROMPT_DIGEST = hashlib.sha256(TRANSCRIPTION_PROMPT.encode("utf-8")).hexdigest()
+STT_CACHE_VERSION = _PROMPT_DIGEST[:12]
+
+
+def _stt_document_cache_id(message) -> Optional[str]:
+    """Cache id for a lone media message, by its Telegram document or photo id.
+
+    Returns None for albums and replies, whose transcription covers more than
+    this message's media.
+    """
+    if message.grouped_id or message.reply_to_msg_id:
+        return None
+    if message.document:
+        return f"{STT_CACHE_VERSION}:doc:{message.document.id}"
+    if message.photo:
+        return f"{STT_CACHE_VERSION}:photo:{message.photo.id}"
+    return None
+
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def _stt_content_cache_id(cwd) -> Optional[str]:
+    """Cache id for the downloaded media in ``cwd``, by the sha256 of the files."""
+    files = [p for p in Path(cwd).iterdir() if p.is_file()]
+    if not files:
+        return None
+    digests = sorted(
+        await asyncio.gather(*(asyncio.to_thread(_hash_file, p) for p in files))
+    )
+    combined = hashlib.sha256("\n".join(digests).encode("utf-8")).hexdigest()
+    return f"{STT_CACHE_VERSION}:sha256:{combined}"
+
+
+async def _send_transcription(
+    event, status_message, json_response_text, *, api_key, italics_marker="__"
+) -> Optional[TranscriptionResult]:
+    """Format a ``TranscriptionResult`` JSON reply into ``status_message``.
+
+    Returns the parsed result, or None if the response could not be parsed and
+    was shown raw.
+    """
+    # Parse the single JSON object and format it for the user
+    result = None
+    final_output_message = ""
+    try:
+        # The entire data blob is our result object
+        result = _parse_transcription_result(json_response_text)
+
+        output_parts = []
+        if result.transcription:
+            # output_parts.append(f"**Transcription:**\n{result.transcription}")
+            output_parts.append(f"{result.transcription}")
+
+        if result.visual_description:
+            output_parts.append(f"\n**Visuals:**\n{result.visual_description}")
+
+        if not output_parts:
+            message = result.error_message or "[No speech or text detected]"
+            output_parts.append(f"{italics_marker}{message}{italics_marker}")
+
+        final_output_message = "\n\n".join(output_parts)
+
+    except (json.JSONDecodeError, Exception) as parse_error:
+        print(f"Error parsing model's JSON response: {parse_error}")
+        final_output_message = f"**Could not parse structured response, showing raw output:**\n\n```json\n{json_response_text}\n```"
+
+    final_output_message = (
+        final_output_message
+        or "{italics_marker}No content was generated.{italics_marker}"
+    )
+    await util.edit_message(
+        status_message,
+        final_output_message,
+        reply_to=event.message,
+        link_preview=False,
+        parse_mode="md",
+        file_name_mode="llm",
+        send_file_mode=util.SendFileMode.ALSO_IF_LESS_THAN,
+        file_length_threshold=STT_FILE_LENGTH_THRESHOLD,
+        file_only_threshold=STT_FILE_ONLY_LENGTH_THRESHOLD,
+        api_keys={
+            "gemini": api_key,
+        },
+    )
+    return result
+
+
+async def reply_with_cached_transcription(event) -> bool:
+    """Answer a lone media message from the transcription cache, without downloading it.
+
+    Returns True if the cached transcription was sent.
+    """
+    cache_id = _stt_document_cache_id(event.message)
+    if not cache_id:
+        return False
+
+    api_key = get_effective_gemini_api_key(event.sender_id)
+    if not api_key:
+        return False
+
+    json_response_text = await history_util.get_cached_stt_result(cache_id)
+    if not json_response_text:
+        return False
+
+    print(f"STT: cache hit for {cache_id}")
+    status_message = await event.reply("Transcribing...")
+    await _send_transcription(
+        event, status_message, json_response_text, api_key=api_key
+    )
+    return True
+
+
 async def llm_stt(*, cwd, event, model_name=STT_MODELS[0], log=True):
     """
     Performs speech-to-text on media, enforcing a single structured JSON output
     that synthesizes all provided files.
     """
-    parse_mode = "md"
     italics_marker = "__"
 
     api_key = get_effective_gemini_api_key(event.sender_id)
@@ -311,17 +658,42 @@ async def llm_stt(*, cwd, event, model_name=STT_MODELS[0], log=True):
         )
         return
 
-    # --- Refactored Attachment Creation ---
-    # The complex logic of iterating files, checking MIME types, and reading
-    # content is now handled by the centralized utility function.
-    attachments = llm_util.create_attachments_from_dir(Path(cwd))
+    # A single long recording is transcribed in segments instead of one request.
+    long_audio = await _get_long_audio(cwd)
 
-    if not attachments:
-        await event.reply("No valid media files found to transcribe.")
-        return
+    if long_audio is None:
+        # --- Refactored Attachment Creation ---
+        # The complex logic of iterating files, checking MIME types, and reading
+        # content is now handled by the centralized utility function.
+        attachments = llm_util.create_attachments_from_dir(Path(cwd))
+
+        if not attachments:
+            await event.reply("No valid media files found to transcribe.")
+            return
 
     status_message = await event.reply("Transcribing...")
 
+    cache_ids = [
+        cache_id
+        for cache_id in (
+            _stt_document_cache_id(event.message),
+            await _stt_content_cache_id(cwd),
+        )
+        if cache_id
+    ]
+    for cache_id in cache_ids:
+        json_response_text = await history_util.get_cached_stt_result(cache_id)
+        if json_response_text:
+            print(f"STT: cache hit for {cache_id}")
+            await _send_transcription(
+                event,
+                status_message,
+                json_response_text,
+                api_key=api_key,
+                italics_marker=italics_marker,
+            )
+            return
+
     json_response_text = None
     try:
         # Route this request's Gemini traffic through GEMINI_SPECIAL_HTTP_PROXY if configured.
@@ -329,66 +701,38 @@ async def llm_stt(*, cwd, event, model_name=STT_MODELS[0], log=True):
         proxy_url, _ = llm_util.get_proxy_config_or_error(event.sender_id)
         proxy_token = llm_util.set_llm_gemini_proxy(proxy_url)
         try:
-            # Transcribe, cycling through fallback models on transient upstream errors.
-            json_response_text = await _transcribe_with_retry(
-                model_name=model_name,
-                attachments=attachments,
-                api_key=api_key,
-                status_message=status_message,
-                italics_marker=italics_marker,
-            )
+            if long_audio:
+                audio_path, duration = long_audio
+                json_response_text = await _transcribe_segmented(
+                    audio_path=audio_path,
+                    duration=duration,
+                    model_name=model_name,
+                    api_key=api_key,
+                    status_message=status_message,
+                    italics_marker=italics_marker,
+                )
+            else:
+                # Transcribe, cycling through fallback models on transient upstream errors.
+                json_response_text = await _transcribe_with_retry(
+                    model_name=model_name,
+                    attachments=attachments,
+                    api_key=api_key,
+                    status_message=status_message,
+                    italics_marker=italics_marker,
+                )
         finally:
             llm_util.reset_llm_gemini_proxy(proxy_token)
 
-        # Parse the single JSON object and format it for the user
-        final_output_message = ""
-        try:
-            clean_json_text = (
-                json_response_text.strip()
-                .removeprefix("```json")
-                .removesuffix("```")
-                .strip()
-            )
-            # The entire data blob is our result object
-            result_data = json.loads(clean_json_text)
-            result = TranscriptionResult.model_validate(result_data)
-
-            output_parts = []
-            if result.transcription:
-                # output_parts.append(f"**Transcription:**\n{result.transcription}")
-                output_parts.append(f"{result.transcription}")
-
-            if result.visual_description:
-                output_parts.append(f"\n**Visuals:**\n{result.visual_description}")
-
-            if not output_parts:
-                message = result.error_message or "[No speech or text detected]"
-                output_parts.append(f"{italics_marker}{message}{italics_marker}")
-
-            final_output_message = "\n\n".join(output_parts)
-
-        except (json.JSONDecodeError, Exception) as parse_error:
-            print(f"Error parsing model's JSON response: {parse_error}")
-            final_output_message = f"**Could not parse structured response, showing raw output:**\n\n```json\n{json_response_text}\n```"
-
-        final_output_message = (
-            final_output_message
-            or "{italics_marker}No content was generated.{italics_marker}"
-        )
-        await util.edit_message(
+        result = await _send_transcription(
+            event,
             status_message,
-            final_output_message,
-            reply_to=event.message,
-            link_preview=False,
-            parse_mode=parse_mode,
-            file_name_mode="llm",
-            send_file_mode=util.SendFileMode.ALSO_IF_LESS_THAN,
-            file_length_threshold=STT_FILE_LENGTH_THRESHOLD,
-            file_only_threshold=STT_FILE_ONLY_LENGTH_THRESHOLD,
-            api_keys={
-                "gemini": api_key,
-            },
+            json_response_text,
+            api_key=api_key,
+            italics_marker=italics_marker,
         )
+        if result is not None and result.error_message is None:
+            for cache_id in cache_ids:
+                await history_util.cache_stt_result(cache_id, json_response_text)
 
         if log:
             try:
@@ -464,6 +808,7 @@ async def set_bot_menu_commands():
 # --- Telethon Event Handlers ---
 
 PROCESSED_GROUP_IDS = set()
+bot_util.register_album_recorder(borg)
 
 
 @borg.on(events.NewMessage(pattern="/start", func=lambda e: e.is_private))
@@ -559,8 +904,13 @@ async def media_handler(event):
         llm_db.cancel_key_flow(user_id)
         await event.reply("API key setup cancelled. Processing your media instead...")
 
+    # A lone voice note transcribed before is answered without downloading it.
+    if await reply_with_cached_transcription(event):
+        return
+
     group_id = event.grouped_id
     if group_id:
+        bot_util.record_album_message(event.message)
         if group_id in PROCESSED_GROUP_IDS:
             return  # Already processing this group
 
@@ -568,11 +918,9 @@ async def media_handler(event):
         try:
             # util.run_and_upload is assumed to handle downloading files from the event
             # into a temporary directory `cwd` and passing it to the awaited function.
+            # It waits for the album to be complete before downloading it.
             await util.run_and_upload(event=event, to_await=llm_stt)
         finally:
-            await asyncio.sleep(
-                5
-            )  # Give some grace time for all messages to be processed
             PROCESSED_GROUP_IDS.remove(group_id)
     else:
         await util.run_and_upload(event=event, to_await=llm_stt)
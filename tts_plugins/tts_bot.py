@@ -1,5 +1,4 @@
 from pynight.common_icecream import ic
-import asyncio
 import json
 import os
 import shutil
@@ -169,16 +168,15 @@ async def message_handler(event, *, log_p=True):
 
     group_id = event.grouped_id
     if group_id:
+        bot_util.record_album_message(event.message)
         if group_id in bot_util.PROCESSED_GROUP_IDS:
             return
         bot_util.PROCESSED_GROUP_IDS.add(group_id)
-        await asyncio.sleep(0.2)
 
     status_message = await event.reply("Processing...")
     import tempfile
 
     temp_dir = Path(tempfile.gettempdir()) / f"temp_tts_bot_{event.id}"
-    ogg_file_path = None
 
     try:
         temp_dir.mkdir(exist_ok=True)
@@ -233,7 +231,7 @@ async def message_handler(event, *, log_p=True):
 
         await status_message.edit("Generating audio...")
         user_prefs = user_manager.get_prefs(event.sender_id)
-        ogg_file_path = await tts_util.generate_tts_audio(
+        ogg_data = await tts_util.generate_tts_ogg(
             text=final_text,
             voice=user_prefs.voice,
             model=user_prefs.model,
@@ -243,8 +241,8 @@ async def message_handler(event, *, log_p=True):
         )
 
         async with borg.action(event.chat, "audio") as action:
-            await event.client.send_file(
-                event.chat_id, ogg_file_path, voice_note=True, reply_to=event.id
+            await tts_util.send_voice_message(
+                event.client, event.chat_id, ogg_data, reply_to=event.id
             )
         await status_message.delete()
         if warnings:
@@ -261,8 +259,6 @@ async def message_handler(event, *, log_p=True):
     finally:
         if group_id:
             bot_util.PROCESSED_GROUP_IDS.discard(group_id)
-        if ogg_file_path and os.path.exists(ogg_file_path):
-            await util.async_remove_file(ogg_file_path)
         if temp_dir.exists():
             await util.async_remove_dir(str(temp_dir))
 
@@ -425,6 +421,7 @@ def register_handlers():
             func=lambda e: e.is_private and (e.text or e.media) and not e.forward
         )
     )(message_handler)
+    bot_util.register_album_recorder(borg)
 
 
 async def initialize_tts_bot():
@@ -0,0 +1,570 @@
+import asyncio
+import os
+import re
+import struct
+import sys
+import time
+from typing import Optional
+
+try:
+    # Optional: encodes PCM to Opus in-process instead of spawning ffmpeg.
+    # Needs the system libopus; `opuslib` raises a plain `Exception` without it.
+    import opuslib
+except Exception:
+    opuslib = None
+
+
+TRANSCODE_MAX_JOBS = int(os.environ.get("BORG_TRANSCODE_MAX_JOBS", os.cpu_count() or 1))
+
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+OPUS_FRAMES_PER_SECOND = 50  # 20ms frames
+OPUS_GRANULE_RATE = 48000
+OPUS_PRE_SKIP = 312
+OGG_PACKETS_PER_PAGE = 50
+
+_transcode_slots = None
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def _get_transcode_slots():
+    global _transcode_slots
+    if _transcode_slots is None:
+        _transcode_slots = asyncio.Semaphore(TRANSCODE_MAX_JOBS)
+    return _transcode_slots
+
+
+async def _start_ffmpeg(args, *, stdin_p: bool, loglevel="error"):
+    cmd = ["ffmpeg", "-hide_banner", "-nostats", "-loglevel", loglevel, *args]
+    try:
+        return await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if stdin_p else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError as e:
+        raise TranscodeError(
+            "ffmpeg not found. Please install ffmpeg for voice message support."
+        ) from e
+
+
+async def _run_ffmpeg(args, *, input_data: bytes = None, loglevel="error"):
+    """
+    Runs ffmpeg with `args` in a transcode slot and returns `(returncode,
+    stdout, stderr)`.
+
+    At most `TRANSCODE_MAX_JOBS` (`$BORG_TRANSCODE_MAX_JOBS`) transcodes run at
+    once, counting `pcm_to_ogg_opus` encodes; further calls wait for a slot.
+    """
+    async with _get_transcode_slots():
+        process = await _start_ffmpeg(
+            args, stdin_p=input_data is not None, loglevel=loglevel
+        )
+        try:
+            stdout, stderr = await process.communicate(input=input_data)
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+
+    return process.returncode, stdout, stderr.decode(errors="replace")
+
+
+def _check_ffmpeg_result(returncode, stdout, stderr) -> bytes:
+    if returncode != 0:
+        raise TranscodeError(f"FFmpeg conversion failed: {stderr or 'Unknown error'}")
+    return stdout
+
+
+async def ffmpeg_transcode(data: bytes, *, input_args=(), output_args) -> bytes:
+    """
+    Pipes `data` through ffmpeg's stdin and returns its stdout, without touching
+    the disk.
+    """
+    return _check_ffmpeg_result(
+        *await _run_ffmpeg(
+            [*input_args, "-i", "pipe:0", *output_args, "pipe:1"],
+            input_data=data,
+        )
+    )
+
+
+async def probe_duration(path) -> Optional[float]:
+    """Returns the duration of the media file at `path` in seconds, if known."""
+    # Without an output file ffmpeg exits with an error after printing the
+    # input's metadata.
+    _, _, stderr = await _run_ffmpeg(["-i", str(path)], loglevel="info")
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+async def detect_silences(
+    path, *, noise_db: float = -35, min_duration: float = 0.5
+) -> list[tuple[float, float]]:
+    """
+    Returns the `(start, end)` times in seconds of the silences in the audio at
+    `path`, using ffmpeg's `silencedetect` filter.
+    """
+    returncode, stdout, stderr = await _run_ffmpeg(
+        [
+            "-i",
+            str(path),
+            "-vn",
+            "-af",
+            f"silencedetect=noise={noise_db}dB:d={min_duration}",
+            "-f",
+            "null",
+            "-",
+        ],
+        loglevel="info",
+    )
+    _check_ffmpeg_result(returncode, stdout, stderr)
+
+    silences = []
+    silence_start = None
+    for line in stderr.splitlines():
+        if match := re.search(r"silence_start: (-?[\d.]+)", line):
+            silence_start = max(0.0, float(match.group(1)))
+        elif (match := re.search(r"silence_end: ([\d.]+)", line)) and (
+            silence_start is not None
+        ):
+            silences.append((silence_start, float(match.group(1))))
+            silence_start = None
+    return silences
+
+
+async def extract_audio_segment(
+    path,
+    *,
+    start: float,
+    duration: float,
+    sample_rate: int = 16000,
+    bitrate: int = 32000,
+) -> bytes:
+    """Returns `duration` seconds of the audio at `path` from `start` as mono OGG/Opus."""
+    return _check_ffmpeg_result(
+        *await _run_ffmpeg(
+            [
+                "-ss",
+                f"{start:.3f}",
+                "-t",
+                f"{duration:.3f}",
+                "-i",
+                str(path),
+                "-vn",
+                "-ac",
+                "1",
+                "-ar",
+                str(sample_rate),
+                "-c:a",
+                "libopus",
+                "-b:a",
+                str(bitrate),
+                "-f",
+                "ogg",
+                "pipe:1",
+            ]
+        )
+    )
+
+
+##
+# * Ogg Opus muxing for the in-process encoder
+
+
+def _make_ogg_crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_OGG_CRC_TABLE = _make_ogg_crc_table()
+
+
+def _ogg_crc(data: bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _OGG_CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+def _ogg_page(packets, *, serial, sequence, granule, header_type=0) -> bytes:
+    lacing = bytearray()
+    for packet in packets:
+        lacing.extend([255] * (len(packet) // 255))
+        lacing.append(len(packet) % 255)
+
+    header = struct.pack(
+        "<4sBBqIIIB",
+        b"OggS",
+        0,  # Version
+        header_type,
+        granule,
+        serial,
+        sequence,
+        0,  # CRC, filled in below
+        len(lacing),
+    )
+    page = bytearray(header + lacing + b"".join(packets))
+    struct.pack_into("<I", page, 22, _ogg_crc(page))
+    return bytes(page)
+
+
+def _encode_ogg_opus(pcm: bytes, *, sample_rate, channels, bitrate) -> bytes:
+    encoder = opuslib.Encoder(sample_rate, channels, opuslib.APPLICATION_AUDIO)
+    if bitrate:
+        encoder.bitrate = bitrate
+
+    frame_size = sample_rate // OPUS_FRAMES_PER_SECOND
+    frame_bytes = frame_size * channels * 2
+    granule_per_frame = OPUS_GRANULE_RATE // OPUS_FRAMES_PER_SECOND
+    serial = int.from_bytes(os.urandom(4), "little")
+
+    opus_head = struct.pack(
+        "<8sBBHIhB",
+        b"OpusHead",
+        1,  # Version
+        channels,
+        OPUS_PRE_SKIP,
+        sample_rate,
+        0,  # Output gain
+        0,  # Channel mapping family
+    )
+    vendor = b"uniborg"
+    opus_tags = struct.pack("<8sI", b"OpusTags", len(vendor)) + vendor
+    opus_tags += struct.pack("<I", 0)  # User comment count
+
+    pages = [
+        _ogg_page([opus_head], serial=serial, sequence=0, granule=0, header_type=2),
+        _ogg_page([opus_tags], serial=serial, sequence=1, granule=0),
+    ]
+
+    sample_count = len(pcm) // (channels * 2)
+    end_granule = OPUS_PRE_SKIP + sample_count * OPUS_GRANULE_RATE // sample_rate
+    # The encoder's lookahead delays the output by `OPUS_PRE_SKIP`, so the
+    # padded frames must cover it too.
+    frame_count = -(-end_granule // granule_per_frame)
+    packets = []
+    for index in range(frame_count):
+        offset = index * frame_bytes
+        frame = pcm[offset : offset + frame_bytes].ljust(frame_bytes, b"\0")
+        packets.append(encoder.encode(frame, frame_size))
+
+        is_last = index == frame_count - 1
+        if len(packets) == OGG_PACKETS_PER_PAGE or is_last:
+            pages.append(
+                _ogg_page(
+                    packets,
+                    serial=serial,
+                    sequence=len(pages),
+                    granule=(
+                        end_granule if is_last else (index + 1) * granule_per_frame
+                    ),
+                    header_type=4 if is_last else 0,
+                )
+            )
+            packets = []
+
+    return b"".join(pages)
+
+
+def opus_encoder_available(sample_rate: int) -> bool:
+    return opuslib is not None and sample_rate in OPUS_SAMPLE_RATES
+
+
+def _iter_ogg_pages(data: bytes):
+    """Yields `(granule, packets)` for each page, with packets reassembled across pages."""
+    position = 0
+    partial = b""
+    while position < len(data):
+        if data[position : position + 4] != b"OggS":
+            raise TranscodeError(f"Invalid Ogg page at byte {position}")
+
+        granule = struct.unpack_from("<q", data, position + 6)[0]
+        segment_count = data[position + 26]
+        lacing = data[position + 27 : position + 27 + segment_count]
+        position += 27 + segment_count
+
+        packets = []
+        for size in lacing:
+            partial += data[position : position + size]
+            position += size
+            if size < 255:
+                packets.append(partial)
+                partial = b""
+        yield granule, packets
+
+
+def _opus_packet_samples(packet: bytes) -> int:
+    """Returns the duration of an Opus packet in 48kHz samples (RFC 6716, 3.1)."""
+    config = packet[0] >> 3
+    if config < 12:
+        frame_samples = (480, 960, 1920, 2880)[config % 4]
+    elif config < 16:
+        frame_samples = (480, 960)[config % 2]
+    else:
+        frame_samples = (120, 240, 480, 960)[config % 4]
+
+    code = packet[0] & 0x3
+    if code == 0:
+        frame_count = 1
+    elif code in (1, 2):
+        frame_count = 2
+    else:
+        frame_count = packet[1] & 0x3F
+    return frame_samples * frame_count
+
+
+def concat_ogg_opus(segments: list[bytes]) -> bytes:
+    """
+    Joins OGG/Opus files encoded with the same channel count into one stream by
+    copying their Opus packets, without re-encoding.
+
+    The headers of the first segment are kept; the later segments' encoder
+    priming (a few milliseconds) is played instead of skipped.
+    """
+    if len(segments) == 1:
+        return segments[0]
+
+    # Reusing the first segment's serial keeps the output deterministic.
+    serial = struct.unpack_from("<I", segments[0], 14)[0]
+    pages = []
+    packets = []
+    granule = 0
+    for index, segment in enumerate(segments):
+        segment_packets = []
+        end_granule = 0
+        for page_granule, page_packets in _iter_ogg_pages(segment):
+            segment_packets.extend(page_packets)
+            end_granule = max(end_granule, page_granule)
+        headers, audio_packets = segment_packets[:2], segment_packets[2:]
+
+        if index == 0:
+            for header in headers:
+                pages.append(
+                    _ogg_page(
+                        [header],
+                        serial=serial,
+                        sequence=len(pages),
+                        granule=0,
+                        header_type=0 if pages else 2,
+                    )
+                )
+
+        segment_start = granule
+        is_last_segment = index == len(segments) - 1
+        for packet_index, packet in enumerate(audio_packets):
+            packets.append(packet)
+            granule += _opus_packet_samples(packet)
+
+            is_last = is_last_segment and packet_index == len(audio_packets) - 1
+            if len(packets) == OGG_PACKETS_PER_PAGE or is_last:
+                pages.append(
+                    _ogg_page(
+                        packets,
+                        serial=serial,
+                        sequence=len(pages),
+                        # Only the final page may trim the padding of the last frame
+                        granule=segment_start + end_granule if is_last else granule,
+                        header_type=4 if is_last else 0,
+                    )
+                )
+                packets = []
+
+    if packets:
+        pages.append(
+            _ogg_page(
+                packets,
+                serial=serial,
+                sequence=len(pages),
+                granule=granule,
+                header_type=4,
+            )
+        )
+
+    return b"".join(pages)
+
+
+##
+
+
+async def pcm_to_ogg_opus(
+    pcm: bytes,
+    *,
+    sample_rate: int,
+    channels: int = 1,
+    bitrate: int = None,
+    use_opus_encoder: bool = True,
+) -> bytes:
+    """
+    Encodes 16-bit little-endian PCM to an OGG/Opus voice message.
+
+    Uses `opuslib` in a thread when it is installed and `sample_rate` is one
+    Opus accepts natively, which avoids spawning ffmpeg; falls back to
+    `ffmpeg_transcode` otherwise. `bitrate` is in bits per second, and `None`
+    keeps the encoder's default.
+    """
+    if use_opus_encoder and opus_encoder_available(sample_rate):
+        async with _get_transcode_slots():
+            return await asyncio.to_thread(
+                _encode_ogg_opus,
+                pcm,
+                sample_rate=sample_rate,
+                channels=channels,
+                bitrate=bitrate,
+            )
+
+    output_args = ["-c:a", "libopus"]
+    if bitrate:
+        output_args += ["-b:a", str(bitrate)]
+    output_args += ["-f", "ogg"]
+    return await ffmpeg_transcode(
+        pcm,
+        input_args=["-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels)],
+        output_args=output_args,
+    )
+
+
+async def audio_to_ogg_opus(data: bytes, *, bitrate: int = None) -> bytes:
+    """Transcodes audio in any container ffmpeg can probe to OGG/Opus."""
+    output_args = ["-c:a", "libopus", "-ac", "1"]
+    if bitrate:
+        output_args += ["-b:a", str(bitrate)]
+    output_args += ["-f", "ogg"]
+    return await ffmpeg_transcode(data, output_args=output_args)
+
+
+async def audio_to_pcm(data: bytes, *, sample_rate: int, channels: int = 1) -> bytes:
+    """Decodes audio (e.g., a Telegram voice message) to 16-bit little-endian PCM."""
+    return await ffmpeg_transcode(
+        data,
+        output_args=["-ar", str(sample_rate), "-ac", str(channels), "-f", "s16le"],
+    )
+
+
+async def iter_audio_to_pcm(
+    chunks, *, sample_rate: int, channels: int = 1, frame_duration: float = 0.1
+):
+    """
+    Decodes audio arriving as `chunks` (an async iterable of bytes, e.g.
+    `client.iter_download`) to 16-bit little-endian PCM, yielding
+    `frame_duration`-second frames as soon as ffmpeg produces them. Only the
+    last frame may be shorter.
+    """
+    frame_size = round(sample_rate * frame_duration) * channels * 2
+    async with _get_transcode_slots():
+        process = await _start_ffmpeg(
+            [
+                "-i",
+                "pipe:0",
+                "-ar",
+                str(sample_rate),
+                "-ac",
+                str(channels),
+                "-f",
+                "s16le",
+                "pipe:1",
+            ],
+            stdin_p=True,
+        )
+
+        async def feed():
+            try:
+                async for chunk in chunks:
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                # ffmpeg exited early; its stderr explains why.
+                pass
+            finally:
+                process.stdin.close()
+
+        feeder = asyncio.create_task(feed())
+        stderr_reader = asyncio.create_task(process.stderr.read())
+        try:
+            while True:
+                try:
+                    frame = await process.stdout.readexactly(frame_size)
+                except asyncio.IncompleteReadError as e:
+                    if e.partial:
+                        yield e.partial
+                    break
+                yield frame
+
+            await feeder
+            returncode = await process.wait()
+            _check_ffmpeg_result(
+                returncode, b"", (await stderr_reader).decode(errors="replace")
+            )
+        finally:
+            feeder.cancel()
+            stderr_reader.cancel()
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+
+##
+
+
+async def _benchmark(*, seconds, clips):
+    import math
+
+    sample_rate = 24000
+    pcm = b"".join(
+        struct.pack("<h", int(8000 * math.sin(2 * math.pi * 440 * i / sample_rate)))
+        for i in range(sample_rate * seconds)
+    )
+
+    modes = [("ffmpeg", False)]
+    if opus_encoder_available(sample_rate):
+        modes.append(("opuslib", True))
+
+    for name, use_opus_encoder in modes:
+        cpu_before = os.times()
+        started_at = time.perf_counter()
+        latencies = []
+
+        async def encode_clip():
+            clip_started_at = time.perf_counter()
+            ogg = await pcm_to_ogg_opus(
+                pcm,
+                sample_rate=sample_rate,
+                bitrate=32000,
+                use_opus_encoder=use_opus_encoder,
+            )
+            latencies.append(time.perf_counter() - clip_started_at)
+            return ogg
+
+        oggs = await asyncio.gather(*(encode_clip() for _ in range(clips)))
+        elapsed = time.perf_counter() - started_at
+        cpu_after = os.times()
+        cpu = sum(cpu_after[:4]) - sum(cpu_before[:4])
+
+        pcm_back = await audio_to_pcm(oggs[0], sample_rate=sample_rate)
+        print(
+            f"{name}: {clips} clips of {seconds}s in {elapsed:.2f}s, "
+            f"latency avg {sum(latencies) / clips * 1000:.0f}ms "
+            f"max {max(latencies) * 1000:.0f}ms, CPU {cpu / clips * 1000:.0f}ms/clip, "
+            f"{len(oggs[0])} bytes, decoded {len(pcm_back) / len(pcm):.3f}x"
+        )
+
+
+if __name__ == "__main__":
+    # Benchmark: python -m uniborg.audio_util [clip_seconds] [clips]
+    asyncio.run(
+        _benchmark(
+            seconds=int(sys.argv[1]) if len(sys.argv) > 1 else 10,
+            clips=int(sys.argv[2]) if len(sys.argv) > 2 else 8,
+        )
+    )
@@ -6,6 +6,10 @@ This includes command registration, generic handlers, and message processing hel
 from pynight.common_icecream import ic
 import asyncio
 import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from telethon import events
 from telethon.tl.functions.bots import SetBotCommandsRequest
 from telethon.tl.types import BotCommand, BotCommandScopeDefault
@@ -22,6 +26,20 @@ from uniborg.constants import BOT_META_INFO_PREFIX
 # A set to track processed media group IDs to avoid redundant processing of albums.
 PROCESSED_GROUP_IDS = set()
 
+# An album counts as complete once no new member has arrived for this long.
+ALBUM_QUIET_PERIOD = float(os.environ.get("BORG_ALBUM_QUIET_PERIOD", "1.0"))
+ALBUM_INDEX_MAX_GROUPS = 1000
+
+
+@dataclass
+class _AlbumEntry:
+    messages: dict = field(default_factory=dict)
+    last_seen: float = 0.0
+
+
+#: (chat_id, grouped_id) -> the members seen so far, oldest groups first.
+_album_index: "OrderedDict[tuple, _AlbumEntry]" = OrderedDict()
+
 
 # --- Bot Initialization ---
 
@@ -59,6 +77,87 @@ async def register_bot_commands(borg, commands: list[dict]):
 # --- Message Processing Utilities ---
 
 
+def record_album_message(message, *, live=True):
+    """
+    Adds a media group member to the album index.
+
+    Called for every message of the NewMessage stream, so the index holds whole
+    albums without any `get_messages` lookups. `live=False` indexes messages
+    fetched after the fact, which do not extend the album's inactivity timer.
+    """
+    group_id = getattr(message, "grouped_id", None)
+    if not group_id:
+        return
+
+    key = (message.chat_id, group_id)
+    entry = _album_index.get(key)
+    if entry is None:
+        entry = _album_index[key] = _AlbumEntry()
+        while len(_album_index) > ALBUM_INDEX_MAX_GROUPS:
+            _album_index.popitem(last=False)
+
+    entry.messages[message.id] = message
+    if live:
+        entry.last_seen = time.monotonic()
+
+
+def register_album_recorder(borg):
+    """
+    Feeds the album index from `borg`'s NewMessage stream, for clients that do
+    not run `history_util.initialize_history_handler`. Safe to call on reload.
+
+    Handlers run in reverse registration order, so a handler that waits on an
+    album should also record its own event with `record_album_message`.
+    """
+    if getattr(borg, "_album_recorder_registered", False):
+        return
+    borg._album_recorder_registered = True
+
+    @borg.on(events.NewMessage(func=lambda e: e.grouped_id))
+    async def album_recorder(event):
+        record_album_message(event.message)
+
+
+async def wait_for_album(chat_id, group_id, *, quiet_period=ALBUM_QUIET_PERIOD):
+    """
+    Waits until no member of the album has arrived for `quiet_period` seconds
+    and returns its messages sorted by id, or None if the album is not indexed.
+    """
+    entry = _album_index.get((chat_id, group_id))
+    if entry is None:
+        return None
+
+    while True:
+        remaining = entry.last_seen + quiet_period - time.monotonic()
+        if remaining <= 0:
+            break
+        await asyncio.sleep(remaining)
+
+    return sorted(entry.messages.values(), key=lambda m: m.id)
+
+
+async def get_album_messages(client, chat_id, message, *, search_range=20):
+    """
+    Returns all members of `message`'s media group, sorted by id.
+
+    Albums seen on the NewMessage stream come from the index once complete.
+    Older ones are found by fetching the `search_range` messages around
+    `message`, and the result is indexed for later calls.
+    """
+    group_id = message.grouped_id
+    album_messages = await wait_for_album(chat_id, group_id)
+    if album_messages is not None:
+        return album_messages
+
+    search_ids = range(message.id - search_range, message.id + search_range + 1)
+    messages_in_vicinity = await client.get_messages(chat_id, ids=list(search_ids))
+    album_messages = [m for m in messages_in_vicinity if m and m.grouped_id == group_id]
+    for m in album_messages:
+        record_album_message(m, live=False)
+
+    return sorted(album_messages, key=lambda m: m.id)
+
+
 async def expand_and_sort_messages_with_groups(event, initial_messages):
     """
     Expands a list of messages to include all members of any media groups
@@ -72,15 +171,8 @@ async def expand_and_sort_messages_with_groups(event, initial_messages):
         group_id = msg.grouped_id
         if group_id and group_id not in processed_group_ids:
             try:
-                # Fetch messages in the vicinity to find all group members
-                k = 20  # Search range
-                search_ids = range(msg.id - k, msg.id + k + 1)
-                messages_in_vicinity = await event.client.get_messages(
-                    event.chat_id, ids=list(search_ids)
-                )
-                for m in messages_in_vicinity:
-                    if m and m.grouped_id == group_id:
-                        final_messages_map[m.id] = m
+                for m in await get_album_messages(event.client, event.chat_id, msg):
+                    final_messages_map[m.id] = m
                 processed_group_ids.add(group_id)
             except Exception as e:
                 print(f"Bot_Util: Could not expand message group {group_id}: {e}")
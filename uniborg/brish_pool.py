@@ -0,0 +1,337 @@
+import asyncio
+import os
+import signal
+import subprocess
+import time
+import traceback
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+
+from brish import Brish
+
+BRISH_IDLE_TIMEOUT = 5 * 60
+#: The default `timeout` of `BrishPool.run`, meaning the pool's own `timeout`.
+POOL_TIMEOUT = object()
+
+
+class BrishTimeoutError(Exception):
+    pass
+
+
+@dataclass
+class BrishServerStats:
+    commands: int = 0
+    timeouts: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    last_seconds: float = 0.0
+
+    def record(self, seconds: float):
+        self.commands += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.last_seconds = seconds
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.total_seconds / self.commands if self.commands else 0.0
+
+
+def _descendant_pids(pid: int) -> list[int]:
+    ps = subprocess.run(
+        ["ps", "-Ao", "pid=,ppid="], capture_output=True, text=True, timeout=10
+    )
+    children = defaultdict(list)
+    for line in ps.stdout.splitlines():
+        child, parent = map(int, line.split())
+        children[parent].append(child)
+
+    pids = []
+    stack = [pid]
+    while stack:
+        for child in children[stack.pop()]:
+            pids.append(child)
+            stack.append(child)
+    return pids
+
+
+class _BrishServer:
+    """A single-worker `Brish`, used by one command at a time."""
+
+    def __init__(self, index: int, *, boot_cmd=None):
+        self.index = index
+        self.brish = Brish(boot_cmd=boot_cmd, server_count=1)
+        self.pid = int(self.brish.z("echo $$").outrs)
+        self.stats = BrishServerStats()
+        self.idle_since = time.monotonic()
+
+    def kill(self):
+        """Kills the worker and everything it started, so its command ends."""
+        for pid in [*_descendant_pids(self.pid), self.pid]:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def cleanup(self):
+        try:
+            self.brish.cleanup()
+        except Exception:
+            traceback.print_exc()
+
+
+class BrishPool:
+    """
+    Runs shell commands on a pool of `Brish` servers, one command per server.
+
+    The pool starts with `min_servers`, starts more on demand up to
+    `max_servers`, and stops servers idle for `idle_timeout` seconds down to
+    `min_servers` again. When every server is busy, callers wait in FIFO
+    order. A command that exceeds its timeout is killed along with its
+    server, which is replaced by a fresh one.
+
+    `persistent_p` commands share a dedicated server whose shell state
+    persists between them, one at a time.
+    """
+
+    def __init__(
+        self,
+        *,
+        boot_cmd=None,
+        min_servers=1,
+        max_servers,
+        timeout=None,
+        idle_timeout=BRISH_IDLE_TIMEOUT,
+        executor=None,
+    ):
+        self.boot_cmd = boot_cmd
+        self.min_servers = min_servers
+        self.max_servers = max(max_servers, min_servers)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.executor = executor
+        self.servers = []
+        self.idle_servers = []
+        self.starting = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.server_available = asyncio.Condition()
+        self.persistent_server = None
+        self.persistent_lock = asyncio.Lock()
+        self._next_index = 0
+        self._scale_down_handle = None
+
+        for _ in range(min_servers):
+            server = self._start_server(self._new_server_index())
+            self.servers.append(server)
+            self.idle_servers.append(server)
+
+    def _new_server_index(self) -> int:
+        self._next_index += 1
+        return self._next_index - 1
+
+    def _start_server(self, index: int) -> _BrishServer:
+        return _BrishServer(index, boot_cmd=self.boot_cmd)
+
+    def _full_p(self) -> bool:
+        return (
+            not self.idle_servers
+            and len(self.servers) + self.starting >= self.max_servers
+        )
+
+    async def _acquire_server(self) -> _BrishServer:
+        loop = asyncio.get_running_loop()
+        async with self.server_available:
+            if self._full_p():
+                self.waiting += 1
+                self.waits += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+                started_at = time.monotonic()
+                try:
+                    while self._full_p():
+                        await self.server_available.wait()
+                finally:
+                    self.waiting -= 1
+                    self.wait_seconds += time.monotonic() - started_at
+
+            if self.idle_servers:
+                # The most recently used server, so the others can go idle.
+                return self.idle_servers.pop()
+
+            self.starting += 1
+
+        try:
+            server = await loop.run_in_executor(
+                self.executor, self._start_server, self._new_server_index()
+            )
+        except BaseException:
+            async with self.server_available:
+                self.starting -= 1
+                self.server_available.notify()
+            raise
+
+        async with self.server_available:
+            self.starting -= 1
+            self.servers.append(server)
+        return server
+
+    async def _release_server(self, server: _BrishServer, *, retire=False):
+        async with self.server_available:
+            if retire:
+                self.servers.remove(server)
+            else:
+                server.idle_since = time.monotonic()
+                self.idle_servers.append(server)
+            self.server_available.notify()
+
+        if retire:
+            asyncio.get_running_loop().run_in_executor(self.executor, server.cleanup)
+            asyncio.create_task(self._replenish())
+        self._schedule_scale_down()
+
+    async def _replenish(self):
+        """Starts servers until there are `min_servers` again."""
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self.server_available:
+                if len(self.servers) + self.starting >= self.min_servers:
+                    return
+                self.starting += 1
+
+            try:
+                server = await loop.run_in_executor(
+                    self.executor, self._start_server, self._new_server_index()
+                )
+            finally:
+                async with self.server_available:
+                    self.starting -= 1
+                    self.server_available.notify()
+
+            async with self.server_available:
+                self.servers.append(server)
+                self.idle_servers.append(server)
+                self.server_available.notify()
+
+    def _schedule_scale_down(self):
+        if self._scale_down_handle is not None:
+            return
+        if len(self.servers) <= self.min_servers:
+            return
+
+        def scale_down():
+            self._scale_down_handle = None
+            asyncio.create_task(self._scale_down())
+
+        self._scale_down_handle = asyncio.get_running_loop().call_later(
+            self.idle_timeout, scale_down
+        )
+
+    async def _scale_down(self):
+        now = time.monotonic()
+        stopped = []
+        async with self.server_available:
+            for server in list(self.idle_servers):
+                if len(self.servers) <= self.min_servers:
+                    break
+                if now - server.idle_since >= self.idle_timeout:
+                    self.idle_servers.remove(server)
+                    self.servers.remove(server)
+                    stopped.append(server)
+
+        loop = asyncio.get_running_loop()
+        for server in stopped:
+            loop.run_in_executor(self.executor, server.cleanup)
+        self._schedule_scale_down()
+
+    async def _run_on(self, server: _BrishServer, fn, timeout):
+        loop = asyncio.get_running_loop()
+        started_at = time.monotonic()
+        future = loop.run_in_executor(self.executor, fn, server.brish)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            # The command keeps its server busy until it is killed.
+            await loop.run_in_executor(self.executor, server.kill)
+            if isinstance(e, asyncio.TimeoutError):
+                server.stats.timeouts += 1
+                raise BrishTimeoutError(
+                    f"The command timed out after {timeout} seconds and was killed."
+                ) from e
+            raise
+        finally:
+            server.stats.record(time.monotonic() - started_at)
+
+    async def run(self, fn, *, timeout=POOL_TIMEOUT, persistent_p=False):
+        """
+        Awaits `fn(brish)` in a thread, with a `Brish` server to itself.
+
+        Raises `BrishTimeoutError` if it takes longer than `timeout` seconds
+        (default: the pool's `timeout`; None or 0 waits indefinitely).
+        """
+        if timeout is POOL_TIMEOUT:
+            timeout = self.timeout
+        timeout = timeout or None
+        if persistent_p:
+            async with self.persistent_lock:
+                if self.persistent_server is None:
+                    self.persistent_server = (
+                        await asyncio.get_running_loop().run_in_executor(
+                            self.executor, self._start_server, self._new_server_index()
+                        )
+                    )
+                server = self.persistent_server
+                try:
+                    return await self._run_on(server, fn, timeout)
+                except (BrishTimeoutError, asyncio.CancelledError):
+                    self.persistent_server = None
+                    asyncio.get_running_loop().run_in_executor(
+                        self.executor, server.cleanup
+                    )
+                    raise
+
+        server = await self._acquire_server()
+        retire = False
+        try:
+            return await self._run_on(server, fn, timeout)
+        except (BrishTimeoutError, asyncio.CancelledError):
+            retire = True
+            raise
+        finally:
+            await self._release_server(server, retire=retire)
+
+    def metrics(self) -> dict:
+        servers = list(self.servers)
+        if self.persistent_server is not None:
+            servers.append(self.persistent_server)
+        return {
+            "servers": len(self.servers),
+            "busy": len(self.servers) - len(self.idle_servers),
+            "starting": self.starting,
+            "min_servers": self.min_servers,
+            "max_servers": self.max_servers,
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_waiting,
+            "waits": self.waits,
+            "mean_wait_seconds": self.wait_seconds / self.waits if self.waits else 0.0,
+            "server_stats": {
+                server.index: {
+                    **asdict(server.stats),
+                    "mean_seconds": server.stats.mean_seconds,
+                    "persistent": server is self.persistent_server,
+                }
+                for server in servers
+            },
+        }
+
+    def cleanup(self):
+        """Stops every server, once their running commands have ended."""
+        servers = list(self.servers)
+        if self.persistent_server is not None:
+            servers.append(self.persistent_server)
+        self.servers = []
+        self.idle_servers = []
+        self.persistent_server = None
+        for server in servers:
+            server.cleanup()
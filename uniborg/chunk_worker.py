@@ -0,0 +1,144 @@
+import asyncio
+import multiprocessing
+import os
+
+from epub_sum_lib.chunk_jobs import run_chunk_worker
+
+
+CHUNK_WORKER_MAX_JOBS = int(os.environ.get("BORG_CHUNK_WORKER_JOBS", "1"))
+
+
+class ChunkingError(Exception):
+    pass
+
+
+class _ChunkWorker:
+    def __init__(self, mp_context):
+        self.mp_context = mp_context
+        self.process = None
+        self.conn = None
+
+    def ensure_started(self):
+        if self.process is not None and self.process.is_alive():
+            return
+
+        parent_conn, child_conn = self.mp_context.Pipe()
+        self.process = self.mp_context.Process(
+            target=run_chunk_worker, args=(child_conn,), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def kill(self):
+        if self.process is None:
+            return
+
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+
+class EbookChunkingService:
+    """
+    Runs `epub_util.iter_epub_chunks` and `pdf_util.iter_pdf_chunks` in
+    persistent worker processes.
+
+    At most `max_jobs` books are chunked at once; further jobs wait for a free
+    worker. Cancelling the awaiting task kills the busy worker, which is
+    respawned for the next job.
+    """
+
+    def __init__(self, *, max_jobs=CHUNK_WORKER_MAX_JOBS):
+        self.mp_context = multiprocessing.get_context("spawn")
+        self.max_jobs = max_jobs
+        self.workers = []
+        self.idle_workers = []
+        self.worker_available = asyncio.Condition()
+
+    async def _acquire_worker(self):
+        async with self.worker_available:
+            while not self.idle_workers and len(self.workers) >= self.max_jobs:
+                await self.worker_available.wait()
+
+            if self.idle_workers:
+                return self.idle_workers.pop()
+
+            worker = _ChunkWorker(self.mp_context)
+            self.workers.append(worker)
+            return worker
+
+    async def _release_worker(self, worker):
+        async with self.worker_available:
+            self.idle_workers.append(worker)
+            self.worker_available.notify()
+
+    async def chunk_ebook_to_files(
+        self,
+        ebook_path,
+        output_dir,
+        *,
+        book_name,
+        on_progress=None,
+        on_notice=None,
+    ):
+        """
+        Writes the chunks of the EPUB or PDF at `ebook_path` to `output_dir` as
+        `<book_name>_part_NNN.txt` and returns the chunk count.
+
+        `on_progress(chunk_count)` and `on_notice(text)` are optional async
+        callbacks.
+        """
+        worker = await self._acquire_worker()
+        try:
+            await asyncio.to_thread(worker.ensure_started)
+            worker.conn.send(
+                {
+                    "ebook_path": str(ebook_path),
+                    "output_dir": str(output_dir),
+                    "book_name": book_name,
+                }
+            )
+            while True:
+                try:
+                    message = await asyncio.to_thread(worker.conn.recv)
+                except (EOFError, OSError) as e:
+                    worker.kill()
+                    raise ChunkingError(f"Chunking worker died: {e!r}") from e
+
+                kind = message[0]
+                if kind == "progress":
+                    if on_progress:
+                        await on_progress(message[1])
+                elif kind == "notice":
+                    if on_notice:
+                        await on_notice(message[1])
+                elif kind == "done":
+                    return message[1]
+                elif kind == "error":
+                    raise ChunkingError(message[1])
+                else:
+                    raise ValueError(f"Unknown chunking worker message: {message!r}")
+        except asyncio.CancelledError:
+            worker.kill()
+            raise
+        finally:
+            await self._release_worker(worker)
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.kill()
+        self.workers = []
+        self.idle_workers = []
+
+
+_service = None
+
+
+def get_chunking_service():
+    global _service
+    if _service is None:
+        _service = EbookChunkingService()
+    return _service
@@ -50,6 +50,14 @@ STT_MODELS = [
 STT_RETRIES_PER_MODEL = 4  # attempts on each model before moving to the next
 STT_RETRY_SLEEP = 10.0  # seconds between all retry attempts
 STT_RETRY_MAX_DELAY = 180.0  # upper cap per sleep
+# Audio at least this long (seconds) is split at silences into segments that are
+# transcribed concurrently; each segment is retried on its own.
+STT_SEGMENT_MIN_DURATION = float(
+    os.environ.get("BORG_STT_SEGMENT_MIN_DURATION", "900")
+)
+STT_SEGMENT_DURATION = 600.0  # target segment length (seconds)
+STT_SEGMENT_OVERLAP = 1.0  # seconds of audio shared by adjacent segments
+STT_SEGMENT_CONCURRENCY = int(os.environ.get("BORG_STT_SEGMENT_CONCURRENCY", "4"))
 ADMIN_ONLY_COMMAND_IGNORED = (
     "You have invoked an admin-only command. Your request has been ignored."
 )
@@ -1,12 +1,15 @@
+import asyncio
 import json
 import os
-import subprocess
 import tempfile
+import time
+from collections import deque
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import List, Tuple, Union
 
 from telethon import utils
+from telethon.errors import FloodWaitError
 from telethon.helpers import add_surrogate, del_surrogate
 from telethon.tl import types
 from telethon.tl.functions.messages import GetMessageReactionsListRequest
@@ -40,6 +43,7 @@ from telethon.tl.types import (
 
 
 TEXT_ONLY_PLACEHOLDER = "(File not included. Text-only export.)"
+EXPORT_PREFETCH_WINDOW = 16
 
 
 ENTITY_TYPE_MAP = {
@@ -113,6 +117,58 @@ def peer_cache_add(entity, peer_cache: dict):
         peer_cache[peer_id] = entity
 
 
+class FloodWaitGate:
+    """Shared FloodWait backoff: a FloodWaitError in one call pauses every caller."""
+
+    def __init__(self):
+        self.resume_at = 0.0
+
+    async def wait(self):
+        while True:
+            delay = self.resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def call(self, make_awaitable):
+        while True:
+            await self.wait()
+            try:
+                return await make_awaitable()
+            except FloodWaitError as e:
+                wait_seconds = int(getattr(e, "seconds", None) or 0) + 1
+                self.resume_at = max(self.resume_at, time.monotonic() + wait_seconds)
+                print(f"export flood wait for {wait_seconds}s", flush=True)
+
+
+async def _rpc(flood_gate, make_awaitable):
+    if flood_gate is None:
+        return await make_awaitable()
+    return await flood_gate.call(make_awaitable)
+
+
+async def resolve_peers(peers, peer_cache: dict, client, *, flood_gate=None):
+    """Fill `peer_cache` for all unknown `peers` with one batched `get_entity` call."""
+    missing = {}
+    for peer in peers:
+        export_id = peer_export_id(peer)
+        if peer is not None and export_id and export_id not in peer_cache:
+            missing.setdefault(export_id, peer)
+    if not missing:
+        return
+
+    try:
+        entities = await _rpc(
+            flood_gate, lambda: client.get_entity(list(missing.values()))
+        )
+    except Exception:
+        # Unresolvable peers fail the whole batch; `_reaction_sender_fields` then
+        # falls back to per-peer lookups.
+        return
+    for entity in entities:
+        peer_cache_add(entity, peer_cache)
+
+
 def chat_type(entity) -> str:
     if isinstance(entity, types.User):
         return "personal_chat"
@@ -285,12 +341,14 @@ def _reaction_identity(reaction) -> dict:
     return {"type": type(reaction).__name__}
 
 
-async def _reaction_sender_fields(peer_id, peer_cache: dict, client) -> dict:
+async def _reaction_sender_fields(
+    peer_id, peer_cache: dict, client, *, flood_gate=None
+) -> dict:
     export_id = peer_export_id(peer_id)
     entity = peer_cache.get(export_id) if export_id else None
     if entity is None and peer_id is not None:
         try:
-            entity = await client.get_entity(peer_id)
+            entity = await _rpc(flood_gate, lambda: client.get_entity(peer_id))
         except Exception:
             entity = None
         if entity is not None:
@@ -306,8 +364,12 @@ async def _reaction_sender_fields(peer_id, peer_cache: dict, client) -> dict:
     return out
 
 
-async def _reaction_recent_item(reaction_entry, peer_cache: dict, client) -> dict:
-    out = await _reaction_sender_fields(reaction_entry.peer_id, peer_cache, client)
+async def _reaction_recent_item(
+    reaction_entry, peer_cache: dict, client, *, flood_gate=None
+) -> dict:
+    out = await _reaction_sender_fields(
+        reaction_entry.peer_id, peer_cache, client, flood_gate=flood_gate
+    )
     if reaction_entry.date:
         out["date"] = isoformat_no_tz(reaction_entry.date)
     out.update(_reaction_identity(reaction_entry.reaction))
@@ -321,7 +383,9 @@ def _group_reaction_entries(entries) -> dict:
     return grouped
 
 
-async def _fetch_reaction_entries(message, input_chat, peer_cache: dict) -> list:
+async def _fetch_reaction_entries(
+    message, input_chat, peer_cache: dict, *, flood_gate=None
+) -> list:
     reactions = getattr(message, "reactions", None)
     if not reactions or not getattr(reactions, "results", None):
         return []
@@ -330,14 +394,13 @@ async def _fetch_reaction_entries(message, input_chat, peer_cache: dict) -> list
         entries = []
         offset = None
         while True:
-            result = await message.client(
-                GetMessageReactionsListRequest(
-                    peer=input_chat,
-                    id=message.id,
-                    limit=100,
-                    offset=offset,
-                )
+            request = GetMessageReactionsListRequest(
+                peer=input_chat,
+                id=message.id,
+                limit=100,
+                offset=offset,
             )
+            result = await _rpc(flood_gate, lambda: message.client(request))
             for user in getattr(result, "users", []) or []:
                 peer_cache_add(user, peer_cache)
             for chat in getattr(result, "chats", []) or []:
@@ -350,15 +413,25 @@ async def _fetch_reaction_entries(message, input_chat, peer_cache: dict) -> list
     return getattr(reactions, "recent_reactions", None) or []
 
 
-async def reaction_results_with_senders(message, input_chat, peer_cache: dict) -> list:
+async def reaction_results_with_senders(
+    message, input_chat, peer_cache: dict, *, flood_gate=None
+) -> list:
     reactions = getattr(message, "reactions", None)
     if not reactions or not getattr(reactions, "results", None):
         return []
 
     try:
-        entries = await _fetch_reaction_entries(message, input_chat, peer_cache)
+        entries = await _fetch_reaction_entries(
+            message, input_chat, peer_cache, flood_gate=flood_gate
+        )
     except Exception:
         entries = getattr(reactions, "recent_reactions", None) or []
+    await resolve_peers(
+        [entry.peer_id for entry in entries],
+        peer_cache,
+        message.client,
+        flood_gate=flood_gate,
+    )
 
     entries_by_reaction = _group_reaction_entries(entries)
     out = []
@@ -366,7 +439,9 @@ async def reaction_results_with_senders(message, input_chat, peer_cache: dict) -
         item = _reaction_identity(result.reaction)
         item["count"] = result.count
         recent = [
-            await _reaction_recent_item(entry, peer_cache, message.client)
+            await _reaction_recent_item(
+                entry, peer_cache, message.client, flood_gate=flood_gate
+            )
             for entry in entries_by_reaction.get(_reaction_key(result.reaction), [])
         ]
         if recent:
@@ -375,14 +450,14 @@ async def reaction_results_with_senders(message, input_chat, peer_cache: dict) -
     return out
 
 
-async def sender_fields(message, sender_cache: dict) -> dict:
+async def sender_fields(message, sender_cache: dict, *, flood_gate=None) -> dict:
     sender = getattr(message, "sender", None)
     sender_key = peer_export_id(getattr(message, "from_id", None))
     if sender is None and sender_key:
         sender = sender_cache.get(sender_key)
         if sender is None:
             try:
-                sender = await message.get_sender()
+                sender = await _rpc(flood_gate, message.get_sender)
             except Exception:
                 sender = None
             if sender is not None:
@@ -399,7 +474,9 @@ async def sender_fields(message, sender_cache: dict) -> dict:
     return {"from_id": from_id} if from_id else {}
 
 
-async def message_to_export(message, input_chat, sender_cache: dict, peer_cache: dict) -> dict:
+async def message_to_export(
+    message, input_chat, sender_cache: dict, peer_cache: dict, *, flood_gate=None
+) -> dict:
     text, text_entities = text_and_entities(message.message or "", message.entities)
     row = {
         "id": message.id,
@@ -407,7 +484,7 @@ async def message_to_export(message, input_chat, sender_cache: dict, peer_cache:
         "date": isoformat_no_tz(message.date),
         "date_unixtime": unix_time_str(message.date),
     }
-    row.update(await sender_fields(message, sender_cache))
+    row.update(await sender_fields(message, sender_cache, flood_gate=flood_gate))
 
     if getattr(message, "fwd_from", None):
         fwd = message.fwd_from
@@ -427,7 +504,9 @@ async def message_to_export(message, input_chat, sender_cache: dict, peer_cache:
 
     row.update(media_fields(message))
 
-    reactions = await reaction_results_with_senders(message, input_chat, peer_cache)
+    reactions = await reaction_results_with_senders(
+        message, input_chat, peer_cache, flood_gate=flood_gate
+    )
     if reactions:
         row["reactions"] = reactions
 
@@ -436,6 +515,41 @@ async def message_to_export(message, input_chat, sender_cache: dict, peer_cache:
     return {key: value for key, value in row.items() if value is not None}
 
 
+async def iter_messages_to_export(
+    messages,
+    input_chat,
+    sender_cache: dict,
+    peer_cache: dict,
+    *,
+    window: int = EXPORT_PREFETCH_WINDOW,
+    flood_gate=None,
+):
+    """Export the async iterable `messages` concurrently, yielding `(message, row)` in input order.
+
+    Up to `window` messages are exported ahead of the consumer, so reaction
+    lists and reactor entities are fetched in parallel. All workers share one
+    `FloodWaitGate`. Call `aclose()` when stopping early to cancel the prefetch.
+    """
+    flood_gate = flood_gate or FloodWaitGate()
+
+    async def export(message):
+        return message, await message_to_export(
+            message, input_chat, sender_cache, peer_cache, flood_gate=flood_gate
+        )
+
+    pending = deque()
+    try:
+        async for message in messages:
+            pending.append(asyncio.ensure_future(export(message)))
+            if len(pending) >= window:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
 def make_chat_export_data(chat, chat_id, messages, **extra) -> dict:
     data = {
         "name": entity_display_name(chat),
@@ -447,36 +561,92 @@ def make_chat_export_data(chat, chat_id, messages, **extra) -> dict:
     return data
 
 
-def write_json_with_jq(data: dict, output_path: Path):
+def append_jsonl_row(out, row: dict):
+    out.write(
+        json.dumps(row, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    )
+    out.write(b"\n")
+
+
+def iter_jsonl_reversed(path: Path, *, block_size: int = 1 << 16):
+    """Yield JSONL rows last-to-first without reading the whole file into memory."""
+    with path.open("rb") as jsonl_file:
+        jsonl_file.seek(0, os.SEEK_END)
+        position = jsonl_file.tell()
+        remainder = b""
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            jsonl_file.seek(position)
+            lines = (jsonl_file.read(read_size) + remainder).split(b"\n")
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line.strip():
+                    yield json.loads(line)
+        if remainder.strip():
+            yield json.loads(remainder)
+
+
+def write_json_atomic(data: dict, output_path: Path):
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    raw_fd, raw_path = tempfile.mkstemp(
-        suffix=".raw.json", prefix=".result.", dir=output_path.parent
+    fd, tmp_path = tempfile.mkstemp(
+        suffix=".json", prefix=f".{output_path.stem}.", dir=output_path.parent
     )
-    fmt_fd, fmt_path = tempfile.mkstemp(
-        suffix=".json", prefix=".result.", dir=output_path.parent
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as out:
+            json.dump(data, out, ensure_ascii=False, separators=(",", ":"))
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _indented_json(value, level: int) -> str:
+    # JSON strings never contain raw newlines, so re-indenting line starts is safe.
+    return json.dumps(value, ensure_ascii=False, indent=2).replace(
+        "\n", "\n" + " " * level
     )
-    os.close(raw_fd)
-    os.close(fmt_fd)
-    raw_path = Path(raw_path)
-    fmt_path = Path(fmt_path)
 
+
+def write_chat_export_stream(chat, chat_id, messages, output_path: Path, **extra):
+    """Write a chat export to `output_path`, consuming `messages` lazily.
+
+    The output is the `make_chat_export_data` object as JSON indented by two
+    spaces, with non-ASCII characters kept as is. Messages are written one at a
+    time as they are consumed, so only one is held in memory.
+    """
+    data = make_chat_export_data(chat, chat_id, [], **extra)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        suffix=".json", prefix=".result.", dir=output_path.parent
+    )
     try:
-        raw_path.write_text(
-            json.dumps(data, ensure_ascii=False, separators=(",", ":")),
-            encoding="utf-8",
-        )
-        with fmt_path.open("w", encoding="utf-8") as fmt_file:
-            subprocess.run(
-                ["jq", ".", str(raw_path)],
-                stdout=fmt_file,
-                stderr=subprocess.PIPE,
-                text=True,
-                check=True,
-            )
-        os.replace(fmt_path, output_path)
-    finally:
-        for path in (raw_path, fmt_path):
-            try:
-                path.unlink()
-            except FileNotFoundError:
-                pass
+        with os.fdopen(fd, "w", encoding="utf-8") as out:
+            out.write("{\n")
+            for index, (key, value) in enumerate(data.items()):
+                if index:
+                    out.write(",\n")
+                out.write(f"  {json.dumps(key, ensure_ascii=False)}: ")
+                if key != "messages":
+                    out.write(_indented_json(value, 2))
+                    continue
+
+                wrote_message = False
+                for message in messages:
+                    out.write(",\n    " if wrote_message else "[\n    ")
+                    out.write(_indented_json(message, 4))
+                    wrote_message = True
+                out.write("\n  ]" if wrote_message else "[]")
+            out.write("\n}\n")
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
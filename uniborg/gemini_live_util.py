@@ -2,10 +2,10 @@ from pynight.common_icecream import ic
 import asyncio
 import os
 import uuid
-import tempfile
+from array import array
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from pathlib import Path
-from typing import Dict, Optional, Any
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
 from dataclasses import dataclass, field
 
 from pynight.common_icecream import ic
@@ -21,35 +21,75 @@ except ImportError:
     )
     raise
 
-from uniborg import util, llm_util
+from uniborg import util, llm_util, audio_util
 
 # Constants
 LIVE_TIMEOUT = 10 * 60  # 10 minutes in seconds
 CONCURRENT_LIVE_LIMIT = 3
 ADMIN_CONCURRENT_LIVE_LIMIT = 5
 
+# Connection supervision
+LIVE_CONNECT_TIMEOUT = 30
+LIVE_RECONNECT_MIN_DELAY = 1
+LIVE_RECONNECT_MAX_DELAY = 30
+LIVE_MAX_RECONNECT_ATTEMPTS = 5
+# How long new input waits for the model to finish speaking before it is sent anyway.
+LIVE_MODEL_TURN_TIMEOUT = 60
+
 # Audio format constants for Gemini Live API
 GEMINI_AUDIO_SAMPLE_RATE = 16000
 GEMINI_AUDIO_CHANNELS = 1
+GEMINI_AUDIO_MIME_TYPE = f"audio/pcm;rate={GEMINI_AUDIO_SAMPLE_RATE}"
+GEMINI_AUDIO_FRAME_DURATION = 0.1  # seconds of audio per realtime input message
+GEMINI_OUTPUT_SAMPLE_RATE = 24000
+
+# Splitting spoken replies into voice notes
+LIVE_VOICE_FIRST_MIN_DURATION = 1.5
+LIVE_VOICE_MIN_DURATION = 8
+LIVE_VOICE_MAX_DURATION = 60
+LIVE_VOICE_PAUSE_DURATION = 0.3
+LIVE_VOICE_SCAN_FRAME_DURATION = 0.02
+LIVE_VOICE_SILENCE_PEAK_TO_PEAK = 1000  # of 65535
+
+
+class LiveSessionError(Exception):
+    pass
 
 
 @dataclass
 class LiveSession:
-    """Represents an active live session with Gemini Live API."""
+    """
+    Represents a live session with Gemini Live API.
+
+    The connection is owned by `LiveSessionManager`, which keeps it open,
+    reconnects (resuming the conversation when the server allows it) and
+    dispatches server messages to `on_response`.
+    """
 
     chat_id: int
     user_id: int
     model: str
     api_key: str
-    session: Optional[Any] = None  # genai.live.LiveSession
+    client: Optional[Any] = None  # genai.Client
+    connection: Optional[Any] = None  # genai.live.AsyncSession
     session_id: str = field(default_factory=lambda: str(uuid.uuid4()))
     created_at: datetime = field(default_factory=datetime.now)
     last_activity: datetime = field(default_factory=datetime.now)
     is_connected: bool = False
-    pending_audio_queue: list = field(default_factory=list)
-    _response_task: Optional[asyncio.Task] = None
-    _session_context: Optional[Any] = None
-    _live_connection: Optional[Any] = None
+    resumption_handle: Optional[str] = None
+    on_response: Optional[Callable[["LiveSession", Any], Awaitable[None]]] = None
+    on_close: Optional[Callable[["LiveSession", str], Awaitable[None]]] = None
+    #: The model turn whose audio is being sent, if any.
+    voice_reply: Optional["LiveVoiceReply"] = None
+    _connected: asyncio.Event = field(default_factory=asyncio.Event)
+    #: Set while the model is not producing a turn; new input waits for it.
+    _model_idle: asyncio.Event = field(default_factory=asyncio.Event)
+    _input_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    _supervisor_task: Optional[asyncio.Task] = None
+    _expiry_handle: Optional[asyncio.TimerHandle] = None
+
+    def __post_init__(self):
+        self._model_idle.set()
 
     def is_expired(self) -> bool:
         """Check if session has expired due to inactivity."""
@@ -59,43 +99,65 @@ class LiveSession:
         """Update last activity timestamp."""
         self.last_activity = datetime.now()
 
+    async def _wait_connected(self):
+        try:
+            await asyncio.wait_for(self._connected.wait(), LIVE_CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise LiveSessionError("Timed out connecting to Gemini Live API.")
+        return self.connection
+
+    @asynccontextmanager
+    async def _input_turn(self):
+        """
+        Serializes user turns and holds them back while the model is speaking.
+        The model is expected to answer each turn, so it counts as speaking
+        from the end of the turn until its reply completes.
+        """
+        async with self._input_lock:
+            try:
+                await asyncio.wait_for(self._model_idle.wait(), LIVE_MODEL_TURN_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"Live session {self.session_id[:8]}: model turn timed out")
 
-class LiveSessionManager:
-    """Manages active Gemini Live API sessions."""
+            yield await self._wait_connected()
+            self._model_idle.clear()
 
-    def __init__(self):
-        self.sessions: Dict[int, LiveSession] = {}  # chat_id -> LiveSession
-        self._cleanup_task = None
-        self._start_cleanup_task()
+    async def send_text(self, text: str):
+        """Send text message to Gemini Live API."""
+        async with self._input_turn() as connection:
+            content = types.Content(role="user", parts=[types.Part(text=text)])
+            await connection.send_client_content(turns=content)
+        print(f"Sent text: {text[:50]}...")
+
+    async def send_audio(self, frames):
+        """
+        Send PCM audio to Gemini Live API as one user turn with manual VAD.
+
+        `frames` is an async iterable of 16kHz mono PCM frames (see
+        `audio_util.iter_audio_to_pcm`); each is sent as soon as it arrives.
+        """
+        size = 0
+        async with self._input_turn() as connection:
+            await connection.send_realtime_input(activity_start=types.ActivityStart())
+            async for frame in frames:
+                await connection.send_realtime_input(
+                    audio=types.Blob(data=frame, mime_type=GEMINI_AUDIO_MIME_TYPE)
+                )
+                size += len(frame)
+            await connection.send_realtime_input(activity_end=types.ActivityEnd())
+        print(f"Sent audio: {size} bytes")
 
-    def _start_cleanup_task(self):
-        """Start background task for session cleanup."""
-        if self._cleanup_task is None or self._cleanup_task.done():
-            self._cleanup_task = asyncio.create_task(self._cleanup_expired_sessions())
 
-    async def _cleanup_expired_sessions(self):
-        """Background task to clean up expired sessions."""
-        while True:
-            try:
-                expired_chats = []
-                for chat_id, session in self.sessions.items():
-                    if session.is_expired():
-                        expired_chats.append(chat_id)
-
-                for chat_id in expired_chats:
-                    await self.end_session(chat_id)
+class LiveSessionManager:
+    """Manages active Gemini Live API sessions, one per chat."""
 
-                await asyncio.sleep(60)  # Check every minute
-            except Exception as e:
-                print(f"Error in cleanup task: {e}")
-                traceback.print_exc()
-                await asyncio.sleep(60)
+    def __init__(self):
+        self.sessions: Dict[int, LiveSession] = {}  # chat_id -> LiveSession
+        self.user_chat_ids: Dict[int, Set[int]] = {}  # user_id -> chat_ids
 
     def get_user_session_count(self, user_id: int) -> int:
         """Get current number of active sessions for a user."""
-        return sum(
-            1 for session in self.sessions.values() if session.user_id == user_id
-        )
+        return len(self.user_chat_ids.get(user_id, ()))
 
     async def can_create_session(self, user_id: int) -> bool:
         """Check if user can create a new session based on limits."""
@@ -105,9 +167,22 @@ class LiveSessionManager:
         return current_count < limit
 
     async def create_session(
-        self, chat_id: int, user_id: int, model: str, api_key: str
+        self,
+        chat_id: int,
+        user_id: int,
+        model: str,
+        api_key: str,
+        *,
+        on_response=None,
+        on_close=None,
     ) -> LiveSession:
-        """Create a new live session using Google GenAI SDK."""
+        """
+        Create a new live session and start connecting it in the background.
+
+        `on_response(session, message)` is awaited for every server message and
+        `on_close(session, reason)` when the session ends by itself (expiry or
+        a connection that cannot be restored).
+        """
         if not await self.can_create_session(user_id):
             is_admin = util.is_admin_by_id(user_id)
             limit = ADMIN_CONCURRENT_LIVE_LIMIT if is_admin else CONCURRENT_LIVE_LIMIT
@@ -117,106 +192,194 @@ class LiveSessionManager:
         if chat_id in self.sessions:
             await self.end_session(chat_id)
 
-        # Create session object
         session_obj = LiveSession(
-            chat_id=chat_id, user_id=user_id, model=model, api_key=api_key
+            chat_id=chat_id,
+            user_id=user_id,
+            model=model,
+            api_key=api_key,
+            on_response=on_response,
+            on_close=on_close,
         )
 
         try:
-            # Base configuration for live session
-            config_kwargs = {
-                "response_modalities": ["AUDIO"],  # Audio responses
-                "realtime_input_config": {
-                    "automatic_activity_detection": {"disabled": True}
-                },
-            }
-
-            live_connect_config = types.LiveConnectConfig(**config_kwargs)
-
             # For live streaming, a larger buffer is beneficial.
-            client = llm_util.create_genai_client(
+            session_obj.client = llm_util.create_genai_client(
                 api_key=api_key,
                 user_id=user_id,
                 read_bufsize=10 * 2**20,
                 proxy_p=True,
             )
-
-            # Create live session connection object
-            session_obj.session = client.aio.live.connect(
-                model=model, config=live_connect_config
-            )
-            session_obj.is_connected = False  # Will be set to True after connection
-
-            print(f"Live session object created for chat {chat_id}")
-
-            print(
-                f"Created live session {session_obj.session_id[:8]}... for chat {chat_id} with model {model}"
-            )
-
         except Exception as e:
             print(f"Failed to create live session: {e}")
             traceback.print_exc()
             raise ValueError(f"Failed to connect to Gemini Live API: {str(e)}")
 
         self.sessions[chat_id] = session_obj
+        self.user_chat_ids.setdefault(user_id, set()).add(chat_id)
+        self._schedule_expiry(session_obj)
+        session_obj._supervisor_task = asyncio.create_task(self._supervise(session_obj))
+
+        print(
+            f"Created live session {session_obj.session_id[:8]}... for chat {chat_id} with model {model}"
+        )
         return session_obj
 
-    def get_session(self, chat_id: int) -> Optional[LiveSession]:
-        """Get active session for a chat."""
-        return self.sessions.get(chat_id)
+    def _connect_config(self, session: LiveSession):
+        return types.LiveConnectConfig(
+            response_modalities=["AUDIO"],  # Audio responses
+            realtime_input_config={"automatic_activity_detection": {"disabled": True}},
+            session_resumption={"handle": session.resumption_handle},
+        )
 
-    async def end_session(self, chat_id: int) -> bool:
-        """End a live session and cleanup resources."""
-        session = self.sessions.pop(chat_id, None)
-        if session:
+    async def _supervise(self, session: LiveSession):
+        """Keeps `session` connected until it is ended."""
+        failures = 0
+        while True:
             try:
-                # Cancel response task if running
-                if session._response_task and not session._response_task.done():
-                    session._response_task.cancel()
-                    try:
-                        await session._response_task
-                    except asyncio.CancelledError:
-                        pass
+                async with session.client.aio.live.connect(
+                    model=session.model, config=self._connect_config(session)
+                ) as connection:
+                    session.connection = connection
+                    session.is_connected = True
+                    session._connected.set()
+                    print(
+                        f"Live session {session.session_id[:8]} connected for chat {session.chat_id}"
+                        f" (resumed: {session.resumption_handle is not None})"
+                    )
+                    if await self._receive(session, connection):
+                        failures = 0
+                    else:
+                        failures += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Live session {session.session_id[:8]} connection error: {e}")
+                traceback.print_exc()
+                failures += 1
+                if failures > 1:
+                    # The resumption handle may be what the server rejects.
+                    session.resumption_handle = None
+            finally:
+                session._connected.clear()
+                session.is_connected = False
+                session.connection = None
+                session._model_idle.set()
 
-                # Close the live session properly
-                if session._session_context:
-                    try:
-                        await session._session_context.__aexit__(None, None, None)
-                        print(f"Live session context closed for chat {chat_id}")
-                    except Exception as e:
-                        print(f"Error closing live session context: {e}")
-                        traceback.print_exc()
-                elif session.session:
+            if failures >= LIVE_MAX_RECONNECT_ATTEMPTS:
+                self._drop(session)
+                await self._notify_close(session, "Live session connection lost.")
+                return
+
+            await asyncio.sleep(
+                min(LIVE_RECONNECT_MIN_DELAY * 2**failures, LIVE_RECONNECT_MAX_DELAY)
+            )
+
+    async def _receive(self, session: LiveSession, connection) -> bool:
+        """
+        Dispatches server messages until the connection closes. Returns whether
+        any message was received.
+        """
+        received_any_p = False
+        while True:
+            received_p = False
+            # `receive` stops after each completed model turn.
+            async for message in connection.receive():
+                received_p = received_any_p = True
+                update = message.session_resumption_update
+                if update:
+                    # Without a resumable handle a reconnect starts a fresh conversation.
+                    session.resumption_handle = (
+                        update.new_handle if update.resumable else None
+                    )
+
+                if message.go_away:
+                    print(
+                        f"Live session {session.session_id[:8]}: server closing in {message.go_away.time_left}"
+                    )
+
+                content = message.server_content
+                if content:
+                    if content.model_turn:
+                        session._model_idle.clear()
+                    if content.turn_complete or content.interrupted:
+                        session._model_idle.set()
+
+                if session.on_response:
                     try:
-                        # For non-context sessions, close directly
-                        if hasattr(session.session, "close"):
-                            await session.session.close()
-                        print(f"Live session closed for chat {chat_id}")
+                        await session.on_response(session, message)
                     except Exception as e:
-                        print(f"Error closing live session: {e}")
+                        print(f"Error processing live response: {e}")
                         traceback.print_exc()
 
-                session.is_connected = False
-                print(f"Ended live session for chat {chat_id}")
+            if not received_p:
+                return received_any_p
+
+    def _schedule_expiry(self, session: LiveSession, delay=LIVE_TIMEOUT):
+        session._expiry_handle = asyncio.get_running_loop().call_later(
+            delay, lambda: asyncio.create_task(self._expire(session))
+        )
 
+    async def _expire(self, session: LiveSession):
+        if self.sessions.get(session.chat_id) is not session:
+            return
+        if not session.is_expired():
+            idle_seconds = (datetime.now() - session.last_activity).total_seconds()
+            self._schedule_expiry(session, LIVE_TIMEOUT - idle_seconds)
+            return
+        await self.end_session(session.chat_id)
+        await self._notify_close(session, "Live session ended due to inactivity.")
+
+    async def _notify_close(self, session: LiveSession, reason: str):
+        if session.on_close:
+            try:
+                await session.on_close(session, reason)
             except Exception as e:
-                print(f"Error ending session: {e}")
+                print(f"Error in live session close callback: {e}")
                 traceback.print_exc()
-            return True
-        return False
 
-    def is_live_mode_active(self, chat_id: int) -> bool:
-        """Check if live mode is active for a chat."""
-        session = self.sessions.get(chat_id)
-        if session is None or session.is_expired():
+    def _drop(self, session: LiveSession) -> bool:
+        if self.sessions.get(session.chat_id) is not session:
             return False
 
-        # If session context was started but connection lost, consider it inactive
-        if session._session_context is not None and not session.is_connected:
+        del self.sessions[session.chat_id]
+        chat_ids = self.user_chat_ids.get(session.user_id)
+        if chat_ids is not None:
+            chat_ids.discard(session.chat_id)
+            if not chat_ids:
+                del self.user_chat_ids[session.user_id]
+        if session._expiry_handle:
+            session._expiry_handle.cancel()
+        return True
+
+    def get_session(self, chat_id: int) -> Optional[LiveSession]:
+        """Get active session for a chat."""
+        return self.sessions.get(chat_id)
+
+    async def end_session(self, chat_id: int) -> bool:
+        """End a live session and close its connection."""
+        session = self.sessions.get(chat_id)
+        if session is None or not self._drop(session):
             return False
 
+        task = session._supervisor_task
+        if task and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                print(f"Error ending session: {e}")
+                traceback.print_exc()
+
+        print(f"Ended live session for chat {chat_id}")
         return True
 
+    def is_live_mode_active(self, chat_id: int) -> bool:
+        """Check if live mode is active for a chat."""
+        session = self.sessions.get(chat_id)
+        return session is not None and not session.is_expired()
+
     def update_session_activity(self, chat_id: int):
         """Update last activity for a session."""
         session = self.sessions.get(chat_id)
@@ -224,146 +387,102 @@ class LiveSessionManager:
             session.update_activity()
 
 
-class GeminiLiveAPI:
-    """Interface for Gemini Live API using Google GenAI SDK."""
-
-    def __init__(self, api_key: str, *, user_id: int = None):
-        self.api_key = api_key
-        # A large buffer is beneficial for live streaming.
-        self.client = llm_util.create_genai_client(
-            api_key=api_key, user_id=user_id, read_bufsize=10 * 2**20, proxy_p=True
-        )
-
-    async def send_text(self, session: Any, text: str):
-        """Send text message to Gemini Live API."""
-        try:
-            # Send text with proper API format
-            content = types.Content(role="user", parts=[types.Part(text=text)])
-            await session.send_client_content(turns=content)
-            print(f"Sent text: {text[:50]}...")
-        except Exception as e:
-            print(f"Error sending text: {e}")
-            traceback.print_exc()
-            raise
-
-    async def send_audio_chunk(self, session: Any, audio_data: bytes):
-        """Send audio data to Gemini Live API with manual VAD."""
-        try:
-            # Send activity start
-            await session.send_realtime_input(activity_start=types.ActivityStart())
-
-            # Send audio data
-            await session.send_realtime_input(
-                audio=types.Blob(data=audio_data, mime_type="audio/pcm;rate=16000")
+class LiveVoiceReply:
+    """
+    Turns the streamed PCM of one model turn into voice notes.
+
+    PCM accumulates in a buffer that is scanned as it arrives, and a note is
+    cut at the first pause once it is long enough, so the first sentence is
+    sent while the model is still talking. Each note is encoded in its own
+    task, concurrently with reception, and `send_ogg` is awaited in order.
+    If a note cannot be encoded or sent, `on_error` is awaited with the
+    exception.
+    """
+
+    def __init__(
+        self,
+        send_ogg,
+        *,
+        on_error=None,
+        sample_rate: int = GEMINI_OUTPUT_SAMPLE_RATE,
+    ):
+        self.send_ogg = send_ogg
+        self.on_error = on_error
+        self.sample_rate = sample_rate
+        self._bytes_per_second = sample_rate * 2
+        self._frame_size = round(sample_rate * LIVE_VOICE_SCAN_FRAME_DURATION) * 2
+        self._buffer = bytearray()
+        self._scanned = 0  # bytes of `_buffer` already scanned for pauses
+        self._pause_start = None  # offset of the current run of silent frames
+        self._note_count = 0
+        self._send_task = None
+
+    def _seconds(self, size: int) -> float:
+        return size / self._bytes_per_second
+
+    def feed(self, pcm: bytes):
+        self._buffer += pcm
+        while self._scanned + self._frame_size <= len(self._buffer):
+            frame = array(
+                "h", self._buffer[self._scanned : self._scanned + self._frame_size]
             )
+            self._scanned += self._frame_size
 
-            # Send activity end
-            await session.send_realtime_input(activity_end=types.ActivityEnd())
-
-            print(f"Sent audio chunk: {len(audio_data)} bytes")
-        except Exception as e:
-            print(f"Error sending audio: {e}")
-            traceback.print_exc()
-            raise
-
-
-class AudioProcessor:
-    """Handles audio format conversion for Gemini Live API."""
+            if max(frame) - min(frame) > LIVE_VOICE_SILENCE_PEAK_TO_PEAK:
+                self._pause_start = None
+            elif self._pause_start is None:
+                self._pause_start = self._scanned - self._frame_size
 
-    @staticmethod
-    async def convert_ogg_to_pcm(ogg_path: str) -> bytes:
-        """Convert Telegram OGG audio to PCM format required by Gemini."""
-        temp_pcm = tempfile.NamedTemporaryFile(delete=False, suffix=".pcm")
-        temp_pcm.close()
-
-        try:
-            # Convert OGG to 16-bit PCM, 16kHz, mono using ffmpeg
-            cmd = [
-                "ffmpeg",
-                "-i",
-                ogg_path,
-                "-ar",
-                str(GEMINI_AUDIO_SAMPLE_RATE),
-                "-ac",
-                str(GEMINI_AUDIO_CHANNELS),
-                "-f",
-                "s16le",  # 16-bit PCM little-endian
-                "-y",
-                temp_pcm.name,
-            ]
-
-            process = await asyncio.create_subprocess_exec(
-                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            min_duration = (
+                LIVE_VOICE_MIN_DURATION
+                if self._note_count
+                else LIVE_VOICE_FIRST_MIN_DURATION
             )
-
-            stdout, stderr = await process.communicate()
-
-            if process.returncode != 0:
-                print(f"FFmpeg error: {stderr.decode()}")
-                raise ValueError(
-                    f"ffmpeg conversion failed with return code {process.returncode}"
-                )
-
-            # Read the converted PCM data
-            with open(temp_pcm.name, "rb") as f:
-                pcm_data = f.read()
-
-            return pcm_data
-
-        finally:
-            # Clean up temporary file
-            Path(temp_pcm.name).unlink(missing_ok=True)
-
-    @staticmethod
-    async def convert_pcm_to_ogg(pcm_data: bytes, sample_rate: int = 24000) -> bytes:
-        """Convert PCM audio from Gemini to OGG format for Telegram."""
-        temp_pcm = tempfile.NamedTemporaryFile(delete=False, suffix=".pcm")
-        temp_ogg = tempfile.NamedTemporaryFile(delete=False, suffix=".ogg")
-
-        try:
-            # Write PCM data to temporary file
-            with open(temp_pcm.name, "wb") as f:
-                f.write(pcm_data)
-
-            # Convert PCM to OGG using ffmpeg
-            cmd = [
-                "ffmpeg",
-                "-f",
-                "s16le",
-                "-ar",
-                str(sample_rate),
-                "-ac",
-                "1",  # mono
-                "-i",
-                temp_pcm.name,
-                "-c:a",
-                "libopus",  # Use Opus codec for OGG
-                "-y",
-                temp_ogg.name,
-            ]
-
-            process = await asyncio.create_subprocess_exec(
-                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            at_pause = (
+                self._pause_start is not None
+                and self._seconds(self._pause_start) >= min_duration
+                and self._seconds(self._scanned - self._pause_start)
+                >= LIVE_VOICE_PAUSE_DURATION
             )
+            if at_pause or self._seconds(self._scanned) >= LIVE_VOICE_MAX_DURATION:
+                self._cut(self._scanned)
+
+    def _cut(self, end: int):
+        pcm = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        self._scanned -= end
+        self._pause_start = None
+        self._note_count += 1
+
+        encoding = asyncio.create_task(
+            audio_util.pcm_to_ogg_opus(pcm, sample_rate=self.sample_rate)
+        )
+        self._send_task = asyncio.create_task(
+            self._send_in_order(self._send_task, encoding)
+        )
 
-            stdout, stderr = await process.communicate()
-
-            if process.returncode != 0:
-                print(f"FFmpeg error: {stderr.decode()}")
-                raise ValueError(
-                    f"ffmpeg conversion failed with return code {process.returncode}"
-                )
-
-            # Read the converted OGG data
-            with open(temp_ogg.name, "rb") as f:
-                ogg_data = f.read()
-
-            return ogg_data
-
-        finally:
-            # Clean up temporary files
-            Path(temp_pcm.name).unlink(missing_ok=True)
-            Path(temp_ogg.name).unlink(missing_ok=True)
+    async def _send_in_order(self, previous_send, encoding):
+        if previous_send:
+            await previous_send
+        try:
+            ogg_data = await encoding
+            await self.send_ogg(ogg_data)
+            print(f"Sent voice response: {len(ogg_data)} bytes")
+        except Exception as e:
+            print(f"Error processing audio response: {e}")
+            traceback.print_exc()
+            if self.on_error:
+                try:
+                    await self.on_error(e)
+                except Exception:
+                    traceback.print_exc()
+
+    async def finish(self):
+        """Sends the rest of the turn and waits until every note is sent."""
+        if self._buffer:
+            self._cut(len(self._buffer))
+        if self._send_task:
+            await self._send_task
 
 
 # Global session manager instance
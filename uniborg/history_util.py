@@ -17,7 +17,7 @@ from typing import List, Deque, DefaultDict, Dict, Optional
 from dataclasses import dataclass, replace, asdict
 
 # Redis utilities
-from . import redis_util
+from . import bot_util, redis_util
 
 # --- Configuration ---
 HISTORY_LIMIT = 5000  # Max number of message IDs to store per chat
@@ -401,6 +401,81 @@ async def get_cached_file(file_id: str) -> Optional[dict]:
     return None
 
 
+async def cache_document_text(digest: str, text: str) -> bool:
+    """Cache the plain text extracted from a document, keyed by its content digest."""
+    return await redis_util.set_with_expiry(
+        redis_util.document_text_cache_key(digest),
+        text,
+        expire_seconds=redis_util.REDIS_LONG_EXPIRE_DURATION,
+    )
+
+
+async def get_cached_document_text(digest: str) -> Optional[str]:
+    """Get the cached text of a document by content digest, renewing its expiry."""
+    return await redis_util.get_and_renew(
+        redis_util.document_text_cache_key(digest),
+        expire_seconds=redis_util.REDIS_LONG_EXPIRE_DURATION,
+    )
+
+
+async def cache_uploaded_file(
+    account_id: int,
+    kind: str,
+    digest: str,
+    *,
+    media_type: str,
+    media_id: int,
+    access_hash: int,
+    file_reference: bytes,
+) -> bool:
+    """Cache the Telegram photo or document an account uploaded for a file, keyed by kind and content digest."""
+    field_values = {
+        "type": media_type,
+        "id": str(media_id),
+        "access_hash": str(access_hash),
+        "file_reference": file_reference.hex(),
+    }
+    return await redis_util.hset_with_expiry(
+        redis_util.uploaded_file_cache_key(account_id, kind, digest),
+        field_values,
+        expire_seconds=redis_util.REDIS_LONG_EXPIRE_DURATION,
+    )
+
+
+async def get_cached_uploaded_file(
+    account_id: int, kind: str, digest: str
+) -> Optional[dict]:
+    """Get the cached Telegram media of an uploaded file, renewing its expiry."""
+    return await redis_util.hgetall_and_renew(
+        redis_util.uploaded_file_cache_key(account_id, kind, digest),
+        expire_seconds=redis_util.REDIS_LONG_EXPIRE_DURATION,
+    )
+
+
+async def uncache_uploaded_file(account_id: int, kind: str, digest: str) -> bool:
+    """Forget the cached Telegram media of an uploaded file."""
+    return await redis_util.delete_key(
+        redis_util.uploaded_file_cache_key(account_id, kind, digest)
+    )
+
+
+async def cache_stt_result(cache_id: str, json_text: str) -> bool:
+    """Cache a validated ``TranscriptionResult`` JSON string."""
+    return await redis_util.set_with_expiry(
+        redis_util.stt_result_cache_key(cache_id),
+        json_text,
+        expire_seconds=redis_util.REDIS_LONG_EXPIRE_DURATION,
+    )
+
+
+async def get_cached_stt_result(cache_id: str) -> Optional[str]:
+    """Get a cached transcription result JSON string, renewing its expiry."""
+    return await redis_util.get_and_renew(
+        redis_util.stt_result_cache_key(cache_id),
+        expire_seconds=redis_util.REDIS_LONG_EXPIRE_DURATION,
+    )
+
+
 async def cache_gemini_file_info(
     file_id: str, user_id: int, name: str, uri: str, mime_type: str
 ) -> bool:
@@ -502,6 +577,7 @@ async def initialize_history_handler():
     async def incoming_message_recorder(event: events.NewMessage.Event):
         # print(f"History: new message in {event.chat_id}: {event.id}, text (truncated):\n{event.text[:100]}")
 
+        bot_util.record_album_message(event.message)
         await add_message(event.chat_id, event.id, event.date)
 
     # --- 2. Handler for Deleted Messages ---
@@ -543,6 +619,7 @@ async def initialize_history_handler():
                 messages = result if isinstance(result, list) else [result]
                 for sent_message in messages:
                     if sent_message:
+                        bot_util.record_album_message(sent_message)
                         await add_message(
                             sent_message.chat_id, sent_message.id, sent_message.date
                         )
@@ -561,6 +638,7 @@ async def initialize_history_handler():
         @borg.on(events.NewMessage(outgoing=True))
         async def outgoing_message_recorder(event: events.NewMessage.Event):
             """Records every outgoing message ID to the history cache."""
+            bot_util.record_album_message(event.message)
             await add_message(event.chat_id, event.id, event.date)
 
         print(
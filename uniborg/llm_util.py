@@ -381,10 +381,11 @@ def create_attachments_from_dir(directory: Path) -> list[llm.Attachment]:
     """
     Scans a directory for files and creates a list of llm.Attachment objects.
 
-    It uses a predefined MIME_TYPE_MAP to handle common audio/video types
-    by reading their binary content directly. For all other file types (e.g.,
-    images), it creates an attachment by path, allowing the `llm` library
-    to infer the type.
+    Attachments refer to the files by path, so nothing is read into memory
+    here; the `llm` plugin reads each file only while building the request.
+    Common audio/video types get their MIME type from the predefined
+    MIME_TYPE_MAP, since the `llm` library misdetects them. For all other file
+    types (e.g., images), the `llm` library infers the type.
 
     Args:
         directory: The Path object of the directory to scan.
@@ -401,26 +402,16 @@ def create_attachments_from_dir(directory: Path) -> list[llm.Attachment]:
             continue
 
         lower_filename = filepath.name.lower()
-        handled_explicitly = False
-
-        for extension, mime_type in MIME_TYPE_MAP.items():
-            if lower_filename.endswith(extension):
-                try:
-                    with open(filepath, "rb") as f:
-                        content = f.read()
-                    attachments.append(llm.Attachment(content=content, type=mime_type))
-                    handled_explicitly = True
-                    break  # Move to the next file
-                except IOError as e:
-                    print(f"Error reading file {filepath} for explicit MIME type: {e}")
-                    # Mark as handled to prevent fallback, but skip adding it
-                    handled_explicitly = True
-                    break
-
-        if not handled_explicitly:
-            # Fallback for images and other file types.
-            # llm.Attachment(path=...) is smart enough to handle these.
-            attachments.append(llm.Attachment(path=str(filepath)))
+        mime_type = next(
+            (
+                mime_type
+                for extension, mime_type in MIME_TYPE_MAP.items()
+                if lower_filename.endswith(extension)
+            ),
+            None,
+        )
+        # llm.Attachment(path=...) is smart enough to infer the rest.
+        attachments.append(llm.Attachment(path=str(filepath), type=mime_type))
 
     return attachments
 
@@ -85,6 +85,21 @@ def file_cache_key(file_id: str) -> str:
     return f"borg:files:{file_id}"
 
 
+def document_text_cache_key(digest: str) -> str:
+    """Redis key for the extracted text of a document, by content digest."""
+    return f"borg:files:doctext:{digest}"
+
+
+def uploaded_file_cache_key(account_id: int, kind: str, digest: str) -> str:
+    """Redis key for the Telegram media of an uploaded file, by kind and content digest."""
+    return f"borg:files:upload:{account_id}:{kind}:{digest}"
+
+
+def stt_result_cache_key(cache_id: str) -> str:
+    """Redis key for a cached transcription result."""
+    return f"borg:stt:result:{cache_id}"
+
+
 def gemini_file_cache_key(file_id: str, user_id: int) -> str:
     """Redis key for Gemini File API name cache."""
     return f"borg:files:gemini:{user_id}:{file_id}"
@@ -23,6 +23,7 @@ from uniborg import (
     tts_util,
     llm_db,
     telethon_compat,
+    upload_util,
 )
 from .storage import Storage
 from . import hacks
@@ -148,6 +149,8 @@ class Uniborg(TelegramClient):
         for module in core_modules:
             module.borg = self
 
+        upload_util.install_send_file_cache(self)
+
         # Cache bot information for plugin injection
         self._is_bot = await self.is_bot()
         self._bot_id = self.me.id
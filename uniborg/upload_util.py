@@ -0,0 +1,622 @@
+import asyncio
+import hashlib
+import io
+import itertools
+import os
+import time
+import traceback
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import telethon.utils
+from telethon import helpers
+from telethon.errors import (
+    BadRequestError,
+    PhotoExtInvalidError,
+    ServerError,
+    TimedOutError,
+)
+from telethon.tl.functions.upload import SaveBigFilePartRequest, SaveFilePartRequest
+from telethon.tl.types import (
+    DocumentAttributeFilename,
+    InputDocument,
+    InputFile,
+    InputFileBig,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaUploadedDocument,
+    InputMediaUploadedPhoto,
+    InputPhoto,
+)
+
+from uniborg import history_util, util
+from uniborg.export_util import FloodWaitGate
+
+UPLOAD_CONCURRENCY = int(os.environ.get("BORG_UPLOAD_CONCURRENCY", "3"))
+UPLOAD_PART_SIZE = 512 * 1024
+UPLOAD_BIG_FILE_SIZE = 10 * 1024 * 1024
+UPLOAD_PART_RETRIES = 5
+UPLOAD_RETRY_DELAY = 2
+UPLOAD_PROGRESS_INTERVAL = 5
+PARTIAL_UPLOADS_MAX = 64
+
+MEDIA_FLAGS = ("force_document", "voice_note", "video_note", "supports_streaming")
+#: `send_file` arguments that change the sent media in ways the cache does not key on.
+SEND_FILE_UNCACHED_KWARGS = (
+    "file_size",
+    "mime_type",
+    "thumb",
+    "ttl",
+    "as_image",
+    "nosound_video",
+)
+
+
+def pop_media_flags(kwargs: dict) -> dict:
+    """Removes the `send_file` flags that decide how a file is sent from `kwargs`."""
+    return {key: kwargs.pop(key) for key in MEDIA_FLAGS if key in kwargs}
+
+
+@dataclass
+class OutgoingFile:
+    path: Path
+    force_document: bool = False
+    voice_note: bool = False
+    video_note: bool = False
+    supports_streaming: bool = False
+
+    def __post_init__(self):
+        self.path = Path(self.path)
+
+    @classmethod
+    def from_name_prefixes(cls, path) -> "OutgoingFile":
+        """Reads the flags from the `voicenote-`, `videonote-`, `fdoc-` and `streaming-` name prefixes."""
+        name = Path(path).name
+        return cls(
+            path,
+            force_document=name.startswith("fdoc-"),
+            voice_note=name.startswith("voicenote-"),
+            video_note=name.startswith("videonote-"),
+            supports_streaming=name.startswith("streaming-"),
+        )
+
+    @property
+    def kind(self) -> str:
+        return media_kind(
+            str(self.path),
+            name=self.path.name,
+            force_document=self.force_document,
+            voice_note=self.voice_note,
+            video_note=self.video_note,
+            supports_streaming=self.supports_streaming,
+        )
+
+
+def media_kind(
+    file,
+    *,
+    name=None,
+    attributes=None,
+    force_document=False,
+    voice_note=False,
+    video_note=False,
+    supports_streaming=False,
+) -> str:
+    """
+    How `file` is sent with these `send_file` arguments; the same bytes sent
+    differently are different media.
+
+    Documents keep the name and attributes they were first sent with, so
+    these are part of the kind of everything but photos.
+    """
+    if not force_document and telethon.utils.is_image(file):
+        return "photo"
+
+    if force_document:
+        kind = "file"
+    elif voice_note:
+        kind = "voice"
+    elif video_note:
+        kind = "video_note"
+    elif supports_streaming:
+        kind = "streaming"
+    else:
+        kind = "document"
+
+    other_attributes = []
+    for attribute in attributes or ():
+        if isinstance(attribute, DocumentAttributeFilename):
+            name = attribute.file_name
+        else:
+            other_attributes.append(repr(attribute.to_dict()))
+    variant = repr((name, sorted(other_attributes)))
+    return f"{kind}:{hashlib.sha256(variant.encode()).hexdigest()[:16]}"
+
+
+async def _get_account_id(client) -> int:
+    account_id = getattr(client, "_upload_account_id", None)
+    if account_id is None:
+        account_id = (await client.get_me(input_peer=True)).user_id
+        client._upload_account_id = account_id
+    return account_id
+
+
+async def get_cached_media(client, kind: str, digest: str):
+    """Returns the `InputMedia` of the file this account sent as `kind` with content `digest`, if any."""
+    cached = await history_util.get_cached_uploaded_file(
+        await _get_account_id(client), kind, digest
+    )
+    if not cached:
+        return None
+
+    media_id = dict(
+        id=int(cached["id"]),
+        access_hash=int(cached["access_hash"]),
+        file_reference=bytes.fromhex(cached["file_reference"]),
+    )
+    if cached["type"] == "photo":
+        return InputMediaPhoto(InputPhoto(**media_id))
+    return InputMediaDocument(InputDocument(**media_id))
+
+
+async def cache_sent_media(client, kind: str, digest: str, message):
+    """Remembers the photo or document of `message` as the media of `digest` sent as `kind`."""
+    if getattr(message, "photo", None):
+        media_type, media = "photo", message.photo
+    elif getattr(message, "document", None):
+        media_type, media = "document", message.document
+    else:
+        return
+
+    await history_util.cache_uploaded_file(
+        await _get_account_id(client),
+        kind,
+        digest,
+        media_type=media_type,
+        media_id=media.id,
+        access_hash=media.access_hash,
+        file_reference=media.file_reference,
+    )
+
+
+async def uncache_media(client, kind: str, digest: str):
+    await history_util.uncache_uploaded_file(
+        await _get_account_id(client), kind, digest
+    )
+
+
+@dataclass
+class _LocalFile:
+    path: Path
+    name: str
+    size: int
+    sha256: str
+    md5: str
+    #: Uploaded instead of the file at `path`, e.g. a resized photo.
+    data: bytes | None = None
+
+
+@dataclass
+class _PartialUpload:
+    file_id: int
+    part_count: int
+    saved_parts: set = field(default_factory=set)
+
+
+@dataclass
+class _PreparedMedia:
+    media: object
+    local: _LocalFile
+    cached_p: bool
+
+
+def _hash_file(path: Path) -> _LocalFile:
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5()
+    size = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_PART_SIZE):
+            sha256.update(chunk)
+            md5.update(chunk)
+            size += len(chunk)
+    return _LocalFile(path, path.name, size, sha256.hexdigest(), md5.hexdigest())
+
+
+def _load_photo(path: Path) -> _LocalFile:
+    """
+    Like `_hash_file`, but pads or shrinks the photo the way `send_file` does
+    (`util._resize_photo_if_needed`), so Telegram accepts its dimensions.
+    """
+    resized = util._resize_photo_if_needed(str(path), True)
+    if not isinstance(resized, io.BytesIO):
+        return _hash_file(path)
+
+    data = resized.getvalue()
+    return _LocalFile(
+        path,
+        f"{path.stem}.jpg",
+        len(data),
+        hashlib.sha256(data).hexdigest(),
+        hashlib.md5(data).hexdigest(),
+        data=data,
+    )
+
+
+def _read_part(local: _LocalFile, index: int) -> bytes:
+    start = index * UPLOAD_PART_SIZE
+    if local.data is not None:
+        return local.data[start : start + UPLOAD_PART_SIZE]
+
+    with open(local.path, "rb") as f:
+        f.seek(start)
+        return f.read(UPLOAD_PART_SIZE)
+
+
+def _format_mb(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+class UploadProgress:
+    """Edits `message` with the upload progress, at most every `interval` seconds."""
+
+    def __init__(
+        self, message, *, total_files, total_bytes, interval=UPLOAD_PROGRESS_INTERVAL
+    ):
+        self.message = message
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.done_files = 0
+        self.done_bytes = 0
+        self.started_at = time.monotonic()
+        self.edited_at = self.started_at
+        self.edit_task = None
+
+    def add_bytes(self, size: int):
+        self.done_bytes += size
+        self._maybe_edit()
+
+    def add_file(self):
+        self.done_files += 1
+        self._maybe_edit()
+
+    def _maybe_edit(self):
+        if self.message is None or self.edit_task is not None:
+            return
+        now = time.monotonic()
+        if now - self.edited_at < self.interval:
+            return
+
+        self.edited_at = now
+        self.edit_task = asyncio.create_task(self._edit(self._text()))
+
+    def _text(self) -> str:
+        elapsed = max(time.monotonic() - self.started_at, 1e-3)
+        return (
+            f"Uploading {self.done_files}/{self.total_files} files: "
+            f"{_format_mb(self.done_bytes)}/{_format_mb(self.total_bytes)} "
+            f"({_format_mb(self.done_bytes / elapsed)}/s)"
+        )
+
+    async def _edit(self, text: str):
+        try:
+            await self.message.edit(text)
+        except Exception as e:
+            print(f"Upload: Could not edit the progress message: {e}")
+        finally:
+            self.edit_task = None
+
+    async def finish(self):
+        if self.message is None:
+            return
+        if self.edit_task is not None:
+            await self.edit_task
+        if self.edited_at == self.started_at:
+            # Nothing was reported, so there is nothing to update.
+            return
+
+        elapsed = time.monotonic() - self.started_at
+        await self._edit(
+            f"Uploaded {self.done_files}/{self.total_files} files "
+            f"({_format_mb(self.done_bytes)}) in {elapsed:.0f}s."
+        )
+
+
+class UploadManager:
+    """
+    Uploads local files to Telegram and sends them, as albums or one by one.
+
+    At most `concurrency` files are uploaded to a chat at a time. Parts are
+    saved individually, so a failed part is retried on its own, and a file
+    whose upload failed resumes from its saved parts when it is sent again.
+    A FloodWait pauses every upload and send of the client until it is over.
+
+    Files already sent by this account (same content and kind) are sent as
+    references to their Telegram media instead of being uploaded again.
+    """
+
+    def __init__(self, client, *, concurrency=UPLOAD_CONCURRENCY):
+        self.client = client
+        self.concurrency = concurrency
+        self.chat_semaphores = defaultdict(lambda: asyncio.Semaphore(concurrency))
+        self.flood_gate = FloodWaitGate()
+        self.partial_uploads = OrderedDict()
+
+    async def _save_part(self, request, *, description: str):
+        for attempt in range(UPLOAD_PART_RETRIES):
+            try:
+                if await self.flood_gate.call(lambda: self.client(request)):
+                    return
+                raise ConnectionError("Telegram did not save the part.")
+            except (
+                ConnectionError,
+                asyncio.TimeoutError,
+                ServerError,
+                TimedOutError,
+            ) as e:
+                if attempt == UPLOAD_PART_RETRIES - 1:
+                    raise
+                delay = UPLOAD_RETRY_DELAY * 2**attempt
+                print(f"Upload: {description} failed ({e!r}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+    async def _upload(self, local: _LocalFile, progress: UploadProgress | None):
+        partial = self.partial_uploads.pop(local.sha256, None)
+        if partial is None:
+            partial = _PartialUpload(
+                file_id=helpers.generate_random_long(),
+                part_count=(local.size + UPLOAD_PART_SIZE - 1) // UPLOAD_PART_SIZE,
+            )
+        big_p = local.size > UPLOAD_BIG_FILE_SIZE
+
+        try:
+            for index in range(partial.part_count):
+                part_size = min(UPLOAD_PART_SIZE, local.size - index * UPLOAD_PART_SIZE)
+                if index not in partial.saved_parts:
+                    part = await asyncio.to_thread(_read_part, local, index)
+                    if big_p:
+                        request = SaveBigFilePartRequest(
+                            partial.file_id, index, partial.part_count, part
+                        )
+                    else:
+                        request = SaveFilePartRequest(partial.file_id, index, part)
+                    await self._save_part(
+                        request,
+                        description=f"Part {index + 1}/{partial.part_count} of {local.name}",
+                    )
+                    partial.saved_parts.add(index)
+                if progress is not None:
+                    progress.add_bytes(part_size)
+        except BaseException:
+            self.partial_uploads[local.sha256] = partial
+            while len(self.partial_uploads) > PARTIAL_UPLOADS_MAX:
+                self.partial_uploads.popitem(last=False)
+            raise
+
+        if big_p:
+            return InputFileBig(partial.file_id, partial.part_count, local.name)
+        return InputFile(partial.file_id, partial.part_count, local.name, local.md5)
+
+    async def _prepare(
+        self,
+        file: OutgoingFile,
+        *,
+        semaphore: asyncio.Semaphore,
+        progress: UploadProgress | None,
+        use_cache=True,
+    ) -> _PreparedMedia:
+        load = _load_photo if file.kind == "photo" else _hash_file
+        local = await asyncio.to_thread(load, file.path)
+        if use_cache:
+            media = await get_cached_media(self.client, file.kind, local.sha256)
+            if media is not None:
+                progress.add_bytes(local.size)
+                return _PreparedMedia(media, local, cached_p=True)
+
+        async with semaphore:
+            handle = await self._upload(local, progress)
+
+        if file.kind == "photo":
+            media = InputMediaUploadedPhoto(handle)
+        else:
+            attributes, mime_type = await asyncio.to_thread(
+                telethon.utils.get_attributes,
+                str(file.path),
+                force_document=file.force_document,
+                voice_note=file.voice_note,
+                video_note=file.video_note,
+                supports_streaming=file.supports_streaming,
+            )
+            media = InputMediaUploadedDocument(
+                handle,
+                mime_type=mime_type,
+                attributes=attributes,
+                force_file=file.force_document,
+            )
+        return _PreparedMedia(media, local, cached_p=False)
+
+    async def _send_prepared(self, chat, group, prepared, **kwargs) -> list:
+        media = [item.media for item in prepared]
+        result = await self.flood_gate.call(
+            lambda: self.client.send_file(
+                chat, media if len(media) > 1 else media[0], **kwargs
+            )
+        )
+        messages = result if isinstance(result, list) else [result]
+        for file, item, message in zip(group, prepared, messages):
+            if not item.cached_p:
+                await cache_sent_media(
+                    self.client, file.kind, item.local.sha256, message
+                )
+        return messages
+
+    async def _send_group(self, chat, group, prepare_tasks, *, prepare, **kwargs):
+        prepared = [await task for task in prepare_tasks]
+        try:
+            return await self._send_prepared(chat, group, prepared, **kwargs)
+        except PhotoExtInvalidError:
+            if len(group) == 1:
+                raise
+            print(f"Album sending failed, using no-album workaround. Files: {group}")
+            messages = []
+            for file in group:
+                item = await prepare(file, retry_p=True)
+                messages += await self._send_prepared(chat, [file], [item], **kwargs)
+            return messages
+        except BadRequestError as e:
+            if not any(item.cached_p for item in prepared):
+                raise
+
+            # The cached media may have expired; upload the files again.
+            print(f"Upload: Could not reuse uploaded files ({e}), uploading again")
+            for file, item in zip(group, prepared):
+                if item.cached_p:
+                    await uncache_media(self.client, file.kind, item.local.sha256)
+            prepared = [await prepare(file, retry_p=True) for file in group]
+            return await self._send_prepared(chat, group, prepared, **kwargs)
+
+    async def send_groups(
+        self, chat, groups, *, status_message=None, on_error=None, **kwargs
+    ) -> list:
+        """
+        Sends each group of `OutgoingFile`s in order, as an album if it has
+        more than one file, while the files of later groups upload.
+
+        If a group fails and `on_error` is given, `await on_error(group)` is
+        called from within the `except` block and the next group is sent;
+        otherwise the error is raised.
+        """
+        groups = [list(group) for group in groups if group]
+        semaphore = self.chat_semaphores[await self.client.get_peer_id(chat)]
+        progress = UploadProgress(
+            status_message,
+            total_files=sum(map(len, groups)),
+            total_bytes=sum(file.path.stat().st_size for g in groups for file in g),
+        )
+
+        def prepare(file, *, retry_p=False):
+            # Retries are not counted again in the progress.
+            return self._prepare(
+                file,
+                semaphore=semaphore,
+                progress=None if retry_p else progress,
+                use_cache=not retry_p,
+            )
+
+        group_tasks = [
+            [asyncio.create_task(prepare(file)) for file in group] for group in groups
+        ]
+        messages = []
+        try:
+            for group, tasks in zip(groups, group_tasks):
+                try:
+                    messages += await self._send_group(
+                        chat, group, tasks, prepare=prepare, **kwargs
+                    )
+                except Exception:
+                    if on_error is None:
+                        raise
+                    traceback.print_exc()
+                    await on_error(group)
+                finally:
+                    for _ in group:
+                        progress.add_file()
+        finally:
+            tasks = list(itertools.chain.from_iterable(group_tasks))
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await progress.finish()
+        return messages
+
+
+def get_upload_manager(client) -> UploadManager:
+    manager = getattr(client, "_upload_manager", None)
+    if manager is None:
+        manager = client._upload_manager = UploadManager(client)
+    return manager
+
+
+def _file_name(file):
+    if isinstance(file, (str, os.PathLike)):
+        return os.path.basename(file)
+    name = getattr(file, "name", None)
+    return os.path.basename(name) if isinstance(name, str) else None
+
+
+async def _content_digest(file):
+    if isinstance(file, (bytes, bytearray)):
+        return hashlib.sha256(file).hexdigest()
+    if isinstance(file, io.BytesIO):
+        with file.getbuffer() as buffer:
+            return hashlib.sha256(buffer).hexdigest()
+    if isinstance(file, (str, os.PathLike)) and os.path.isfile(file):
+        return (await asyncio.to_thread(_hash_file, Path(file))).sha256
+    return None
+
+
+def install_send_file_cache(client):
+    """
+    Patches `client.send_file` so that files (paths, bytes or `BytesIO`s)
+    this account has sent before as the same kind are sent as references
+    to their Telegram media instead of being uploaded again.
+
+    Safe to call more than once.
+    """
+    if getattr(client, "_send_file_cache_installed", False):
+        return
+    client._send_file_cache_installed = True
+    send_file = client.send_file
+
+    async def send_file_cached(entity, file, *args, **kwargs):
+        if args or any(kwargs.get(key) for key in SEND_FILE_UNCACHED_KWARGS):
+            return await send_file(entity, file, *args, **kwargs)
+
+        list_p = telethon.utils.is_list_like(file)
+        files = list(file) if list_p else [file]
+        # `file` may be a generator, which is spent now.
+        original = files if list_p else file
+        flags = {key: kwargs.get(key, False) for key in MEDIA_FLAGS}
+        keys = []
+        for f in files:
+            digest = await _content_digest(f)
+            if digest is None:
+                keys.append(None)
+                continue
+            kind = media_kind(
+                f, name=_file_name(f), attributes=kwargs.get("attributes"), **flags
+            )
+            keys.append((kind, digest))
+        if not any(keys):
+            return await send_file(entity, original, **kwargs)
+
+        cached = [key and await get_cached_media(client, *key) for key in keys]
+        to_send = [media or f for media, f in zip(cached, files)]
+        try:
+            result = await send_file(
+                entity, to_send if list_p else to_send[0], **kwargs
+            )
+        except BadRequestError as e:
+            if not any(cached):
+                raise
+
+            # The cached media may have expired; upload the files again.
+            print(f"Upload: Could not reuse uploaded files ({e}), uploading again")
+            for key, media in zip(keys, cached):
+                if media:
+                    await uncache_media(client, *key)
+            for f in files:
+                if isinstance(f, io.BytesIO):
+                    f.seek(0)
+            cached = [None] * len(files)
+            result = await send_file(entity, original, **kwargs)
+
+        messages = result if isinstance(result, list) else [result]
+        if len(messages) == len(files):
+            for key, media, message in zip(keys, cached, messages):
+                if key and not media:
+                    await cache_sent_media(client, *key, message)
+        return result
+
+    client.send_file = send_file_cached
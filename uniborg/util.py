@@ -13,12 +13,15 @@ import json
 from pydantic import BaseModel, Field
 import litellm
 from brish import z, zp, zs, bsh, Brish
+from uniborg.brish_pool import POOL_TIMEOUT, BrishPool, BrishTimeoutError
 from pynight.common_icecream import ic
 from collections.abc import Iterable
 from IPython.terminal.embed import InteractiveShellEmbed, InteractiveShell
 from IPython.terminal.ipapp import load_default_config
 from aioify import aioify
 import functools
+import multiprocessing
+import hashlib
 from functools import partial
 import uuid
 import asyncio
@@ -35,7 +38,6 @@ from telethon import TelegramClient, events
 import telethon.utils
 from telethon.tl.functions.messages import GetPeerDialogsRequest
 from telethon.tl.types import DocumentAttributeAudio
-from telethon.errors.rpcerrorlist import PhotoExtInvalidError
 from IPython import embed
 import IPython
 import sys
@@ -154,6 +156,8 @@ def _resize_photo_if_needed(
 telethon.client.uploads._resize_photo_if_needed = _resize_photo_if_needed
 ##
 dl_base = os.getcwd() + "/dls/"
+#: How many media files `run_and_get` downloads at once.
+download_concurrency = int(os.environ.get("borg_download_concurrency", 4))
 # pexpect_ai = aioify(obj=pexpect, name='pexpect_ai')
 pexpect_ai = aioify(pexpect)
 # os_aio = aioify(obj=os, name='os_aio')
@@ -185,6 +189,10 @@ adminChats = [
 ]
 ##
 brish_count = int(os.environ.get("borg_brish_count", 16))
+brish_min_count = min(int(os.environ.get("borg_brish_min_count", 2)), brish_count)
+#: Seconds before a brish command is killed, unless its caller sets its own
+#: limit; unset or 0 means no limit.
+brish_timeout = float(os.environ.get("borg_brish_timeout", 0)) or None
 executor = ThreadPoolExecutor(max_workers=(brish_count + 16))
 
 
@@ -215,26 +223,29 @@ async def za(template, *args, bsh=bsh, getframe=1, locals_=None, **kwargs):
     return await future
 
 
-def brish_server_cleanup(brish_server):
-    if brish_server:
-        brish_server.cleanup()
+brish_pool = None
 
 
 def init_brishes():
-    print(f"Initializing {brish_count} brishes ...")
-    global persistent_brish
+    print(f"Initializing {brish_min_count} to {brish_count} brishes ...")
+    global brish_pool
 
-    executor.submit(lambda: brish_server_cleanup(persistent_brish))
+    if brish_pool:
+        executor.submit(brish_pool.cleanup)
 
     boot_cmd = "export JBRISH=y ; unset FORCE_INTERACTIVE"
-    persistent_brish = Brish(boot_cmd=boot_cmd, server_count=brish_count)
-    ##
-    # global brishes
-    # brishes = [Brish(boot_cmd=boot_cmd) for i in range(brish_count)] # range includes 0
-    ##
+    brish_pool = BrishPool(
+        boot_cmd=boot_cmd,
+        min_servers=brish_min_count,
+        max_servers=brish_count,
+        timeout=brish_timeout,
+        executor=executor,
+    )
 
 
-init_brishes()
+# Processes spawned by the bot (e.g., for ebook chunking) have no use for brishes.
+if multiprocessing.parent_process() is None:
+    init_brishes()
 
 
 def restart_brishes():
@@ -450,22 +461,23 @@ async def run_and_get(
         cwd = dl_base + str(uuid.uuid4()) + "/"
     Path(cwd).mkdir(parents=True, exist_ok=True)
     a = borg
-    dled_files = []
+    download_slots = asyncio.Semaphore(download_concurrency)
 
     async def dl(z):
         if z is not None and getattr(z, "file", None) is not None:
             dled_file_name = getattr(z.file, "name", "")
             dled_file_name = dled_file_name or f"some_file_{uuid.uuid4().hex}"
             dled_path = f"{cwd}{z.id}_{dled_file_name}"
-            dled_path = await a.download_media(message=z, file=dled_path)
+            #: Telethon writes the media to `dled_path` chunk by chunk.
+            async with download_slots:
+                dled_path = await a.download_media(message=z, file=dled_path)
             mdate = os.path.getmtime(dled_path)
-            dled_files.append((dled_path, mdate, dled_file_name))
+            return (dled_path, mdate, dled_file_name)
 
     #: Use a dictionary to store unique messages, with message.id as the key.
     todl_map = {event.message.id: event.message}
     inspection_list = [event.message]
     processed_group_ids = set()
-    k = 30
 
     rep_id = event.message.reply_to_msg_id
     if rep_id:
@@ -474,29 +486,30 @@ async def run_and_get(
             todl_map[replied_message.id] = replied_message
             inspection_list.append(replied_message)
 
+    from uniborg import bot_util
+
     for message_to_inspect in inspection_list:
         if message_to_inspect and message_to_inspect.grouped_id:
             group_id = message_to_inspect.grouped_id
             if group_id in processed_group_ids:
                 continue
 
-            search_ids = range(message_to_inspect.id - k, message_to_inspect.id + k)
-            messages_in_vicinity = await a.get_messages(
-                event.chat, ids=list(search_ids)
-            )
-
-            for msg in messages_in_vicinity:
-                if msg and msg.grouped_id == group_id:
-                    #: Add message to the map; duplicates are automatically handled by the key.
-                    todl_map[msg.id] = msg
+            for msg in await bot_util.get_album_messages(
+                a, event.chat_id, message_to_inspect, search_range=30
+            ):
+                #: Add message to the map; duplicates are automatically handled by the key.
+                todl_map[msg.id] = msg
 
             processed_group_ids.add(group_id)
 
     #: Iterate over the values of the dictionary to get the unique Message objects.
     todl_messages = list(todl_map.values())
     todl_messages.sort(key=lambda msg: msg.id)  #: sorts inplace
-    for msg in todl_messages:
-        await dl(msg)
+    dled_files = [
+        dled_file
+        for dled_file in await asyncio.gather(*(dl(msg) for msg in todl_messages))
+        if dled_file
+    ]
 
     # ic(cwd, dled_files)
 
@@ -522,45 +535,50 @@ async def handle_exc_chat(chat, reply_exc=True):
     await borg.send_message(chat, exc)
 
 
-async def send_files(chat, files, **kwargs):
+async def send_files(chat, files, *, status_message=None, **kwargs):
+    #: `status_message` is edited with the upload progress.
+    from uniborg import upload_util
+
+    flags = upload_util.pop_media_flags(kwargs)
     if isinstance(files, str) or not isinstance(files, Iterable):
-        try:
-            await borg.send_file(chat, files, allow_cache=False, **kwargs)
-        except:
-            await handle_exc_chat(chat)
-        return
+        if not isinstance(files, (str, pathlib.PurePath)) or not os.path.isfile(files):
+            try:
+                await borg.send_file(chat, files, **flags, **kwargs)
+            except:
+                await handle_exc_chat(chat)
+            return
+
+        files = [files]
 
     f2ext = lambda p: p.suffix
     files = [Path(f) for f in files]  # idempotent
     files = sorted(files, key=f2ext)
+    groups = []
     for ext, fs in itertools.groupby(files, f2ext):  # groupby assumes sorted
         print(f"Sending files of '{ext}':")
-        async with borg.action(chat, "document") as action:
-            try:
-                fs = list(fs)
-                fs.sort()
-                [print(f) for f in fs]
-                print()
-                # Use no-album workaround for GIFs or when album sending fails
-                use_no_album = ext == ".gif"
-                if not use_no_album:
-                    try:
-                        await borg.send_file(chat, fs, allow_cache=False, **kwargs)
-                    except PhotoExtInvalidError:
-                        print(
-                            f"Album sending failed, using no-album workaround. Files: {fs}"
-                        )
-                        use_no_album = True
+        fs = list(fs)
+        fs.sort()
+        [print(f) for f in fs]
+        print()
+        fs = [upload_util.OutgoingFile(f, **flags) for f in fs]
+        # Use no-album workaround for GIFs
+        if ext == ".gif":
+            groups += [[f] for f in fs]
+        else:
+            groups.append(fs)
 
-                if use_no_album:
-                    for f in fs:
-                        await borg.send_file(chat, f, allow_cache=False, **kwargs)
-            except:
-                await handle_exc_chat(chat)
+    async def on_error(group):
+        await handle_exc_chat(chat)
+
+    async with borg.action(chat, "document"):
+        await upload_util.get_upload_manager(borg).send_groups(
+            chat, groups, status_message=status_message, on_error=on_error, **kwargs
+        )
 
 
 async def run_and_upload(event, to_await, quiet=True, reply_exc=True, album_mode=True):
-    file_add = ""
+    from uniborg import upload_util
+
     cwd = ""
     # util.interact(locals())
     try:
@@ -572,46 +590,32 @@ async def run_and_upload(event, to_await, quiet=True, reply_exc=True, album_mode
         trying_to_dl = await util.discreet_send(
             event, "Julia is processing your request ...", event.message, quiet
         )
+        status_message = None if quiet else trying_to_dl
         cwd = await run_and_get(event=event, to_await=to_await)
         # client = borg
         files = list(Path(cwd).glob("*"))
         if album_mode and len(files) != 1:
             files = [p.absolute() for p in files if not p.is_dir()]
-            await send_files(chat, files)
+            await send_files(chat, files, status_message=status_message)
         else:
             files.sort()
-            for p in files:
-                if (
-                    not p.is_dir()
-                ):  # and not any(s in p.name for s in ('.torrent', '.aria2')):
-                    file_add = p.absolute()
-                    base_name = str(await os_aio.path.basename(file_add))
-                    # trying_to_upload_msg = await util.discreet_send(
-                    # event, "Julia is trying to upload \"" + base_name +
-                    # "\".\nPlease wait ...", trying_to_dl, quiet)
-                    voice_note = base_name.startswith("voicenote-")
-                    video_note = base_name.startswith("videonote-")
-                    force_doc = base_name.startswith("fdoc-")
-                    supports_streaming = base_name.startswith("streaming-")
-                    if False:
-                        att, mime = telethon.utils.get_attributes(file_add)
-                        print(f"File attributes: {att.__dict__}")
-                    async with borg.action(chat, "document") as action:
-                        try:
-                            await borg.send_file(
-                                chat,
-                                file_add,
-                                voice_note=voice_note,
-                                video_note=video_note,
-                                supports_streaming=supports_streaming,
-                                force_document=force_doc,
-                                reply_to=event.message,
-                                allow_cache=False,
-                            )
-                            #                            progress_callback=action.progress)
-                            # caption=base_name)
-                        except:
-                            await handle_exc(event, reply_exc)
+            groups = [
+                [upload_util.OutgoingFile.from_name_prefixes(p.absolute())]
+                for p in files
+                if not p.is_dir()
+            ]  # and not any(s in p.name for s in ('.torrent', '.aria2'))
+
+            async def on_error(group):
+                await handle_exc(event, reply_exc)
+
+            async with borg.action(chat, "document"):
+                await upload_util.get_upload_manager(borg).send_groups(
+                    chat,
+                    groups,
+                    status_message=status_message,
+                    on_error=on_error,
+                    reply_to=event.message,
+                )
     except:
         await handle_exc(event, reply_exc)
     finally:
@@ -856,6 +860,7 @@ async def discreet_send(
                               If bool-like, always/never send as file.
         file_only_threshold: For ALSO_IF_LESS_THAN mode, threshold below which to send both text and file.
         file_name_mode: File naming mode - "random", "timestamp", or "llm".
+            "random" names are derived from a hash of the text.
         title_model (str | None): Optional override of the model used to
             generate a smart filename when file_name_mode == "llm".
         api_keys (dict | None): Optional mapping of service name (e.g., "gemini") to
@@ -1078,6 +1083,7 @@ async def edit_message(
                               If bool-like, always/never send as file.
         file_only_threshold: For ALSO_IF_LESS_THAN mode, threshold below which to send both text and file.
         file_name_mode (str): File naming mode - "random", "timestamp", or "llm".
+            "random" names are derived from a hash of the text.
         title_model (str | None): Optional override of the model used to
             generate a smart filename when file_name_mode == "llm". Defaults to
             constants.CHAT_TITLE_MODEL when not provided.
@@ -1301,7 +1307,6 @@ async def send_text_as_file(
             last_msg = await borg.send_file(
                 chat,
                 f_path,
-                allow_cache=False,
                 **kwargs,
             )
 
@@ -1408,18 +1413,15 @@ async def aget_brishz(event, cmd, fork=True, album_mode=True):
     await util.run_and_upload(event=event, to_await=to_await, album_mode=album_mode)
 
 
-@force_async
-def brishz_helper(myBrish, cwd, cmd, fork=True, server_index=None, **kwargs):
-    lock, server_index = myBrish.acquire_lock(server_index=server_index, lock_sleep=1)
-    try:
+async def brishz_helper(pool, cwd, cmd, fork=True, timeout=POOL_TIMEOUT, **kwargs):
+    def run(myBrish):
         if cwd:
-            myBrish.z("typeset -g jd={cwd}", server_index=server_index, **kwargs)
+            myBrish.z("typeset -g jd={cwd}", **kwargs)
             myBrish.send_cmd(
                 """
             cd "$jd"
             ! ((${+functions[jinit]})) || jinit
             """,
-                server_index=server_index,
                 **kwargs,
             )
 
@@ -1427,27 +1429,26 @@ def brishz_helper(myBrish, cwd, cmd, fork=True, server_index=None, **kwargs):
             '{ eval "$(< /dev/stdin)" } 2>&1',
             fork=fork,
             cmd_stdin=cmd,
-            server_index=server_index,
             **kwargs,
         )
         if cwd:
-            myBrish.z("cd /tmp", server_index=server_index, **kwargs)
+            myBrish.z("cd /tmp", **kwargs)
 
         return res
-    finally:
-        lock.release()
 
+    #: `fork=False` runs in the persistent server, to have a persistent REPL.
+    return await pool.run(run, timeout=timeout, persistent_p=not fork)
 
-async def brishz(event, cwd, cmd, fork=True, shell=True, **kwargs):
-    # print(f"entering brishz with cwd: '{cwd}', cmd: '{cmd}'")
-    res = None
-    server_index = None
-    if fork == False:
-        server_index = 0  # to have a persistent REPL
 
-    res = await brishz_helper(
-        persistent_brish, cwd, cmd, fork=fork, server_index=server_index
-    )
+async def brishz(
+    event, cwd, cmd, fork=True, shell=True, timeout=POOL_TIMEOUT, **kwargs
+):
+    # print(f"entering brishz with cwd: '{cwd}', cmd: '{cmd}'")
+    try:
+        res = await brishz_helper(brish_pool, cwd, cmd, fork=fork, timeout=timeout)
+    except BrishTimeoutError as e:
+        await send_output(event, str(e), retcode=124, shell=shell)
+        return
 
     await send_output(event, res.outerr, retcode=res.retcode, shell=shell)
 
@@ -1514,11 +1515,17 @@ async def async_remove_dir(dir_path: str):
         pass  # Ignore cleanup errors
 
 
-def _generate_random_filename(file_ext: str) -> str:
-    """Generate a random filename with the given extension."""
-    import uuid
+def _content_filename(file_ext: str, text: str) -> str:
+    """
+    Returns a filename with the given extension derived from a hash of `text`.
 
-    return f"message_{uuid.uuid4().hex[:8]}{file_ext}"
+    This is what the "random" `file_name_mode` and the LLM-title fallbacks use.
+    The name used to be random; it is derived from the content only so that
+    it stays the same for the same text, which lets the upload cache reuse
+    an earlier upload.
+    """
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    return f"message_{digest[:8]}{file_ext}"
 
 
 # Define structured output schema using Pydantic
@@ -1555,7 +1562,7 @@ async def _generate_file_data(
         )
 
     if file_name_mode == "random":
-        filename = _generate_random_filename(file_ext)
+        filename = _content_filename(file_ext, text)
         caption = default_caption
 
     elif file_name_mode == "timestamp":
@@ -1583,9 +1590,9 @@ async def _generate_file_data(
 
             if not api_key_to_use:
                 print(
-                    f"Warning: {service_needed} API key not found for user {api_user_id}, falling back to random filename"
+                    f"Warning: {service_needed} API key not found for user {api_user_id}, falling back to a content-derived filename"
                 )
-                filename = _generate_random_filename(file_ext)
+                filename = _content_filename(file_ext, text)
                 caption = default_caption
             else:
                 # Set up LiteLLM with the API key
@@ -1626,12 +1633,12 @@ async def _generate_file_data(
         except Exception as e:
             print(f"Warning: Failed to generate LLM title: {e}")
             traceback.print_exc()
-            filename = _generate_random_filename(file_ext)
+            filename = _content_filename(file_ext, text)
             caption = f"{default_caption}\n\n(Failed to generate a title.)"
             #: do not put the error in the caption as normal users might see it.
 
     else:
-        filename = _generate_random_filename(file_ext)
+        filename = _content_filename(file_ext, text)
         caption = default_caption
 
     return FileGeneration(filename=filename, caption=caption, extension=file_ext)